@@ -19,7 +19,6 @@
 from shopkit.core.utils import get_model_from_string
 
 from shopkit.category.settings import CATEGORY_MODEL
-category_class = get_model_from_string(CATEGORY_MODEL)
 
 
 def main_categories(request):
@@ -27,4 +26,6 @@ def main_categories(request):
     Return the main categories, from which it is easy to
     render a hierarchical category structure. 
     """
+    category_class = get_model_from_string(CATEGORY_MODEL)
+
     return {'main_categories': category_class.get_main_categories()}
@@ -22,7 +22,6 @@ logger = logging.getLogger(__name__)
 from shopkit.core.utils import get_model_from_string
 
 from shopkit.category.settings import CATEGORY_MODEL
-category_class = get_model_from_string(CATEGORY_MODEL)
 
 
 """ Mixins relevant for shops with categories. """
@@ -37,6 +36,8 @@ class CategoriesMixin(object):
 
         context = super(CategoriesMixin, self).get_context_data(**kwargs)
         
+        category_class = get_model_from_string(CATEGORY_MODEL)
+
         context.update({'categories': category_class.get_categories()})
         
         return context
@@ -20,9 +20,13 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+import datetime
+import hashlib
+
 from decimal import Decimal
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import ugettext_lazy as _
@@ -31,7 +35,7 @@ from django.db import models
 from shopkit.core.settings import (
     PRODUCT_MODEL, CART_MODEL, CARTITEM_MODEL, ORDER_MODEL,
     ORDERITEM_MODEL, CUSTOMER_MODEL, ORDERSTATE_CHANGE_MODEL, ORDER_STATES,
-    DEFAULT_ORDER_STATE
+    DEFAULT_ORDER_STATE, QUOTE_CACHE_TIMEOUT
 )
 
 from shopkit.core import signals
@@ -41,9 +45,12 @@ from shopkit.core.basemodels import (
 )
 
 from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils.cache import make_key, get_version
 
 from shopkit.core.exceptions import AlreadyConfirmedException
 
+from shopkit.currency.money import round_decimal
+
 # Get the currently configured currency field, whatever it is
 from shopkit.currency.utils import get_currency_field
 PriceField = get_currency_field()
@@ -110,12 +117,8 @@ class CartItemBase(AbstractPricedItemBase, QuantizedItemBase):
     def get_total_price(self, **kwargs):
         """ Gets the tatal price for the items in the cart. """
 
-        piece_price = self.get_piece_price(**kwargs)
-        assert isinstance(piece_price, Decimal)
-
-        price = self.quantity*piece_price
-
-        return price
+        # Round the product of the unrounded piece price and the quantity
+        return round_decimal(self.get_piece_price(**kwargs)*self.quantity)
 
     def get_piece_price(self, **kwargs):
         """ Gets the price per piece for a given quantity of items. """
@@ -300,9 +303,8 @@ class CartBase(AbstractPricedItemBase):
 
         logger.debug(u'Calculating total price for shopping cart.')
 
-        # logger.debug(self.get_items()[0].get_total_price())
-
-        price = Decimal("0.0")
+        # Item totals are rounded already, so their sum is exact
+        price = Decimal('0.00')
 
         for cartitem in self.get_items():
             item_price = cartitem.get_total_price(**kwargs)
@@ -310,12 +312,87 @@ class CartBase(AbstractPricedItemBase):
                 u'Adding price %f for item \'%s\' to total cart price.',
                 item_price, cartitem
             )
-            assert isinstance(item_price, Decimal)
 
             price += item_price
 
         return price
 
+    def get_fingerprint_fields(self):
+        """
+        Return the names of the cart item fields making up the contents of
+        the cart: all fields except for the primary key and the cart. This
+        includes the product, the quantity and, ie., a variation.
+        """
+        cartitem_class = get_model_from_string(CARTITEM_MODEL)
+
+        fields = []
+        for field in cartitem_class._meta.fields:
+            if not field.primary_key and field.name != 'cart':
+                fields.append(field.name)
+
+        return fields
+
+    def get_fingerprint_parts(self):
+        """
+        Return a list with everything the price of this cart depends on:
+        the cart, the contents of its items, the version of the prices and
+        the current date, as prices and discounts might only be valid
+        within a period. Subclasses can extend this, ie. with a coupon code
+        or country.
+        """
+        items = self.get_items().order_by('pk')
+        lines = list(items.values_list(*self.get_fingerprint_fields()))
+
+        return [self.pk, lines, get_version('prices'), datetime.date.today()]
+
+    def get_fingerprint(self):
+        """
+        Return a hash of `get_fingerprint_parts()`. As the contents are read
+        from the database, adding, updating or removing items results in a
+        different fingerprint.
+        """
+        data = repr(self.get_fingerprint_parts())
+
+        return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+    def get_quote_data(self):
+        """
+        Compute a dictionary with the totals and breakdowns for this cart.
+        The values should be picklable. Subclasses can extend this, ie.
+        with shipping costs or discounts.
+        """
+        items = []
+        for cartitem in self.get_items().order_by('pk'):
+            items.append((cartitem.pk, cartitem.get_price()))
+
+        return {'price': self.get_price(), 'items': items}
+
+    def get_quote(self):
+        """
+        Return the dictionary from `get_quote_data()`, which is kept in
+        Django's cache under the fingerprint of this cart. As long as
+        the cart and the data it depends on remain unchanged, rendering
+        the cart again does not recompute prices, shipping or discounts.
+
+        Use it in templates rendering the cart from the `cart` context
+        processor, ie. `{{ cart.get_quote.price }}`.
+        """
+        if not self.pk:
+            return self.get_quote_data()
+
+        key = make_key('quote', self.get_fingerprint())
+
+        data = cache.get(key)
+
+        if data is None:
+            logger.debug(u'Computing quote for cart %s', self)
+
+            data = self.get_quote_data()
+
+            cache.set(key, data, QUOTE_CACHE_TIMEOUT)
+
+        return data
+
     def get_order_line(self):
         """
         Get a string representation of this `OrderItem` for use in list views.
@@ -395,12 +472,8 @@ class OrderItemBase(AbstractPricedItemBase, QuantizedItemBase):
     def get_total_price(self, **kwargs):
         """ Gets the tatal price for the items in the cart. """
 
-        piece_price = self.get_piece_price(**kwargs)
-        assert isinstance(piece_price, Decimal)
-
-        price = self.quantity*piece_price
-
-        return price
+        # Round the product of the unrounded piece price and the quantity
+        return round_decimal(self.get_piece_price(**kwargs)*self.quantity)
 
     def get_piece_price(self, **kwargs):
         """ Gets the price per piece for a given quantity of items. """
@@ -690,9 +763,8 @@ class OrderBase(AbstractPricedItemBase, DatedItemBase):
 
         logger.debug(u'Calculating total price for order.')
 
-        # logger.debug(self.get_items()[0].get_total_price())
-
-        price = Decimal("0.0")
+        # Item totals are rounded already, so their sum is exact
+        price = Decimal('0.00')
 
         for orderitem in self.get_items():
             item_price = orderitem.get_total_price(**kwargs)
@@ -700,7 +772,6 @@ class OrderBase(AbstractPricedItemBase, DatedItemBase):
                 u'Adding price %f for item \'%s\' to total price.',
                 item_price, orderitem
             )
-            assert isinstance(item_price, Decimal)
             price += item_price
 
         return price
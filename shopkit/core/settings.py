@@ -65,4 +65,16 @@ ORDERITEM_MODEL = getattr(settings, 'SHOPKIT_ORDERITEM_MODEL')
 MAX_NAME_LENGTH = getattr(settings, 'SHOPKIT_MAX_NAME_LENGTH', 255)
 """ (Optional) The maximum name length for named products in the webshop. 
     This defaults to 255.
-"""
\ No newline at end of file
+"""
+
+CACHE_PREFIX = getattr(settings, 'SHOPKIT_CACHE_PREFIX', 'shopkit')
+"""
+(Optional) Prefix used for keys stored by django-shopkit in Django's cache
+framework. This defaults to `shopkit`.
+"""
+
+QUOTE_CACHE_TIMEOUT = getattr(settings, 'SHOPKIT_QUOTE_CACHE_TIMEOUT', 60*30)
+"""
+(Optional) Number of seconds computed cart quotes are kept in Django's
+cache. This defaults to 30 minutes.
+"""
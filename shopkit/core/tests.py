@@ -16,6 +16,9 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import subprocess
+import sys
+
 from django.conf import settings
 
 from shopkit.core.utils import get_model_from_string
@@ -101,3 +104,81 @@ class CoreTestMixin(object):
         Change the state of an order, see if the state change gets logged.
         """
         pass
+
+
+IMPORT_TIME_SCRIPT = """
+import time
+start = time.time()
+for name in %r:
+    __import__(name)
+middle = time.time()
+for name in %r:
+    __import__(name)
+print('%%f %%f' %% (middle - start, time.time() - middle))
+"""
+
+
+class ImportTimeTestMixin(object):
+    """
+    Base class for measuring the time it takes to import shopkit's modules
+    in a fresh interpreter, such that regressions in startup time are
+    noticed. Subclasses should set `import_modules` to the modules used
+    by the project and might adjust `max_import_ratio`.
+
+    Rather than an absolute time, which depends on the machine and its
+    load, the time is compared with that of importing `baseline_modules`
+    beforehand in the same interpreter.
+    """
+
+    import_modules = ('shopkit.core.models', )
+    """ Modules imported in the benchmark. """
+
+    baseline_modules = ('django.db.models', 'django.contrib.auth.models')
+    """ Modules of which the import time serves as a baseline. """
+
+    max_import_ratio = 1.0
+    """
+    Maximal time importing `import_modules` might take, relative to the
+    time of importing `baseline_modules`.
+    """
+
+    import_runs = 3
+    """ Number of measurements, of which the fastest counts. """
+
+    def get_import_times(self):
+        """
+        Return a tuple with the number of seconds it takes to import
+        `baseline_modules` and, subsequently, `import_modules` in a new
+        interpreter using the current settings.
+        """
+
+        script = IMPORT_TIME_SCRIPT % (tuple(self.baseline_modules),
+                                       tuple(self.import_modules))
+
+        # The environment, including DJANGO_SETTINGS_MODULE, is inherited
+        process = subprocess.Popen([sys.executable, '-c', script],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        (output, errors) = process.communicate()
+
+        if process.returncode:
+            self.fail('Importing %s failed:\n%s' % \
+                      (', '.join(self.import_modules), errors))
+
+        (baseline, import_time) = output.split()
+
+        return (float(baseline), float(import_time))
+
+    def test_import_time(self):
+        """ Test whether importing shopkit stays within budget. """
+
+        times = [self.get_import_times() for run in range(self.import_runs)]
+
+        baseline = min([baseline for (baseline, import_time) in times])
+        import_time = min([import_time for (baseline, import_time) in times])
+
+        self.assertTrue(import_time <= baseline * self.max_import_ratio,
+            'Importing %s took %.3fs, more than %.1f times %.3fs for %s' % \
+            (', '.join(self.import_modules), import_time,
+             self.max_import_ratio, baseline,
+             ', '.join(self.baseline_modules)))
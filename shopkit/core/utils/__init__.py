@@ -39,4 +39,62 @@ def get_model_from_string(model):
     assert isinstance(model_class, models.base.ModelBase), \
         '%s does not refer to a known Model class.' % model
 
-    return model_class
\ No newline at end of file
+    return model_class
+
+
+class LazyModel(object):
+    """
+    Descriptor resolving a model from a string in the form of
+    `appname.Model` on first access rather than upon import, ie. for the
+    `model` of admin inlines::
+
+        class ProductImageInline(admin.TabularInline):
+            model = LazyModel(PRODUCTIMAGE_MODEL)
+
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.model_class = None
+
+    def __get__(self, instance, owner):
+        if self.model_class is None:
+            self.model_class = get_model_from_string(self.model)
+
+        return self.model_class
+
+def implements_predicates(cls, query_name, predicate_name):
+    """
+    Return whether every class in the MRO of `cls` which defines the
+    queryset method `query_name` also defines the instance predicate
+    `predicate_name`, such that the predicates cover all filters.
+    """
+    for klass in cls.__mro__:
+        if query_name in vars(klass) and not predicate_name in vars(klass):
+            logger.debug(u'%s defines %s but not %s',
+                         klass, query_name, predicate_name)
+
+            return False
+
+    return True
+
+
+def get_pks(objects):
+    """
+    Return a set with primary keys for `objects`, which can be a single
+    model instance or primary key, a `QuerySet` or an iterable of model
+    instances and/or primary keys.
+    """
+    if isinstance(objects, models.query.QuerySet):
+        return set(objects.values_list('pk', flat=True))
+
+    if hasattr(objects, 'pk'):
+        return set([objects.pk])
+
+    try:
+        objects = iter(objects)
+    except TypeError:
+        # A single primary key
+        return set([objects])
+
+    return set([getattr(obj, 'pk', obj) for obj in objects])
@@ -0,0 +1,203 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Utilities for versioned caching in Django's cache framework.
+
+Cached values which depend on database contents (ie. the set of currently
+valid discounts) are stored under keys containing a version number for the
+data they depend on. Invalidation then simply means bumping this version,
+after which the stale entries are never read again and eventually expire.
+
+Models bump their version when saving or deleting instances. As bulk
+operations on querysets bypass `save()` and `delete()`, models should use
+a :class:`VersionedManager`, of which the querysets bump the version upon
+`update()` and `delete()` as well. Changes made otherwise, ie. with
+`bulk_create` or raw SQL, require an explicit call to `bump_version`.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import threading
+
+from django.core.cache import cache
+from django.db import models
+from django.db.models.query import QuerySet
+
+from shopkit.core.settings import CACHE_PREFIX
+
+
+_local_versions = {}
+""" Versions kept in this process for caches which do not store values. """
+
+
+def make_key(name, *parts):
+    """
+    Make a cache key for `name`, consisting of `CACHE_PREFIX`, the name
+    and the string representations of any further `parts`.
+    """
+    return u':'.join([CACHE_PREFIX, name] + [unicode(part) for part in parts])
+
+
+def get_version(name):
+    """
+    Return the current version number for the data referred to by `name`.
+
+    New versions are initialised with the current timestamp rather than
+    a fixed number, so that a version which has been evicted from the
+    cache never reverts to a value that has been used before.
+    """
+    key = make_key('version', name)
+
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, int(time.time()))
+
+        # Another process might have been ahead of us
+        version = cache.get(key)
+
+    if version is None:
+        # The cache does not store values (ie. `DummyCache`), fall back to
+        # a constant version which is only bumped within this process
+        version = _local_versions.setdefault(name, 0)
+
+    return version
+
+
+def bump_version(name):
+    """
+    Invalidate all cached values depending on the data referred to by
+    `name` by increasing its version number.
+    """
+    key = make_key('version', name)
+
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        # Key is not currently in the cache, (re)initialise it
+        version = get_version(name)
+
+        if name in _local_versions:
+            _local_versions[name] += 1
+            version = _local_versions[name]
+
+    logger.debug(u'Cache version for %s bumped to %s', name, version)
+
+    return version
+
+
+class VersionedCache(object):
+    """
+    Process-local cache for a value computed by `loader`, ie. a compiled
+    lookup table. The value is computed on first use and recomputed only
+    after the version for `name` has been bumped, so every process picks up
+    changes without having to query the database on every access.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+
+        self._lock = threading.Lock()
+        self._data = (None, None)
+
+    def get(self):
+        """ Return the current value, (re)loading it when out of date. """
+        version = get_version(self.name)
+
+        (cached_version, value) = self._data
+        if cached_version != version:
+            with self._lock:
+                (cached_version, value) = self._data
+
+                if cached_version != version:
+                    logger.debug(u'Loading %s for version %s',
+                                 self.name, version)
+
+                    value = self.loader()
+                    self._data = (version, value)
+
+        return value
+
+    def clear(self):
+        """ Discard the value cached in this process. """
+        self._data = (None, None)
+
+
+class VersionedQuerySet(QuerySet):
+    """
+    `QuerySet` bumping the version for `version_name` after bulk updates
+    and deletions.
+    """
+
+    version_name = None
+
+    def _clone(self, *args, **kwargs):
+        clone = super(VersionedQuerySet, self)._clone(*args, **kwargs)
+        clone.version_name = self.version_name
+
+        return clone
+
+    def update(self, **kwargs):
+        """ Update the objects and bump the version. """
+        rows = super(VersionedQuerySet, self).update(**kwargs)
+
+        bump_version(self.version_name)
+
+        return rows
+    update.alters_data = True
+
+    def delete(self):
+        """ Delete the objects and bump the version. """
+        super(VersionedQuerySet, self).delete()
+
+        bump_version(self.version_name)
+    delete.alters_data = True
+
+
+class VersionedManager(models.Manager):
+    """
+    Manager for models of which cached data is versioned as `version_name`,
+    such that bulk changes through its querysets (ie. admin actions)
+    invalidate the cache as well. Subclass it for every version name::
+
+        class DiscountManager(VersionedManager):
+            version_name = 'discounts'
+
+        class Discount(...):
+            objects = DiscountManager()
+
+    As Django derives related managers from the class of the default
+    manager and instantiates them without arguments, the version name is a
+    class attribute rather than an argument.
+    """
+
+    version_name = None
+    """ Name of the version bumped by bulk changes. """
+
+    def get_query_set(self):
+        assert self.version_name, \
+            'Subclasses of VersionedManager should specify a version_name.'
+
+        qs = VersionedQuerySet(self.model, using=self._db)
+        qs.version_name = self.version_name
+
+        return qs
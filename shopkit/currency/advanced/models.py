@@ -16,3 +16,142 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+
+import logging
+logger = logging.getLogger(__name__)
+
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from shopkit.core.utils.cache import bump_version, VersionedManager
+
+from shopkit.currency.settings import CURRENCY_CODE
+from shopkit.currency.advanced.rates import \
+    get_rate_snapshot, convert_amount, convert_amounts
+
+
+class ExchangeRateManager(VersionedManager):
+    """
+    Manager for exchange rates, bumping the `exchange_rates` version upon
+    bulk changes.
+    """
+
+    version_name = 'exchange_rates'
+
+
+class ExchangeRateBase(models.Model):
+    """
+    Base class for exchange rates from the default currency to other
+    currencies. Saving or deleting a rate refreshes the cached
+    :class:`RateSnapshot <shopkit.currency.advanced.rates.RateSnapshot>`
+    in all processes.
+    """
+
+    class Meta:
+        abstract = True
+        verbose_name = _('exchange rate')
+        verbose_name_plural = _('exchange rates')
+
+    objects = ExchangeRateManager()
+    """ Manager invalidating cached data upon bulk changes as well. """
+
+    currency = models.CharField(max_length=3, unique=True,
+                                verbose_name=_('currency'),
+                                help_text=_('ISO 4217 currency code.'))
+    """ ISO 4217 code of the currency this rate converts to. """
+
+    rate = models.DecimalField(max_digits=16, decimal_places=8,
+                               verbose_name=_('rate'))
+    """ Amount in this currency for one unit of the default currency. """
+
+    date_modified = models.DateTimeField(auto_now=True,
+                                         verbose_name=_('modified'))
+    """ Date and time this rate was last updated. """
+
+    def __unicode__(self):
+        return u'%s %s' % (self.rate, self.currency)
+
+    def save(self, *args, **kwargs):
+        """ Invalidate cached exchange rates upon saving. """
+        self.currency = self.currency.upper()
+
+        super(ExchangeRateBase, self).save(*args, **kwargs)
+
+        bump_version('exchange_rates')
+
+    def delete(self, *args, **kwargs):
+        """ Invalidate cached exchange rates upon deletion. """
+        super(ExchangeRateBase, self).delete(*args, **kwargs)
+
+        bump_version('exchange_rates')
+
+
+class ExchangeRateOrderMixin(models.Model):
+    """
+    Mixin for orders placed in another currency than the default. The
+    exchange rate is stored on the order upon confirmation, so that
+    converted amounts can be reproduced after rates have changed.
+    """
+
+    class Meta:
+        abstract = True
+
+    currency = models.CharField(max_length=3, blank=True,
+                                default=CURRENCY_CODE or '',
+                                verbose_name=_('currency'))
+    """ ISO 4217 code of the currency this order is placed in. """
+
+    exchange_rate = models.DecimalField(max_digits=16, decimal_places=8,
+                                        blank=True, null=True,
+                                        verbose_name=_('exchange rate'))
+    """ Exchange rate from the default currency at confirmation. """
+
+    def update_exchange_rate(self):
+        """
+        Store the current exchange rate for the currency of this order.
+        The order itself is not saved.
+        """
+        if self.currency:
+            self.exchange_rate = get_rate_snapshot().get_rate(self.currency)
+        else:
+            self.exchange_rate = None
+
+        logger.debug(u'Updating exchange rate for %s to %s %s',
+                     self, self.exchange_rate, self.currency)
+
+    def get_exchange_rate(self):
+        """
+        Return the stored exchange rate, or the current one for orders
+        which have not been confirmed yet.
+        """
+        if self.exchange_rate is None and self.currency:
+            return get_rate_snapshot().get_rate(self.currency)
+
+        return self.exchange_rate
+
+    def convert_price(self, amount):
+        """ Convert `amount` into the currency of this order. """
+        rate = self.get_exchange_rate()
+
+        if rate is None:
+            return amount
+
+        return convert_amount(amount, rate, self.currency)
+
+    def convert_prices(self, amounts):
+        """
+        Convert a list of `amounts`, ie. the prices of all order items, into
+        the currency of this order.
+        """
+        rate = self.get_exchange_rate()
+
+        if rate is None:
+            return list(amounts)
+
+        return convert_amounts(amounts, rate, self.currency)
+
+    def confirm(self):
+        """ Store the exchange rate before confirming the order. """
+        self.update_exchange_rate()
+
+        super(ExchangeRateOrderMixin, self).confirm()
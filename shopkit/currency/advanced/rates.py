@@ -0,0 +1,177 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Conversion of prices into other currencies.
+
+Exchange rates are read from the `EXCHANGE_RATE_MODEL` table into a
+:class:`RateSnapshot`, which is cached in every process and reloaded only
+when rates have been saved or deleted. Converting a list of prices thus
+requires no queries, and the rate for a currency is looked up only once
+per list.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from decimal import Decimal
+
+from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils.cache import VersionedCache
+
+from shopkit.currency.money import Money
+from shopkit.currency.settings import \
+    CURRENCY_CODE, CURRENCY_DECIMALS, CURRENCY_ROUNDING
+from shopkit.currency.advanced.settings import \
+    EXCHANGE_RATE_MODEL, CURRENCY_ROUNDING_RULES
+
+
+class UnknownCurrencyError(KeyError):
+    """ Raised when no exchange rate is available for a currency. """
+    pass
+
+
+def get_rounding(currency):
+    """
+    Return an `(increment, rounding)` tuple for rounding amounts in
+    `currency`, according to `CURRENCY_ROUNDING_RULES`.
+    """
+    rule = CURRENCY_ROUNDING_RULES.get(currency, {})
+
+    increment = Decimal(rule.get('increment', Decimal(1).scaleb(-CURRENCY_DECIMALS)))
+    rounding = rule.get('rounding', CURRENCY_ROUNDING)
+
+    return (increment, rounding)
+
+
+def round_amount(amount, currency):
+    """ Round a `Decimal` `amount` according to the rules for `currency`. """
+    (increment, rounding) = get_rounding(currency)
+
+    steps = (amount / increment).quantize(Decimal(1), rounding=rounding)
+
+    return (steps * increment).quantize(increment)
+
+
+def convert_amount(amount, rate, currency):
+    """
+    Convert `amount`, a `Decimal` or :class:`Money
+    <shopkit.currency.money.Money>` in the default currency, using `rate`
+    and round it for `currency`. Returns a `Decimal`.
+    """
+    if isinstance(amount, Money):
+        amount = amount.to_decimal()
+
+    return round_amount(amount * rate, currency)
+
+
+def convert_amounts(amounts, rate, currency):
+    """
+    Convert an iterable of `amounts` using `rate` and round them for
+    `currency`, returning a list. `None` values are passed through.
+    """
+    (increment, rounding) = get_rounding(currency)
+
+    converted = []
+    for amount in amounts:
+        if amount is None:
+            converted.append(None)
+            continue
+
+        if isinstance(amount, Money):
+            amount = amount.to_decimal()
+
+        steps = (amount * rate / increment).quantize(Decimal(1),
+                                                     rounding=rounding)
+        converted.append((steps * increment).quantize(increment))
+
+    return converted
+
+
+class RateSnapshot(object):
+    """
+    Immutable set of exchange rates from the default currency, compiled
+    from an iterable of `(currency, rate)` tuples.
+    """
+
+    def __init__(self, rates):
+        self.rates = dict(rates)
+
+        # Converting to the default currency only applies rounding
+        if CURRENCY_CODE:
+            self.rates.setdefault(CURRENCY_CODE, Decimal(1))
+
+        logger.debug(u'Compiled exchange rate snapshot for %d currencies',
+                     len(self.rates))
+
+    def get_currencies(self):
+        """ Return a sorted list of the available currency codes. """
+        return sorted(self.rates.keys())
+
+    def get_rate(self, currency):
+        """
+        Return the exchange rate for `currency`.
+
+        :raises: UnknownCurrencyError
+        """
+        try:
+            return self.rates[currency]
+        except KeyError:
+            raise UnknownCurrencyError(currency)
+
+    def convert(self, amount, currency):
+        """ Convert a single `amount` into `currency`. """
+        return convert_amount(amount, self.get_rate(currency), currency)
+
+    def convert_many(self, amounts, currency):
+        """ Convert an iterable of `amounts` into `currency`. """
+        return convert_amounts(amounts, self.get_rate(currency), currency)
+
+
+def _load_snapshot():
+    """ Read all exchange rates from the database. """
+    assert EXCHANGE_RATE_MODEL, \
+        'SHOPKIT_CURRENCY_EXCHANGE_RATE_MODEL should be set to convert prices.'
+
+    rate_class = get_model_from_string(EXCHANGE_RATE_MODEL)
+
+    return RateSnapshot(rate_class.objects.values_list('currency', 'rate'))
+
+
+_snapshot = VersionedCache('exchange_rates', _load_snapshot)
+
+
+def get_rate_snapshot():
+    """
+    Return the current :class:`RateSnapshot`, reloading it when exchange
+    rates have changed.
+    """
+    return _snapshot.get()
+
+
+def convert_price(amount, currency):
+    """ Convert `amount` into `currency` using the current rates. """
+    return get_rate_snapshot().convert(amount, currency)
+
+
+def convert_prices(amounts, currency):
+    """
+    Convert a list of `amounts`, ie. the prices on a catalog page or the
+    items in a cart, into `currency` using the current rates.
+    """
+    return get_rate_snapshot().convert_many(amounts, currency)
@@ -16,3 +16,27 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+from django.conf import settings
+
+
+EXCHANGE_RATE_MODEL = getattr(settings, 'SHOPKIT_CURRENCY_EXCHANGE_RATE_MODEL', None)
+"""
+Model holding the exchange rates from the default currency
+(`SHOPKIT_CURRENCY_CODE`) to other currencies. Should be a subclass of
+:class:`ExchangeRateBase <shopkit.currency.advanced.models.ExchangeRateBase>`.
+"""
+
+CURRENCY_ROUNDING_RULES = getattr(settings, 'SHOPKIT_CURRENCY_ROUNDING_RULES', {})
+"""
+Rounding rules for converted amounts per ISO 4217 currency code, as a
+dictionary with an `increment` to which amounts are rounded and an
+optional `rounding` mode from the :mod:`decimal` module. Currencies
+without rules are rounded to `SHOPKIT_CURRENCY_DECIMALS` decimals.
+
+For example::
+
+    SHOPKIT_CURRENCY_ROUNDING_RULES = {
+        'JPY': {'increment': '1'},
+        'CHF': {'increment': '0.05', 'rounding': 'ROUND_HALF_UP'},
+    }
+"""
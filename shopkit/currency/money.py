@@ -0,0 +1,252 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Integer based monetary amounts.
+
+Prices are stored as `Decimal` in :class:`PriceField` columns and price
+calculations are performed on `Decimal`, rounding to minor units once per
+result with :func:`round_decimal` or :func:`sum_decimals`. Converting each
+amount to integers and back would cost more than it saves.
+
+:class:`Money` represents an amount as an integer number of minor currency
+units (ie. cents) and a currency code, for code working with minor units,
+ie. formatting, currency conversion or the discount solver. Rounding only
+happens when converting from `Decimal` and when multiplying by non-integer
+factors, ie. percentages, using `CURRENCY_ROUNDING`. Addition, subtraction
+and integer multiplication are exact.
+"""
+
+from decimal import Decimal
+
+from shopkit.currency.settings import \
+    CURRENCY_CODE, CURRENCY_DECIMALS, CURRENCY_ROUNDING
+
+
+ONE = Decimal('1')
+
+SCALE = Decimal(10) ** CURRENCY_DECIMALS
+""" Factor converting major to minor units. """
+
+EXPONENT = ONE.scaleb(-CURRENCY_DECIMALS)
+""" Exponent of amounts rounded to minor units. """
+
+_setattr = object.__setattr__
+
+
+def round_minor(value, rounding=CURRENCY_ROUNDING):
+    """ Round a `Decimal` number of minor units to an integer. """
+    return int(value.quantize(ONE, rounding=rounding))
+
+
+def round_decimal(amount, rounding=CURRENCY_ROUNDING):
+    """ Round a `Decimal` `amount` in major units to minor units. """
+    return amount.quantize(EXPONENT, rounding=rounding)
+
+
+class Money(object):
+    """
+    Immutable monetary amount of `minor` currency units in `currency`.
+    Amounts without a currency can be combined with amounts in any
+    currency; combining amounts in different currencies raises a
+    `ValueError`.
+    """
+
+    __slots__ = ('minor', 'currency')
+
+    def __init__(self, minor=0, currency=CURRENCY_CODE):
+        _setattr(self, 'minor', int(minor))
+        _setattr(self, 'currency', currency)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Money objects are immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('Money objects are immutable.')
+
+    def __reduce__(self):
+        return (Money, (self.minor, self.currency))
+
+    @classmethod
+    def from_decimal(cls, amount, currency=CURRENCY_CODE,
+                     decimals=CURRENCY_DECIMALS):
+        """
+        Create an amount from a `Decimal` (or integer) `amount` in major
+        units, rounding to minor units.
+        """
+        if amount.__class__ is not Decimal:
+            if amount is None:
+                amount = 0
+
+            if isinstance(amount, Money):
+                return amount
+
+            amount = Decimal(amount)
+
+        if decimals == CURRENCY_DECIMALS:
+            scaled = amount * SCALE
+        else:
+            scaled = amount.scaleb(decimals)
+
+        # Amounts with no more than `decimals` decimals need no rounding
+        minor = int(scaled)
+        if minor != scaled:
+            minor = int(scaled.quantize(ONE, rounding=CURRENCY_ROUNDING))
+
+        return _make(minor, currency)
+
+    def to_decimal(self, decimals=CURRENCY_DECIMALS):
+        """ Return this amount in major units as a `Decimal`. """
+        return Decimal(self.minor).scaleb(-decimals)
+
+    def _get_currency(self, other):
+        """
+        Return the currency for combining this amount with `other`, which
+        might also be an integer 0.
+        """
+        if not isinstance(other, Money):
+            if other == 0:
+                return self.currency
+
+            raise TypeError('Cannot combine Money with %r' % other)
+
+        if self.currency is None:
+            return other.currency
+
+        if other.currency is None or other.currency == self.currency:
+            return self.currency
+
+        raise ValueError('Cannot combine amounts in %s and %s' % \
+                         (self.currency, other.currency))
+
+    def _get_minor(self, other):
+        if isinstance(other, Money):
+            return other.minor
+
+        return 0
+
+    def __add__(self, other):
+        # Fast path for the common case of amounts in the same currency
+        if other.__class__ is Money and other.currency == self.currency:
+            return _make(self.minor + other.minor, self.currency)
+
+        currency = self._get_currency(other)
+
+        return Money(self.minor + self._get_minor(other), currency)
+
+    # Allows for sum() over amounts
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        currency = self._get_currency(other)
+
+        return Money(self.minor - self._get_minor(other), currency)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __neg__(self):
+        return Money(-self.minor, self.currency)
+
+    def __abs__(self):
+        return Money(abs(self.minor), self.currency)
+
+    def __mul__(self, factor):
+        """
+        Multiply by an integer exactly, or by a `Decimal` factor rounding
+        the result to minor units.
+        """
+        if isinstance(factor, Money):
+            raise TypeError('Cannot multiply amounts of money.')
+
+        if isinstance(factor, (int, long)):
+            return Money(self.minor * factor, self.currency)
+
+        return Money(round_minor(self.minor * Decimal(factor)), self.currency)
+
+    __rmul__ = __mul__
+
+    def percentage(self, percentage):
+        """ Return `percentage` percent of this amount, rounded. """
+        return Money(round_minor(self.minor * Decimal(percentage) / 100),
+                     self.currency)
+
+    def _compare(self, other):
+        self._get_currency(other)
+
+        return self.minor - self._get_minor(other)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money) and other != 0:
+            return False
+
+        try:
+            return self._compare(other) == 0
+        except ValueError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self._compare(other) < 0
+
+    def __le__(self, other):
+        return self._compare(other) <= 0
+
+    def __gt__(self, other):
+        return self._compare(other) > 0
+
+    def __ge__(self, other):
+        return self._compare(other) >= 0
+
+    def __hash__(self):
+        # Equal amounts might differ in currency, ie. when one of them has
+        # none, and `Money(0)` equals 0
+        return hash(self.minor)
+
+    def __nonzero__(self):
+        return self.minor != 0
+
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return 'Money(%d, %r)' % (self.minor, self.currency)
+
+    def __unicode__(self):
+        if self.currency:
+            return u'%s %s' % (self.to_decimal(), self.currency)
+
+        return unicode(self.to_decimal())
+
+
+def _make(minor, currency):
+    """ Create an amount from an integer `minor` without any checks. """
+    money = object.__new__(Money)
+    _setattr(money, 'minor', minor)
+    _setattr(money, 'currency', currency)
+
+    return money
+
+
+def sum_decimals(amounts):
+    """
+    Sum an iterable of `Decimal` `amounts` exactly and round the total to
+    minor units once.
+    """
+    return round_decimal(sum(amounts, Decimal(0)))
@@ -23,3 +23,22 @@ PRICE_FIELD_NAME = getattr(settings, 'SHOPKIT_CURRENCY_PRICE_FIELD')
 String reference to default price field for webshop.
 For example: `shopkit.currency.simple.fields.PriceField`
 """
+
+CURRENCY_CODE = getattr(settings, 'SHOPKIT_CURRENCY_CODE', None)
+"""
+(Optional) ISO 4217 code of the currency prices are stored in, ie.
+`EUR`. Used for :class:`Money <shopkit.currency.money.Money>` amounts.
+"""
+
+CURRENCY_DECIMALS = getattr(settings, 'SHOPKIT_CURRENCY_DECIMALS', 2)
+"""
+Number of decimals of the minor currency unit, in which
+:class:`Money <shopkit.currency.money.Money>` amounts are stored.
+Defaults to: 2.
+"""
+
+CURRENCY_ROUNDING = getattr(settings, 'SHOPKIT_CURRENCY_ROUNDING', 'ROUND_HALF_UP')
+"""
+Rounding mode from the :mod:`decimal` module used when converting amounts
+to minor units and when multiplying amounts. Defaults to `ROUND_HALF_UP`.
+"""
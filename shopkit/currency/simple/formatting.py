@@ -0,0 +1,230 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Locale-aware price formatting.
+
+The formatting string for a currency is parsed once into a
+:class:`PriceFormatter`, which is cached per language and currency.
+Formatting then consists of quantizing a `Decimal` (or splitting an integer
+amount of minor units) and some string operations, without converting
+amounts to float.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import re
+
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.utils import formats, translation
+
+from shopkit.currency.money import Money, round_minor
+from shopkit.currency.settings import CURRENCY_DECIMALS
+from shopkit.currency.simple.settings import \
+    CURRENCY_FORMATTING, CURRENCY_FORMATS
+
+
+PATTERN_RE = re.compile(r'%([-+ #0]*)(\d*)(?:\.(\d+))?([fFdis])')
+"""
+Matches the amount in formatting strings like `u"\\u20AC %.2f"` or
+`u"%-8.2f \\u20AC"`, capturing the flags, width, precision and type.
+"""
+
+
+class PriceFormatter(object):
+    """
+    Formatter for prices in a single currency and locale, compiled from
+    a `%`-style formatting string.
+    """
+
+    def __init__(self, pattern, decimal_separator='.',
+                 thousand_separator='', grouping=0):
+        match = PATTERN_RE.search(pattern)
+        if not match:
+            raise ValueError('No amount in formatting string %r' % pattern)
+
+        self.prefix = pattern[:match.start()].replace('%%', '%')
+        self.suffix = pattern[match.end():].replace('%%', '%')
+
+        (flags, width, precision, conversion) = match.groups()
+
+        self.flags = flags
+        self.width = int(width or 0)
+
+        if precision is not None and conversion != 's':
+            self.decimals = int(precision)
+        elif conversion in 'fF':
+            # Python's default precision for %f
+            self.decimals = 6
+        elif conversion == 's':
+            # Like `%s`, keep the decimals of the amount itself
+            self.decimals = None
+        else:
+            self.decimals = 0
+
+        self.decimal_separator = decimal_separator
+        self.thousand_separator = thousand_separator
+        self.grouping = grouping
+
+    def _group(self, digits):
+        """ Insert thousand separators into a string of digits. """
+        if not self.thousand_separator or not self.grouping:
+            return digits
+
+        grouping = self.grouping
+        groups = []
+        while len(digits) > grouping:
+            groups.insert(0, digits[-grouping:])
+            digits = digits[:-grouping]
+        groups.insert(0, digits)
+
+        return self.thousand_separator.join(groups)
+
+    def _format_parts(self, negative, digits, decimals):
+        """
+        Format a string of `digits`, the last `decimals` of which are
+        decimals, applying the flags and width of the pattern.
+        """
+        if decimals:
+            digits = digits.rjust(decimals + 1, '0')
+            number = self._group(digits[:-decimals]) + \
+                self.decimal_separator + digits[-decimals:]
+        else:
+            number = self._group(digits)
+
+        if negative:
+            sign = u'-'
+        elif '+' in self.flags:
+            sign = u'+'
+        elif ' ' in self.flags:
+            sign = u' '
+        else:
+            sign = u''
+
+        if len(sign) + len(number) < self.width:
+            if '-' in self.flags:
+                number = (sign + number).ljust(self.width)
+            elif '0' in self.flags:
+                number = sign + number.rjust(self.width - len(sign), '0')
+            else:
+                number = (sign + number).rjust(self.width)
+        else:
+            number = sign + number
+
+        return self.prefix + number + self.suffix
+
+    def format_minor(self, minor, decimals=CURRENCY_DECIMALS):
+        """
+        Format an integer amount of `minor` units with `decimals` decimals.
+        """
+        if self.decimals is not None:
+            if decimals > self.decimals:
+                minor = round_minor(
+                    Decimal(minor).scaleb(self.decimals - decimals))
+            elif decimals < self.decimals:
+                minor = minor * 10 ** (self.decimals - decimals)
+
+            decimals = self.decimals
+
+        return self._format_parts(minor < 0, str(abs(minor)), decimals)
+
+    def format(self, amount):
+        """
+        Format `amount`, which might be a `Decimal`, a :class:`Money`
+        amount, an integer or a string. Floats are converted through their
+        string representation.
+
+        Returns `None` for empty or invalid amounts.
+        """
+        if isinstance(amount, Money):
+            return self.format_minor(amount.minor)
+
+        if not isinstance(amount, Decimal):
+            if amount is None or amount == '':
+                logger.warn('Attempting to format an empty price, failing softly by returning None.')
+                return None
+
+            try:
+                amount = Decimal(str(amount))
+            except (InvalidOperation, ValueError):
+                logger.warn('Attempting to format an invalid price %r, failing softly by returning None.', amount)
+                return None
+
+        if not amount.is_finite():
+            return None
+
+        decimals = self.decimals
+        if decimals is None:
+            decimals = max(0, -amount.as_tuple().exponent)
+
+        minor = round_minor(amount.scaleb(decimals))
+
+        return self._format_parts(minor < 0, str(abs(minor)), decimals)
+
+    def format_many(self, amounts):
+        """ Format an iterable of `amounts`, returning a list. """
+        format = self.format
+
+        return [format(amount) for amount in amounts]
+
+
+_formatters = {}
+
+
+def get_formatter(currency=None, language=None):
+    """
+    Return the cached :class:`PriceFormatter` for `currency` in `language`,
+    defaulting to the active language. Separators follow Django's
+    localized number formats when `USE_L10N` is enabled.
+    """
+    if language is None:
+        language = translation.get_language()
+
+    key = (language, currency)
+
+    formatter = _formatters.get(key)
+    if formatter is None:
+        pattern = CURRENCY_FORMATS.get(currency, CURRENCY_FORMATTING)
+
+        if getattr(settings, 'USE_L10N', False):
+            decimal_separator = \
+                formats.get_format('DECIMAL_SEPARATOR', lang=language)
+
+            if getattr(settings, 'USE_THOUSAND_SEPARATOR', False):
+                thousand_separator = \
+                    formats.get_format('THOUSAND_SEPARATOR', lang=language)
+                grouping = formats.get_format('NUMBER_GROUPING', lang=language)
+            else:
+                thousand_separator = ''
+                grouping = 0
+        else:
+            decimal_separator = '.'
+            thousand_separator = ''
+            grouping = 0
+
+        formatter = PriceFormatter(pattern,
+                                   decimal_separator=decimal_separator,
+                                   thousand_separator=thousand_separator,
+                                   grouping=grouping)
+
+        _formatters[key] = formatter
+
+    return formatter
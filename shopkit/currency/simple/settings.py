@@ -41,3 +41,16 @@ For example, euro's will be nicely rendered with::
 
     SHOPKIT_CURRENCY_FORMATTING = u"\u20AC %.2f"
 """
+
+CURRENCY_FORMATS = getattr(settings, 'SHOPKIT_CURRENCY_FORMATS', {})
+"""
+Formatting strings per ISO 4217 currency code, for prices in other
+currencies than the default. Falls back to `CURRENCY_FORMATTING`.
+
+For example::
+
+    SHOPKIT_CURRENCY_FORMATS = {
+        'USD': u"$ %.2f",
+        'JPY': u"\u00A5 %.0f",
+    }
+"""
@@ -16,19 +16,24 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
-import logging
-logger = logging.getLogger(__name__)
+from shopkit.currency.money import Money
+from shopkit.currency.simple.formatting import get_formatter
 
-from shopkit.currency.simple.settings import CURRENCY_FORMATTING
 
+def format_price(amount, currency=None):
+    """
+    Format the given price in the current locale, using the cached
+    :class:`PriceFormatter
+    <shopkit.currency.simple.formatting.PriceFormatter>` for `currency`.
+    Amounts may be `Decimal` or :class:`Money <shopkit.currency.money.Money>`,
+    in which case the currency of the amount is used by default.
+    """
+    if currency is None and isinstance(amount, Money):
+        currency = amount.currency
 
-def format_price(amount):
-    """ Format the given float-like object in the current locale. """
-    try:
-        float(amount)
-    except ValueError:
-        logger.warn('Attempting to format an empty price, failing softly by returning None.')
-        return None
+    return get_formatter(currency).format(amount)
 
-    return CURRENCY_FORMATTING % amount
 
+def format_prices(amounts, currency=None):
+    """ Format a list of prices in `currency` in the current locale. """
+    return get_formatter(currency).format_many(amounts)
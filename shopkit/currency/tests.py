@@ -0,0 +1,114 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import pickle
+
+from decimal import Decimal, ROUND_HALF_UP, ROUND_HALF_EVEN
+
+from django.test import TestCase
+
+from shopkit.currency.money import Money, round_minor, round_decimal, \
+    sum_decimals
+from shopkit.currency.settings import CURRENCY_ROUNDING
+
+
+class MoneyTest(TestCase):
+    """ Tests for integer based monetary amounts. """
+
+    def test_from_decimal(self):
+        """ Convert `Decimal` amounts to minor units and back. """
+
+        amount = Money.from_decimal(Decimal('12.34'), decimals=2)
+        self.assertEqual(amount.minor, 1234)
+        self.assertEqual(amount.to_decimal(decimals=2), Decimal('12.34'))
+
+        self.assertEqual(Money.from_decimal(5, decimals=2).minor, 500)
+        self.assertEqual(Money.from_decimal(None).minor, 0)
+        self.assertTrue(Money.from_decimal(amount) is amount)
+
+        # More decimals than the minor units are rounded
+        expected = int(Decimal('1234.5').quantize(Decimal('1'),
+                                                  rounding=CURRENCY_ROUNDING))
+        self.assertEqual(
+            Money.from_decimal(Decimal('12.345'), decimals=2).minor, expected)
+
+    def test_rounding(self):
+        """ Round halves according to the rounding mode. """
+
+        self.assertEqual(round_minor(Decimal('0.5'), ROUND_HALF_UP), 1)
+        self.assertEqual(round_minor(Decimal('-0.5'), ROUND_HALF_UP), -1)
+        self.assertEqual(round_minor(Decimal('0.5'), ROUND_HALF_EVEN), 0)
+        self.assertEqual(round_minor(Decimal('1.5'), ROUND_HALF_EVEN), 2)
+
+    def test_round_once(self):
+        """ Amounts are rounded once, from the exact result. """
+
+        # Rounding the piece price first would yield 0.13 * 8 = 1.04
+        self.assertEqual(round_decimal(Decimal('0.125') * 8), Decimal('1'))
+
+        self.assertEqual(sum_decimals([Decimal('1.10'), Decimal('2.20')]),
+                         Decimal('3.30'))
+        self.assertEqual(sum_decimals([]), Decimal('0'))
+
+    def test_arithmetic(self):
+        """ Addition and integer multiplication are exact. """
+
+        self.assertEqual(Money(100, 'EUR') + Money(50, 'EUR'),
+                         Money(150, 'EUR'))
+        self.assertEqual(Money(100, 'EUR') - Money(150, 'EUR'),
+                         Money(-50, 'EUR'))
+        self.assertEqual(Money(3, 'EUR') * 2, Money(6, 'EUR'))
+        self.assertEqual(Money(10) * Decimal('0.3'), Money(3))
+        self.assertEqual(Money(1000).percentage(21), Money(210))
+
+        self.assertEqual(sum([Money(1, 'EUR'), Money(2, 'EUR')]),
+                         Money(3, 'EUR'))
+
+    def test_currencies(self):
+        """ Amounts in different currencies cannot be combined. """
+
+        self.assertEqual((Money(1, 'EUR') + Money(1)).currency, 'EUR')
+        self.assertEqual((Money(1) + Money(1, 'EUR')).currency, 'EUR')
+
+        self.assertRaises(ValueError, lambda: Money(1, 'EUR') + Money(1, 'USD'))
+        self.assertRaises(ValueError, lambda: Money(1, 'EUR') < Money(2, 'USD'))
+        self.assertRaises(TypeError, lambda: Money(1, 'EUR') + 1)
+        self.assertRaises(TypeError, lambda: Money(1) * Money(1))
+
+        self.assertFalse(Money(1, 'EUR') == Money(1, 'USD'))
+
+    def test_equality(self):
+        """ Equal amounts have equal hashes. """
+
+        self.assertEqual(Money(0), 0)
+        self.assertEqual(hash(Money(0)), hash(0))
+
+        self.assertEqual(Money(5), Money(5, 'EUR'))
+        self.assertEqual(hash(Money(5)), hash(Money(5, 'EUR')))
+        self.assertEqual(len(set([Money(5), Money(5, 'EUR')])), 1)
+
+        self.assertNotEqual(Money(5), 5)
+        self.assertFalse(Money(0))
+
+    def test_immutable(self):
+        """ Amounts are immutable and can be pickled. """
+
+        amount = Money(1234, 'EUR')
+
+        self.assertRaises(AttributeError, setattr, amount, 'minor', 1)
+        self.assertEqual(pickle.loads(pickle.dumps(amount)), amount)
@@ -16,6 +16,9 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+_currency_field = None
+
+
 def get_currency_field():
     """
     Use this method to get a useable pricefield based on the
@@ -29,7 +32,18 @@ def get_currency_field():
             ...
             price = PriceField()
 
+    The field class is resolved only once and cached afterwards.
 """
+    global _currency_field
+
+    if _currency_field is None:
+        _currency_field = _resolve_currency_field()
+
+    return _currency_field
+
+
+def _resolve_currency_field():
+    """ Import the field class referred to by `PRICE_FIELD_NAME`. """
     from shopkit.currency.settings import PRICE_FIELD_NAME
 
     # If we're just documenting, return some bogus value here
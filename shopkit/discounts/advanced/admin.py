@@ -17,9 +17,34 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 from django.contrib import admin
+from django.utils.translation import ugettext_lazy as _
 
 from shopkit.core.utils import get_model_from_string
 
 from shopkit.discounts.settings import *
 
 
+class DiscountTraceAdminMixin(object):
+    """
+    Mixin class for admins of carts or orders with calculated discounts,
+    displaying a trace of the discount evaluation. To use this, add
+    `'discount_trace'` to `readonly_fields`::
+
+        OrderAdmin(DiscountTraceAdminMixin, <Base classes>):
+            readonly_fields = ('discount_trace', )
+
+    """
+
+    def discount_trace(self, obj):
+        """
+        Recalculate discounts for `obj` and render the resulting trace.
+        """
+
+        if not obj or not obj.pk:
+            return u''
+
+        trace = obj.get_discount_trace()
+
+        return trace.as_html()
+    discount_trace.short_description = _('discount trace')
+    discount_trace.allow_tags = True
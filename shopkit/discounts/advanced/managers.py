@@ -0,0 +1,336 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import logging
+logger = logging.getLogger(__name__)
+
+import datetime
+
+from decimal import Decimal
+
+from django.db import models
+from django.db.models.fields import FieldDoesNotExist
+
+from shopkit.discounts.settings import DISCOUNT_MODEL
+from shopkit.core.utils import get_model_from_string, implements_predicates
+from shopkit.price.managers import get_price_class
+from shopkit.price.models import PricedItemBase
+
+
+def _get_m2m_field(model, name):
+    """
+    Return the many-to-many field `name` of `model`, or `None` when no
+    such relation exists.
+    """
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+    if isinstance(field, models.ManyToManyField):
+        return field
+
+    return None
+
+
+def get_product_categories(model, products):
+    """
+    Return a dictionary with sets of category primary keys for `products`
+    of product model `model`, looking up many-to-many categories in a
+    single query.
+    """
+
+    categories = dict([(product.pk, set()) for product in products])
+
+    field = _get_m2m_field(model, 'categories')
+    if field:
+        through = field.rel.through
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+
+        rows = through.objects.filter(
+            **{'%s__in' % source: categories.keys()}
+        ).values_list(source, target)
+
+        for (product_pk, category_pk) in rows:
+            categories[product_pk].add(category_pk)
+
+    else:
+        for product in products:
+            category_pk = getattr(product, 'category_id', None)
+
+            if category_pk:
+                categories[product.pk].add(category_pk)
+
+    return categories
+
+
+def get_candidate_discounts(products, categories, **kwargs):
+    """
+    Return a list with all item discounts which might be valid for any of
+    the given `products` and `categories`, with their `products` and
+    `categories` prefetched so `check_valid` does not query.
+
+    :param kwargs: Passed on to `get_valid_discounts`, ie. `date` or
+                   `coupon_code`.
+    """
+
+    discount_class = get_model_from_string(DISCOUNT_MODEL)
+
+    discounts = discount_class.get_valid_discounts(
+        products=products, categories=categories,
+        item_discounts=True, **kwargs
+    )
+
+    prefetch = [name for name in ('products', 'categories')
+                if _get_m2m_field(discount_class, name)]
+    if prefetch:
+        discounts = discounts.prefetch_related(*prefetch)
+
+    return list(discounts.distinct())
+
+
+class DiscountedProductManager(models.Manager):
+    """
+    Manager for products, providing discounted prices for whole pages of
+    products in a fixed number of queries. Use it by setting it as a
+    manager on the `Product` model::
+
+        class Product(...):
+            objects = DiscountedProductManager()
+
+    """
+
+    bulk_prices = False
+    """
+    Whether `get_price()` of the products returns their cheapest price
+    from the advanced price model, such that these prices can be obtained
+    for all products at once by `get_prices()`. Enable this in a subclass
+    when no VAT, variations or custom pricing are applied by `get_price()`.
+    """
+
+    def uses_price_field(self):
+        """
+        Return whether `get_price()` of the products is the one of
+        :class:`PricedItemBase <shopkit.price.models.PricedItemBase>`,
+        which merely returns the `price` field.
+        """
+        get_price = getattr(self.model.get_price, 'im_func', None)
+
+        return get_price is PricedItemBase.__dict__['get_price']
+
+    def get_product_categories(self, products):
+        """
+        Return a dictionary with sets of category primary keys for
+        `products`, looking up many-to-many categories in a single query.
+        """
+
+        return get_product_categories(self.model, products)
+
+    def get_candidate_discounts(self, products, categories, **kwargs):
+        """
+        Return a list with all item discounts which might be valid for any
+        of the given `products` and `categories`, without a coupon code.
+        """
+
+        return get_candidate_discounts(products, categories,
+                                       coupon_code=None, **kwargs)
+
+    def get_restrictions(self, discount):
+        """
+        Return a tuple with the sets of product and category primary keys
+        `discount` is restricted to, or `None` when it is not restricted
+        to specific products or categories. Only used when the discount
+        model does not implement `check_valid` for all of its mixins.
+        """
+
+        restrictions = []
+        for (fk_name, m2m_name) in (('product_id', 'products'),
+                                    ('category_id', 'categories')):
+            if getattr(discount, fk_name, None):
+                restrictions.append(set([getattr(discount, fk_name)]))
+            elif _get_m2m_field(type(discount), m2m_name) and \
+                    getattr(discount, m2m_name).all():
+                restrictions.append(set([obj.pk for obj in
+                                    getattr(discount, m2m_name).all()]))
+            else:
+                restrictions.append(None)
+
+        return tuple(restrictions)
+
+    def matches(self, discount, product, categories, restrictions=None,
+                **kwargs):
+        """
+        Return whether candidate `discount` applies to `product`, which has
+        the category primary keys `categories`. Uses the query-free
+        `check_valid` of the discount when `restrictions` is `None` and the
+        ones from `get_restrictions` otherwise.
+        """
+
+        if restrictions is None:
+            return discount.check_valid(product=product.pk,
+                                        categories=categories,
+                                        item_discounts=True,
+                                        coupon_code=None, **kwargs)
+
+        (product_pks, category_pks) = restrictions
+
+        if product_pks is not None and not product.pk in product_pks:
+            return False
+
+        if category_pks is not None and not category_pks & categories:
+            return False
+
+        return True
+
+    def get_prices(self, products, date=None):
+        """
+        Return a dictionary mapping the primary keys of `products` to their
+        price for a single piece on `date` (defaulting to today).
+
+        When `get_price()` of the products merely returns their `price`
+        field (see `uses_price_field()`), prices are taken from that field.
+        When `bulk_prices` is enabled, prices are taken from, in order of
+        preference:
+
+        1. The `current_price` of products implementing
+           :class:`CurrentPriceProductMixin
+           <shopkit.price.advanced.models.CurrentPriceProductMixin>`, when
+           it has been refreshed for `date`.
+        2. The cheapest prices of the advanced price model, obtained with a
+           single query through `get_cheapest_for`.
+
+        Products for which no price is found otherwise are priced with
+        `get_price()`, such that overrides of it are respected.
+        """
+
+        today = datetime.date.today()
+        if not date:
+            date = today
+
+        field_names = [field.name for field in self.model._meta.fields]
+
+        prices = {}
+        if self.uses_price_field():
+            for product in products:
+                prices[product.pk] = product.price
+
+        elif self.bulk_prices:
+            if 'current_price' in field_names and date == today:
+                for product in products:
+                    if product.current_price_date == today and \
+                            not product.current_price is None:
+                        prices[product.pk] = product.current_price
+
+        missing = [product.pk for product in products
+                   if not product.pk in prices]
+
+        price_class = get_price_class()
+        if missing and price_class and self.bulk_prices:
+            cheapest = price_class.get_cheapest_for(missing, quantity=1,
+                                                    date=date)
+
+            for (product_pk, price) in cheapest.iteritems():
+                prices[product_pk] = price.get_price()
+
+        for product in products:
+            if not product.pk in prices:
+                prices[product.pk] = product.get_price(quantity=1)
+
+        return prices
+
+    def annotate_discounts(self, products=None, **kwargs):
+        """
+        Annotate each of `products` (defaulting to all products of this
+        manager) with the following attributes:
+
+        * `undiscounted_price`: the price for a single piece, as returned by
+          `get_prices()`
+        * `best_discount`: the discount yielding the highest item discount
+          for a single piece, or `None`
+        * `discount`: the amount of discount for a single piece
+        * `discounted_price`: the price with the discount applied
+
+        Discounts are obtained from the `get_valid_discounts` chain of the
+        discount model for all products at once, so the number of queries
+        does not depend on the number of products. The same holds for the
+        prices, unless products need to fall back to `get_price()` (see
+        `get_prices()`).
+
+        :param kwargs: Passed on to `get_valid_discounts`, ie. `date`.
+        :returns: List with the annotated products.
+        """
+
+        if products is None:
+            products = self.get_query_set()
+
+        products = list(products)
+
+        if not products:
+            return products
+
+        categories = self.get_product_categories(products)
+
+        all_categories = set()
+        for product_categories in categories.values():
+            all_categories.update(product_categories)
+
+        discounts = self.get_candidate_discounts(
+            [product.pk for product in products], list(all_categories),
+            **kwargs
+        )
+
+        discount_class = get_model_from_string(DISCOUNT_MODEL)
+        if implements_predicates(discount_class, 'get_valid_discounts',
+                                 'check_valid'):
+            restrictions = [(discount, None) for discount in discounts]
+        else:
+            restrictions = [(discount, self.get_restrictions(discount))
+                            for discount in discounts]
+
+        prices = self.get_prices(products, kwargs.get('date', None))
+
+        logger.debug(u'Annotating %d products with %d candidate discounts',
+                     len(products), len(discounts))
+
+        for product in products:
+            price = prices[product.pk]
+
+            best_discount = None
+            best_amount = Decimal('0.00')
+
+            for (discount, restriction) in restrictions:
+                if not self.matches(discount, product, categories[product.pk],
+                                    restriction, **kwargs):
+                    continue
+
+                amount = discount.get_discount(item_price=price, quantity=1)
+
+                if amount > best_amount:
+                    best_discount = discount
+                    best_amount = amount
+
+            # Never discount beyond the price of the product
+            best_amount = min(best_amount, price)
+
+            product.undiscounted_price = price
+            product.best_discount = best_discount
+            product.discount = best_amount
+            product.discounted_price = price - best_amount
+
+        return products
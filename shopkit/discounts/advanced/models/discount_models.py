@@ -33,26 +33,48 @@ from django.db import models
 from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 
+from django.core.cache import cache
+
 from shopkit.discounts.settings import \
-    COUPON_LENGTH, COUPON_CHARACTERS
+    COUPON_LENGTH, COUPON_CHARACTERS, DATE_CACHE_TIMEOUT
 
 from datetime import datetime
 
 from shopkit.core.settings import PRODUCT_MODEL
+from shopkit.core.utils import implements_predicates, get_pks
 from shopkit.core.utils.fields import PercentageField
+from shopkit.core.utils.cache import make_key, get_version, bump_version, \
+    VersionedManager
+
+from shopkit.discounts.advanced.tracing import traced_filter, traced_discount
+
+from shopkit.currency.money import round_decimal
 
 # Get the currently configured currency field, whatever it is
 from shopkit.currency.utils import get_currency_field
 PriceField = get_currency_field()
 
 
+class DiscountManager(VersionedManager):
+    """
+    Manager for discounts, bumping the `discounts` version upon bulk
+    changes.
+    """
+
+    version_name = 'discounts'
+
+
 class DiscountBase(models.Model):
     """ Base class for discounts. """
 
     class Meta:
         abstract = True
 
+    objects = DiscountManager()
+    """ Manager invalidating cached data upon bulk changes as well. """
+
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
         """
         Get all valid discount objects for a given `kwargs`. By default,
@@ -67,22 +89,47 @@ class DiscountBase(models.Model):
 
         return cls.objects.all()
 
-    def is_valid(self, **kwargs):
+    def check_valid(self, **kwargs):
         """
-        Check to see whether an individual discount is valid under the
-        given circumstances.
+        Evaluate whether this discount is valid for the given `kwargs` on
+        the instance itself, without querying the database. Every mixin
+        implementing `get_valid_discounts` should implement the equivalent
+        predicate here. By default, all discounts are invalid.
         """
 
-        valid = self.get_valid_discounts(**kwargs)
+        return False
+
+    def is_valid_query(self, **kwargs):
+        """
+        Check whether this discount is part of the `QuerySet` returned by
+        `get_valid_discounts` for the given `kwargs`.
+        """
 
         assert self.pk, \
         "This discount has not yet been saved, which is required in order \
-         to determine it's validity (for now)."
+         to determine it's validity through the database."
+
+        valid = self.get_valid_discounts(**kwargs)
+
+        return valid.filter(pk=self.pk).exists()
+
+    def is_valid(self, **kwargs):
+        """
+        Check to see whether an individual discount is valid under the
+        given circumstances.
+
+        When every mixin implementing `get_valid_discounts` implements
+        `check_valid` as well, validity is evaluated on the instance without
+        queries. Otherwise, `is_valid_query` is used.
+        """
 
-        valid.filter(pk=self.pk)
+        if implements_predicates(type(self), 'get_valid_discounts',
+                                 'check_valid'):
+            return self.check_valid(**kwargs)
 
-        return valid.exists()
+        return self.is_valid_query(**kwargs)
 
+    @traced_discount
     def get_discount(self, **kwargs):
         """
         Get the total amount of discount produced by this `Discount`. This
@@ -90,6 +137,18 @@ class DiscountBase(models.Model):
         """
         return Decimal('0.00')
 
+    def save(self, *args, **kwargs):
+        """ Invalidate cached discount data upon saving. """
+        super(DiscountBase, self).save(*args, **kwargs)
+
+        bump_version('discounts')
+
+    def delete(self, *args, **kwargs):
+        """ Invalidate cached discount data upon deletion. """
+        super(DiscountBase, self).delete(*args, **kwargs)
+
+        bump_version('discounts')
+
     def __unicode__(self):
         """
         Natural representation of discount. For now, just use the pk.
@@ -110,6 +169,7 @@ class OrderDiscountAmountMixin(models.Model):
     """ Absolute discount on the total of an order. """
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
         """
         We want to be able to discriminate between discounts valid for
@@ -134,6 +194,20 @@ class OrderDiscountAmountMixin(models.Model):
 
         return valid
 
+    def check_valid(self, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(OrderDiscountAmountMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        order_discounts = kwargs.get('order_discounts', None)
+
+        if not order_discounts is None:
+            valid = valid or \
+                (self.order_amount is None) == (not order_discounts)
+
+        return valid
+
+    @traced_discount
     def get_discount(self, **kwargs):
         """
         Get the total amount of discount for the current item.
@@ -167,6 +241,7 @@ class ItemDiscountAmountMixin(models.Model):
     """
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
         """
         We want to be able to discriminate between discounts valid for
@@ -192,6 +267,20 @@ class ItemDiscountAmountMixin(models.Model):
 
         return valid
 
+    def check_valid(self, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(ItemDiscountAmountMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        item_discounts = kwargs.get('item_discounts', None)
+
+        if not item_discounts is None:
+            valid = valid or \
+                (self.item_amount is None) == (not item_discounts)
+
+        return valid
+
+    @traced_discount
     def get_discount(self, **kwargs):
         """
         Get the total amount of discount for the current item.
@@ -225,6 +314,7 @@ class OrderDiscountPercentageMixin(models.Model):
     """ Percentual discount on the total of an order. """
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
         """
         We want to be able to discriminate between discounts valid for
@@ -250,6 +340,20 @@ class OrderDiscountPercentageMixin(models.Model):
 
         return valid
 
+    def check_valid(self, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(OrderDiscountPercentageMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        order_discounts = kwargs.get('order_discounts', None)
+
+        if not order_discounts is None:
+            valid = valid or \
+                (self.order_percentage is None) == (not order_discounts)
+
+        return valid
+
+    @traced_discount
     def get_discount(self, **kwargs):
         """
         Get the total amount of discount for the current item.
@@ -262,7 +366,8 @@ class OrderDiscountPercentageMixin(models.Model):
         discount = superclass.get_discount(**kwargs)
 
         if self.order_percentage:
-            discount += (self.order_percentage/100)*order_price
+            amount = order_price*self.order_percentage/100
+            discount += round_decimal(amount)
 
         return discount
 
@@ -289,6 +394,7 @@ class ItemDiscountPercentageMixin(models.Model):
 
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
         """
         We want to be able to discriminate between discounts valid for
@@ -314,6 +420,20 @@ class ItemDiscountPercentageMixin(models.Model):
 
         return valid
 
+    def check_valid(self, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(ItemDiscountPercentageMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        item_discounts = kwargs.get('item_discounts', None)
+
+        if not item_discounts is None:
+            valid = valid or \
+                (self.item_percentage is None) == (not item_discounts)
+
+        return valid
+
+    @traced_discount
     def get_discount(self, **kwargs):
         """
         Get the total amount of discount for the current item.
@@ -325,7 +445,8 @@ class ItemDiscountPercentageMixin(models.Model):
 
         discount = superclass.get_discount(**kwargs)
         if self.item_percentage:
-            discount += (self.item_percentage/100)*item_price
+            amount = item_price*self.item_percentage/100
+            discount += round_decimal(amount)
 
         return discount
 
@@ -350,22 +471,48 @@ class ProductDiscountMixin(models.Model):
     """ Product this discount relates to. """
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
-        """ Return valid discounts for a specified product """
+        """
+        Return valid discounts for a specified `product`, or for any of
+        the `products` specified.
+        """
 
         superclass = super(ProductDiscountMixin, cls)
         valid = superclass.get_valid_discounts(**kwargs)
 
         product = kwargs.get('product', None)
+        products = kwargs.get('products', None)
         if not product is None:
             # When a product has been specified, allow discounts for this
             # specific product and discounts for which no product is specified
             valid = valid.filter(Q(product__isnull=True) | Q(product=product))
+        elif not products is None:
+            # Allow discounts for any of the specified products
+            valid = valid.filter(Q(product__isnull=True) | \
+                                 Q(product__in=products))
         else:
             valid = valid.filter(product__isnull=True)
 
         return valid
 
+    def check_valid(self, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(ProductDiscountMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        if self.product_id is None:
+            return valid
+
+        product = kwargs.get('product', None)
+        products = kwargs.get('products', None)
+        if not product is None:
+            return valid and self.product_id in get_pks(product)
+        elif not products is None:
+            return valid and self.product_id in get_pks(products)
+
+        return False
+
 
 class ManyProductDiscountMixin(models.Model):
     """ Mixin defining discounts based on products. """
@@ -379,22 +526,53 @@ class ManyProductDiscountMixin(models.Model):
     """ Products this discount relates to. """
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
-        """ Return valid discounts for a specified product """
+        """
+        Return valid discounts for a specified `product`, or for any of
+        the `products` specified.
+        """
 
         superclass = super(ManyProductDiscountMixin, cls)
         valid = superclass.get_valid_discounts(**kwargs)
 
         product = kwargs.get('product', None)
+        products = kwargs.get('products', None)
         if not product is None:
             # When a product has been specified, allow discounts for this
             # specific product and discounts for which no product is specified
             valid = valid.filter(Q(products__isnull=True) | Q(products=product))
+        elif not products is None:
+            # Allow discounts for any of the specified products
+            valid = valid.filter(Q(products__isnull=True) | \
+                                 Q(products__in=products)).distinct()
         else:
             valid = valid.filter(products__isnull=True)
 
         return valid
 
+    def check_valid(self, **kwargs):
+        """
+        Instance equivalent of `get_valid_discounts`. In order to avoid a
+        query, prefetch `products` using `prefetch_related`.
+        """
+        superclass = super(ManyProductDiscountMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        product_pks = set([product.pk for product in self.products.all()])
+
+        if not product_pks:
+            return valid
+
+        product = kwargs.get('product', None)
+        products = kwargs.get('products', None)
+        if not product is None:
+            return valid and bool(product_pks & get_pks(product))
+        elif not products is None:
+            return valid and bool(product_pks & get_pks(products))
+
+        return False
+
 
 class DateRangeDiscountMixin(models.Model):
     """ Mixin for discount which are only valid within a given date range. """
@@ -414,12 +592,71 @@ class DateRangeDiscountMixin(models.Model):
                                   of this discount.'))
 
     @classmethod
+    def get_date_valid_ids(cls, date):
+        """
+        Return a list with the primary keys of discounts valid on `date`.
+
+        As this set only changes at day boundaries or when a discount is
+        edited, it is kept in Django's cache per calendar day for
+        `DATE_CACHE_TIMEOUT` seconds. Saving or deleting any discount, or
+        changing discounts in bulk through the querysets of their
+        :class:`VersionedManager
+        <shopkit.core.utils.cache.VersionedManager>`, invalidates the
+        cached sets.
+        """
+
+        key = make_key('discounts', cls._meta.app_label,
+                       cls._meta.object_name, 'date',
+                       date.isoformat(), get_version('discounts'))
+
+        valid_ids = cache.get(key)
+
+        if valid_ids is None:
+            valid = cls.get_all_discounts().filter(
+                        Q(start_date__isnull=True) | Q(start_date__lte=date),
+                        Q(end_date__isnull=True) | Q(end_date__gte=date))
+
+            valid_ids = list(valid.values_list('pk', flat=True))
+
+            logger.debug(u'Caching %d discounts valid on %s',
+                         len(valid_ids), date)
+
+            cache.set(key, valid_ids, DATE_CACHE_TIMEOUT)
+
+        return valid_ids
+
+    def check_valid(self, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(DateRangeDiscountMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        date = kwargs.get('date', None)
+        if not date:
+            date = datetime.today()
+
+        if isinstance(date, datetime):
+            date = date.date()
+
+        if self.start_date and self.start_date > date:
+            return False
+
+        if self.end_date and self.end_date < date:
+            return False
+
+        return valid
+
+    @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
         """
         Return valid discounts for a specified date, taking the current
         date if no date is specified. When no start or end date are specified,
         a discount defaults to be valid.
 
+        Rather than evaluating the date range on every call, the discounts
+        valid on the given day are obtained from
+        :meth:`get_date_valid_ids`.
+
         .. todo::
             Test this code.
         """
@@ -432,12 +669,12 @@ class DateRangeDiscountMixin(models.Model):
         if not date:
             date = datetime.today()
 
+        # Bucket by calendar day
+        if isinstance(date, datetime):
+            date = date.date()
+
         # Get valid discounts for the current situation
-        valid = valid.filter(
-                    Q(start_date__isnull=True, end_date__isnull=True) | \
-                    Q(start_date__isnull=True, end_date__gte=date) | \
-                    Q(start_date__lte=date, end_date__isnull=True) | \
-                    Q(start_date__lte=date, end_date__gte=date))
+        valid = valid.filter(pk__in=cls.get_date_valid_ids(date))
 
         return valid
 
@@ -464,6 +701,7 @@ if CATEGORIES:
         """ Category this discount relates to. """
 
         @classmethod
+        @traced_filter
         def get_valid_discounts(cls, **kwargs):
             """ Return valid discounts for a specified product """
 
@@ -493,6 +731,33 @@ if CATEGORIES:
 
             return valid
 
+        def check_valid(self, **kwargs):
+            """ Instance equivalent of `get_valid_discounts`. """
+            superclass = super(CategoryDiscountMixin, self)
+            valid = superclass.check_valid(**kwargs)
+
+            category_pks = set()
+            if self.category_id is not None:
+                category_pks.add(self.category_id)
+
+            if not category_pks:
+                return valid
+
+            categories = kwargs.get('categories', None)
+            if categories is None:
+                product = kwargs.get('product', None)
+
+                if product:
+                    if hasattr(product, 'categories'):
+                        categories = product.categories.all()
+                    else:
+                        categories = getattr(product, 'category', None)
+
+            if categories is None:
+                return False
+
+            return valid and bool(category_pks & get_pks(categories))
+
 
     class ManyCategoryDiscountMixin(models.Model):
         """
@@ -511,6 +776,7 @@ if CATEGORIES:
         """ Categories this discount relates to. """
 
         @classmethod
+        @traced_filter
         def get_valid_discounts(cls, **kwargs):
             """ Return valid discounts for a specified product """
 
@@ -539,6 +805,32 @@ if CATEGORIES:
 
             return valid
 
+        def check_valid(self, **kwargs):
+            """ Instance equivalent of `get_valid_discounts`. """
+            superclass = super(ManyCategoryDiscountMixin, self)
+            valid = superclass.check_valid(**kwargs)
+
+            category_pks = set([category.pk for category in
+                                self.categories.all()])
+
+            if not category_pks:
+                return valid
+
+            categories = kwargs.get('categories', None)
+            if categories is None:
+                product = kwargs.get('product', None)
+
+                if product:
+                    if hasattr(product, 'categories'):
+                        categories = product.categories.all()
+                    else:
+                        categories = getattr(product, 'category', None)
+
+            if categories is None:
+                return False
+
+            return valid and bool(category_pks & get_pks(categories))
+
 
 class CouponDiscountMixin(models.Model):
     """ Discount based on a specified coupon code. """
@@ -582,13 +874,14 @@ class CouponDiscountMixin(models.Model):
         return code
 
 
-    def save(self):
+    def save(self, *args, **kwargs):
         if self.use_coupon and not self.coupon_code:
             self.coupon_code = self.generate_coupon_code()
 
-        super(CouponDiscountMixin, self).save()
+        super(CouponDiscountMixin, self).save(*args, **kwargs)
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, coupon_code=None, **kwargs):
         """
         Return only items for which no coupon code has been set or
@@ -607,6 +900,17 @@ class CouponDiscountMixin(models.Model):
 
         return valid
 
+    def check_valid(self, coupon_code=None, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(CouponDiscountMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        if not self.use_coupon:
+            return valid
+
+        return valid and bool(coupon_code) and \
+            self.coupon_code == coupon_code
+
 
 class AccountedUseDiscountMixin(models.Model):
     """
@@ -625,6 +929,9 @@ class AccountedUseDiscountMixin(models.Model):
         """ Register `count` uses of discounts in queryset `qs`. """
         qs.update(used=models.F('used') + count)
 
+        # Use limits affect the validity of discounts
+        bump_version('discounts')
+
 
 class LimitedUseDiscountMixin(AccountedUseDiscountMixin):
     """
@@ -654,6 +961,7 @@ class LimitedUseDiscountMixin(AccountedUseDiscountMixin):
         return leftover
 
     @classmethod
+    @traced_filter
     def get_valid_discounts(cls, **kwargs):
         """
         Return currently valid discounts: ones for which either no use
@@ -668,3 +976,38 @@ class LimitedUseDiscountMixin(AccountedUseDiscountMixin):
                              Q(use_limit__gt=models.F('used')))
 
         return valid
+
+    def check_valid(self, **kwargs):
+        """ Instance equivalent of `get_valid_discounts`. """
+        superclass = super(LimitedUseDiscountMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        return valid and (self.use_limit is None or
+                          self.use_limit > self.used)
+
+
+class ExclusiveGroupDiscountMixin(models.Model):
+    """
+    Mixin class for discounts which can be grouped such that only one of
+    the discounts within a group is applied to an order or item. Only has an
+    effect on orders and items using :class:`BestCombinationDiscountMixin
+    <shopkit.discounts.advanced.models.order_models.BestCombinationDiscountMixin>`.
+    """
+
+    class Meta:
+        abstract = True
+
+    exclusive_group = models.CharField(verbose_name=_('exclusive group'),
+                                       max_length=255, blank=True,
+                                       db_index=True,
+                                       help_text=_('Of the discounts \
+                                         sharing a group, only the highest \
+                                         one is applied.'))
+    """ Group of mutually exclusive discounts this discount belongs to. """
+
+    def get_exclusive_group(self):
+        """
+        Return the exclusive group for this discount, or `None` if it can
+        be combined with any other discount.
+        """
+        return self.exclusive_group or None
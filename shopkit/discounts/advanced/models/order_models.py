@@ -32,16 +32,27 @@ logger = logging.getLogger(__name__)
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
-from decimal import Decimal
-
 from shopkit.discounts.settings import COUPON_LENGTH
 
 from shopkit.discounts.basemodels import \
     DiscountedCartBase, DiscountedCartItemBase, \
     DiscountedOrderBase, DiscountedOrderItemBase
 
-from shopkit.discounts.settings import DISCOUNT_MODEL
-from shopkit.core.utils import get_model_from_string
+from shopkit.discounts.settings import DISCOUNT_MODEL, MAX_STACKED, \
+    APPLIED_DISCOUNT_MODEL
+from shopkit.discounts.advanced.managers import \
+    get_product_categories, get_candidate_discounts
+from shopkit.discounts.advanced.solver import best_combination
+from shopkit.discounts.advanced.tracing import attach_trace, trace_discounts
+from shopkit.core.settings import ORDER_MODEL, ORDERITEM_MODEL, \
+    PRODUCT_MODEL
+from shopkit.core.utils import get_model_from_string, implements_predicates
+from shopkit.core.utils.cache import get_version
+from shopkit.currency.money import Money, sum_decimals
+
+# Get the currently configured currency field, whatever it is
+from shopkit.currency.utils import get_currency_field
+PriceField = get_currency_field()
 
 
 class CalculatedDiscountMixin(object):
@@ -50,12 +61,28 @@ class CalculatedDiscountMixin(object):
     a `Discount` model.
     """
 
-    def get_valid_discounts(self, **kwargs):
-        """ Return valid discounts for the given arguments. """
+    def get_valid_discounts(self, candidates=None, **kwargs):
+        """
+        Return valid discounts for the given arguments. When a list of
+        `candidates` is given, the valid discounts are selected from it
+        using `check_valid` rather than queried.
+        """
+
+        if candidates is not None:
+            return [discount for discount in candidates
+                    if discount.check_valid(**kwargs)]
 
         discount_class = get_model_from_string(DISCOUNT_MODEL)
         return discount_class.get_valid_discounts(**kwargs)
 
+    def combine_discounts(self, amounts, price):
+        """
+        Given a list of `(discount, amount)` tuples for all valid discounts,
+        return those which should actually be applied. By default, all
+        discounts are combined.
+        """
+        return amounts
+
 
 class CalculatedOrderDiscountMixin(CalculatedDiscountMixin):
     """
@@ -75,21 +102,48 @@ class CalculatedOrderDiscountMixin(CalculatedDiscountMixin):
 
         return discounts
 
-    def get_order_discount(self, **kwargs):
+    def get_order_discount_amounts(self, **kwargs):
         """
-        Get the discount specific for this `Order`.
+        Return a list of `(discount, amount)` tuples for the discounts
+        applied to this `Order`.
         """
 
-        # Now, add discounts on the total order
         valid_discounts = self.get_valid_discounts(**kwargs)
         price = self.get_price_without_discount(**kwargs)
 
-        total_discount = Decimal('0.00')
+        amounts = []
         for discount in valid_discounts:
-            total_discount += discount.get_discount(order_price=price,
-                                                    **kwargs)
+            amount = discount.get_discount(order_price=price, **kwargs)
+            amounts.append((discount, amount))
+
+        return self.combine_discounts(amounts, price)
+
+    @attach_trace
+    def get_order_discount(self, **kwargs):
+        """
+        Get the discount specific for this `Order`.
+        """
+
+        amounts = self.get_order_discount_amounts(**kwargs)
 
-        return total_discount
+        return sum_decimals([amount for (discount, amount) in amounts])
+
+    def get_discount_trace(self, **kwargs):
+        """
+        Recalculate the order discount and the discounts for all items with
+        tracing enabled and return the resulting
+        :class:`DiscountTrace <shopkit.discounts.advanced.tracing.DiscountTrace>`.
+        """
+
+        with trace_discounts() as trace:
+            CalculatedOrderDiscountMixin.get_order_discount(self, **kwargs)
+
+            for item in self.get_items():
+                if isinstance(item, CalculatedItemDiscountMixin):
+                    CalculatedItemDiscountMixin.get_item_discount(item,
+                                                                  **kwargs)
+
+        return trace
 
 
 class CalculatedItemDiscountMixin(CalculatedDiscountMixin):
@@ -115,36 +169,120 @@ class CalculatedItemDiscountMixin(CalculatedDiscountMixin):
 
         return discounts
 
+    def _get_discount_amounts(self, price, quantity, valid_discounts=None,
+                              **kwargs):
+        """
+        Return a list of `(discount, amount)` tuples for the discounts
+        applied to `quantity` pieces with a total price of `price`, out of
+        `valid_discounts` (defaulting to `get_valid_discounts()`).
+        """
+
+        if valid_discounts is None:
+            valid_discounts = self.get_valid_discounts(**kwargs)
+
+        amounts = []
+        for discount in valid_discounts:
+            amount = discount.get_discount(item_price=price, \
+                                           quantity=quantity, \
+                                           **kwargs)
+            amounts.append((discount, amount))
+
+        return self.combine_discounts(amounts, price)
+
+    def get_piece_discount_amounts(self, **kwargs):
+        """
+        Return a list of `(discount, amount)` tuples for the discounts
+        applied to a single piece of this OrderItem.
+        """
+        price = self.get_piece_price_without_discount(**kwargs)
+
+        return self._get_discount_amounts(price, 1, **kwargs)
+
+    def get_item_discount_amounts(self, valid_discounts=None, **kwargs):
+        """
+        Return a list of `(discount, amount)` tuples for the discounts
+        applied to this OrderItem, optionally out of `valid_discounts`.
+        """
+        price = self.get_price_without_discount(**kwargs)
+
+        return self._get_discount_amounts(price, self.quantity,
+                                          valid_discounts, **kwargs)
+
+    @attach_trace
     def get_piece_discount(self, **kwargs):
         """
         Get the total discount per piece for this OrderItem.
         """
-        valid_discounts = self.get_valid_discounts(**kwargs)
-        price = self.get_piece_price_without_discount(**kwargs)
 
-        total_discount = Decimal('0.00')
-        for discount in valid_discounts:
-            total_discount += discount.get_discount(item_price=price, \
-                                                    quantity=1, \
-                                                    **kwargs)
+        amounts = self.get_piece_discount_amounts(**kwargs)
 
-        return total_discount
+        return sum_decimals([amount for (discount, amount) in amounts])
 
+    @attach_trace
     def get_item_discount(self, **kwargs):
         """
         Get the total discount for this OrderItem.
         """
 
-        valid_discounts = self.get_valid_discounts(**kwargs)
-        price = self.get_price_without_discount(**kwargs)
+        amounts = self.get_item_discount_amounts(**kwargs)
 
-        total_discount = Decimal('0.00')
-        for discount in valid_discounts:
-            total_discount += discount.get_discount(item_price=price, \
-                                                    quantity=self.quantity, \
-                                                    **kwargs)
+        return sum_decimals([amount for (discount, amount) in amounts])
+
+    def get_discount_trace(self, **kwargs):
+        """
+        Recalculate the discount for this item with tracing enabled and
+        return the resulting
+        :class:`DiscountTrace <shopkit.discounts.advanced.tracing.DiscountTrace>`.
+        """
+
+        with trace_discounts() as trace:
+            CalculatedItemDiscountMixin.get_item_discount(self, **kwargs)
+
+        return trace
+
+
+class BestCombinationDiscountMixin(object):
+    """
+    Mixin class for carts, orders and their items which, rather than
+    combining all valid discounts, only apply the best combination of
+    discounts. Of the discounts sharing an exclusive group (see
+    :class:`ExclusiveGroupDiscountMixin
+    <shopkit.discounts.advanced.models.discount_models.ExclusiveGroupDiscountMixin>`)
+    only the highest is applied, and no more than `MAX_STACKED` discounts
+    are combined.
+
+    This class should precede the calculated discount mixins in the
+    list of base classes.
+    """
+
+    def combine_discounts(self, amounts, price):
+        """
+        Select the best combination out of the `(discount, amount)` tuples
+        in `amounts` using
+        :func:`best_combination <shopkit.discounts.advanced.solver.best_combination>`.
+        """
+
+        candidates = []
+        for (index, (discount, amount)) in enumerate(amounts):
+            if hasattr(discount, 'get_exclusive_group'):
+                group = discount.get_exclusive_group()
+            else:
+                group = None
+
+            candidates.append((index, group,
+                               Money.from_decimal(amount).minor))
+
+        selected = best_combination(candidates,
+                                    limit=Money.from_decimal(price).minor,
+                                    max_stacked=MAX_STACKED)
 
-        return total_discount
+        # Keep the original order of the discounts
+        indexes = sorted([index for (index, group, amount) in selected])
+
+        logger.debug(u'Best combination of discounts for %s: %s',
+                     self, indexes)
+
+        return [amounts[index] for index in indexes]
 
 
 class PersistentDiscountedItemBase(models.Model):
@@ -177,6 +315,193 @@ class PersistentDiscountedItemBase(models.Model):
         self.discounts = discounts
 
 
+class AppliedDiscountBase(models.Model):
+    """
+    Abstract base class for storing the discounts applied to an order or
+    order item, along with the resulting amount. Rows are written by
+    :class:`BulkPersistentDiscountedOrderMixin` so the breakdown of the
+    discount of an order never has to be recalculated.
+    """
+
+    class Meta:
+        verbose_name = _('applied discount')
+        verbose_name_plural = _('applied discounts')
+        abstract = True
+
+    order = models.ForeignKey(ORDER_MODEL, related_name='applied_discounts',
+                              verbose_name=_('order'))
+    """ Order the discount has been applied to. """
+
+    order_item = models.ForeignKey(ORDERITEM_MODEL, null=True, blank=True,
+                                   related_name='applied_discounts',
+                                   verbose_name=_('order item'))
+    """
+    Order item the discount has been applied to, or `None` for discounts on
+    the whole order.
+    """
+
+    discount = models.ForeignKey(DISCOUNT_MODEL, verbose_name=_('discount'))
+    """ Discount applied. """
+
+    amount = PriceField(verbose_name=_('amount'))
+    """ Amount of discount resulting from the discount. """
+
+    def __unicode__(self):
+        return _(u'%(discount)s: %(amount)s') % {
+            'discount': self.discount,
+            'amount': self.amount
+        }
+
+
+class BulkPersistentDiscountedOrderMixin(object):
+    """
+    Mixin class for `Order`'s which persist the discounts applied to the
+    order and all of its items in a single operation, storing them as
+    `APPLIED_DISCOUNT_MODEL` rows with their amounts.
+
+    This is an alternative for :class:`PersistentDiscountedItemBase`, which
+    updates a many-to-many relation for every order and order item
+    separately.
+    """
+
+    def get_applied_discount_class(self):
+        """ Return the model class for applied discounts. """
+        assert APPLIED_DISCOUNT_MODEL, \
+            'SHOPKIT_APPLIED_DISCOUNT_MODEL should be set to persist discounts.'
+
+        return get_model_from_string(APPLIED_DISCOUNT_MODEL)
+
+    def get_items_valid_discounts(self, items):
+        """
+        Return a dictionary mapping the primary keys of `items` to their
+        valid item discounts. When the discount model implements
+        `check_valid` for all of its mixins, the candidate discounts for
+        all items are queried at once and checked on the instances.
+        Otherwise, `get_valid_discounts` is called for every item.
+        """
+
+        discount_class = get_model_from_string(DISCOUNT_MODEL)
+
+        if not implements_predicates(discount_class, 'get_valid_discounts',
+                                     'check_valid'):
+            return dict([(item.pk, item.get_valid_discounts())
+                         for item in items])
+
+        products = [item.product for item in items]
+        categories = get_product_categories(
+            get_model_from_string(PRODUCT_MODEL), products)
+
+        all_categories = set()
+        for product_categories in categories.values():
+            all_categories.update(product_categories)
+
+        candidates = get_candidate_discounts(
+            [product.pk for product in products], list(all_categories),
+            coupon_code=getattr(self, 'coupon_code', None)
+        )
+
+        logger.debug(u'Checking %d candidate discounts for %d items of %s',
+                     len(candidates), len(items), self)
+
+        return dict([(item.pk, item.get_valid_discounts(
+                        candidates=candidates,
+                        categories=categories[item.product.pk]))
+                     for item in items])
+
+    def update_discount(self):
+        """
+        Calculate the discounts for the order and all of its items once,
+        update the `order_discount` property of the order as well as the
+        `discount` of changed order items, with one `UPDATE` per distinct
+        discount, and replace the stored applied discounts with a single
+        delete and a single `bulk_create`. The valid item discounts are
+        obtained with `get_items_valid_discounts`.
+
+        Transactions are left to the caller, ie. the confirmation of the
+        order. Like with :class:`DiscountedOrderBase`, the order itself is
+        not saved.
+        """
+
+        assert self.pk, 'Object not saved, need PK for assigning discounts'
+
+        applied_class = self.get_applied_discount_class()
+        orderitem_class = get_model_from_string(ORDERITEM_MODEL)
+
+        applied = []
+
+        amounts = []
+        for (discount, amount) in self.get_order_discount_amounts():
+            amounts.append(amount)
+
+            applied.append(applied_class(order=self, discount=discount,
+                                         amount=amount))
+
+        order_discount = sum_decimals(amounts)
+
+        logger.debug(u'Updating order discount for %s to %s',
+                     self, order_discount)
+
+        self.order_discount = order_discount
+
+        items = list(self.get_items())
+        valid_discounts = self.get_items_valid_discounts(items)
+
+        # Primary keys of changed items by their new discount
+        changed = {}
+        for item in items:
+            amounts = []
+            for (discount, amount) in item.get_item_discount_amounts(
+                    valid_discounts[item.pk]):
+                amounts.append(amount)
+
+                applied.append(applied_class(order=self, order_item=item,
+                                             discount=discount,
+                                             amount=amount))
+
+            item_discount = sum_decimals(amounts)
+
+            if item.discount != item_discount:
+                logger.debug(u'Updating item discount for %s to %s',
+                             item, item_discount)
+
+                changed.setdefault(item_discount, []).append(item.pk)
+                item.discount = item_discount
+
+        for (item_discount, pks) in changed.iteritems():
+            orderitem_class.objects.filter(pk__in=pks).update(
+                discount=item_discount)
+
+        logger.debug(u'Storing %d applied discounts for %s',
+                     len(applied), self)
+
+        applied_class.objects.filter(order=self).delete()
+        applied_class.objects.bulk_create(applied)
+
+    def get_discount_breakdown(self):
+        """
+        Return the stored applied discounts for this order and its items.
+        """
+        applied_class = self.get_applied_discount_class()
+
+        qs = applied_class.objects.filter(order=self)
+
+        return qs.select_related('discount', 'order_item')
+
+    def get_applied_discounts(self):
+        """
+        Return a `QuerySet` with the distinct discounts applied to this
+        order and its items.
+        """
+
+        discount_class = get_model_from_string(DISCOUNT_MODEL)
+        applied_class = self.get_applied_discount_class()
+
+        applied = applied_class.objects.filter(order=self)
+
+        return discount_class.objects.filter(
+            pk__in=applied.values('discount'))
+
+
 class DiscountedCartMixin(CalculatedOrderDiscountMixin,
                           DiscountedCartBase):
     """
@@ -185,6 +510,31 @@ class DiscountedCartMixin(CalculatedOrderDiscountMixin,
     class Meta:
         abstract = True
 
+    def get_fingerprint_parts(self):
+        """ Add the coupon code and the version of the discounts. """
+        parts = super(DiscountedCartMixin, self).get_fingerprint_parts()
+
+        parts.append(getattr(self, 'coupon_code', None))
+        parts.append(get_version('discounts'))
+
+        return parts
+
+    def get_quote_data(self):
+        """
+        Add the order discount and a list of `(discount pk, amount)` tuples
+        for the discounts applied to the order.
+        """
+        data = super(DiscountedCartMixin, self).get_quote_data()
+
+        amounts = self.get_order_discount_amounts()
+
+        data['order_discount'] = \
+            sum_decimals([amount for (discount, amount) in amounts])
+        data['order_discounts'] = \
+            [(discount.pk, amount) for (discount, amount) in amounts]
+
+        return data
+
 
 class DiscountedCartItemMixin(CalculatedItemDiscountMixin,
                               DiscountedCartItemBase):
@@ -214,6 +564,27 @@ class DiscountedOrderItemMixin(CalculatedItemDiscountMixin,
         abstract = True
 
 
+class BulkDiscountedOrderMixin(BulkPersistentDiscountedOrderMixin,
+                               DiscountedOrderBase,
+                               CalculatedOrderDiscountMixin):
+    """
+    Mixin class for `Order` objects which have their discount calculated and
+    persisted as applied discounts.
+    """
+    class Meta:
+        abstract = True
+
+
+class BulkDiscountedOrderItemMixin(CalculatedItemDiscountMixin,
+                                   DiscountedOrderItemBase):
+    """
+    Mixin class for `OrderItem` objects of orders using
+    :class:`BulkDiscountedOrderMixin`.
+    """
+    class Meta:
+        abstract = True
+
+
 class AccountedDiscountedItemMixin(object):
     """
     Model mixin class for orders for which the use is automatically accounted
@@ -227,12 +598,17 @@ class AccountedDiscountedItemMixin(object):
         # Call registration for superclass
         super(AccountedDiscountedItemMixin, self).confirm()
 
-        # Make sure we're of the proper type so we have a discounts property
-        assert isinstance(self, PersistentDiscountedItemBase)
-
         discount_class = get_model_from_string(DISCOUNT_MODEL)
 
-        discounts = self.discounts.all()
+        if isinstance(self, BulkPersistentDiscountedOrderMixin):
+            # Every discount applied to the order or its items counts once
+            discounts = self.get_applied_discounts()
+        else:
+            # Make sure we're of the proper type so we have a discounts
+            # property
+            assert isinstance(self, PersistentDiscountedItemBase)
+
+            discounts = self.discounts.all()
 
         # Register discount usage for order
         discount_class.register_use(discounts)
@@ -0,0 +1,94 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Selection of the best combination of discounts.
+
+Every discount valid for an order or item yields an amount independently of
+the other discounts, as percentages are calculated over the undiscounted
+price. The value of a combination is therefore the sum of its amounts,
+capped at the price. Given these constraints:
+
+* of the discounts sharing an exclusive group, at most one is applied
+* at most `max_stacked` discounts are applied in total
+
+the best combination consists of the largest discount in every group plus the
+ungrouped discounts, from which the `max_stacked` largest are taken. This
+selection is exact, so no enumeration of combinations is needed. Amounts are
+compared as integers in minor currency units, so no Decimal arithmetic is
+performed while selecting.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def best_combination(candidates, limit=None, max_stacked=None):
+    """
+    Select the best combination from `candidates`, an iterable of
+    `(key, group, amount)` tuples where `group` is `None` for discounts
+    which do not belong to an exclusive group and `amount` is an integer.
+
+    :param limit: Maximum total amount, ie. the price of the order or item.
+                  Candidates which do not add to the total because this limit
+                  has already been reached are not selected.
+    :param max_stacked: Maximum number of candidates selected.
+
+    :returns: List of `(key, group, amount)` tuples for the selected
+              candidates, ordered by descending amount.
+    """
+
+    options = []
+    best_in_group = {}
+
+    for candidate in candidates:
+        (key, group, amount) = candidate
+
+        if amount <= 0:
+            continue
+
+        if group is None:
+            options.append(candidate)
+        elif group not in best_in_group or \
+                amount > best_in_group[group][2]:
+            best_in_group[group] = candidate
+
+    options.extend(best_in_group.values())
+
+    # Sort on descending amount; the input order breaks ties
+    options.sort(key=lambda candidate: candidate[2], reverse=True)
+
+    if max_stacked is not None:
+        options = options[:max_stacked]
+
+    if limit is None:
+        return options
+
+    selected = []
+    total = 0
+    for candidate in options:
+        if total >= limit:
+            break
+
+        selected.append(candidate)
+        total += candidate[2]
+
+    logger.debug(u'Selected %d out of %d discount candidates',
+                 len(selected), len(options))
+
+    return selected
@@ -0,0 +1,210 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import datetime
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models
+
+from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils.cache import get_version
+from shopkit.discounts.advanced.tracing import \
+    trace_discounts, attach_trace, get_active_trace
+
+
+class TracedCalculation(object):
+    """
+    Stand-in for a cart, order or item calculating the discounts for a
+    list of discounts, decorated like `get_order_discount`.
+    """
+
+    def __init__(self, discounts):
+        self.discounts = discounts
+
+    def __unicode__(self):
+        return u'traced calculation'
+
+    @attach_trace
+    def get_discount(self):
+        price = Decimal('100.00')
+
+        return [discount.get_discount(order_price=price, item_price=price)
+                for discount in self.discounts]
+
+
+class AdvancedDiscountTestMixin(object):
+    """
+    Base class for testing advanced discounts. Subclasses should implement
+    `make_discounts` to create discounts covering the mixins used by the
+    `Discount` model of the project.
+    """
+
+    def setUp(self):
+        """
+        This makes the `Discount` class from the `SHOPKIT_DISCOUNT_MODEL`
+        available as `self.discount_class` for unittests to make use of.
+        """
+
+        super(AdvancedDiscountTestMixin, self).setUp()
+
+        self.discount_class = \
+            get_model_from_string(settings.SHOPKIT_DISCOUNT_MODEL)
+
+    def make_discounts(self):
+        """
+        Abstract function for creating a list of saved test discounts. As
+        the actual properties of discounts depend on the classes actually
+        implementing them, this function must be overridden in subclasses.
+        """
+        raise NotImplementedError
+
+    def get_validity_kwargs(self):
+        """
+        Return a list of keyword arguments under which validity of the
+        test discounts is checked. Subclasses can extend this, ie. with
+        products or categories.
+        """
+        today = datetime.date.today()
+
+        return [
+            {},
+            {'order_discounts': True},
+            {'order_discounts': False},
+            {'item_discounts': True},
+            {'item_discounts': False},
+            {'order_discounts': True, 'coupon_code': 'TESTCOUPON'},
+            {'item_discounts': True, 'date': today},
+            {'item_discounts': True,
+             'date': today + datetime.timedelta(days=365)},
+        ]
+
+    def get_discounts(self):
+        """ Return all discounts with their relations prefetched. """
+        discounts = self.discount_class.objects.all()
+
+        prefetch = []
+        for field in self.discount_class._meta.many_to_many:
+            prefetch.append(field.name)
+
+        if prefetch:
+            discounts = discounts.prefetch_related(*prefetch)
+
+        return list(discounts)
+
+    def test_is_valid_agrees(self):
+        """
+        Test whether `check_valid` and `is_valid_query` agree for all
+        test discounts.
+        """
+
+        self.make_discounts()
+
+        for discount in self.get_discounts():
+            for kwargs in self.get_validity_kwargs():
+                self.assertEqual(discount.check_valid(**kwargs),
+                                 discount.is_valid_query(**kwargs),
+                                 'Validity of %s differs for %s' % \
+                                    (discount, kwargs))
+
+    def test_is_valid_queries(self):
+        """ Test whether `is_valid` runs no queries. """
+
+        self.make_discounts()
+
+        discounts = self.get_discounts()
+
+        with self.assertNumQueries(0):
+            for discount in discounts:
+                for kwargs in self.get_validity_kwargs():
+                    discount.is_valid(**kwargs)
+
+    def test_related_managers(self):
+        """
+        Test whether the managers for relations to discounts, which Django
+        derives from the discount manager, work and bump the version of
+        the discounts upon bulk changes.
+        """
+
+        self.make_discounts()
+
+        opts = self.discount_class._meta
+        fields = [field for field in opts.fields + opts.many_to_many
+                  if isinstance(field, (models.ForeignKey,
+                                        models.ManyToManyField))]
+
+        for discount in self.get_discounts():
+            for field in fields:
+                if isinstance(field, models.ManyToManyField):
+                    related = list(getattr(discount, field.name).all())
+                else:
+                    related = [getattr(discount, field.name)]
+
+                for obj in related:
+                    if obj is None:
+                        continue
+
+                    manager = getattr(obj, field.related.get_accessor_name())
+
+                    self.assertTrue(discount in manager.all())
+
+                    version = get_version('discounts')
+                    manager.all().update(used=models.F('used'))
+
+                    self.assertNotEqual(get_version('discounts'), version)
+
+    def test_trace_nesting(self):
+        """
+        Test whether nested traces join the active trace, even when it does
+        not have any entries yet.
+        """
+
+        with trace_discounts() as outer:
+            self.assertEqual(len(outer), 0)
+
+            with trace_discounts() as inner:
+                self.assertTrue(inner is outer)
+
+            self.assertTrue(get_active_trace() is outer)
+
+        self.assertEqual(get_active_trace(), None)
+
+    def test_trace_records_entries(self):
+        """
+        Test whether the contributions of discounts calculated by a method
+        decorated with `attach_trace` are recorded in an enclosing trace.
+        """
+
+        self.make_discounts()
+
+        calculation = TracedCalculation(self.get_discounts())
+
+        with trace_discounts() as trace:
+            calculation.get_discount()
+
+            self.assertTrue(get_active_trace() is trace)
+
+            # A second calculation is recorded in the same trace
+            entries = len(trace)
+            calculation.get_discount()
+
+        self.assertTrue(entries > 0)
+        self.assertEqual(len(trace), 2*entries)
+        self.assertEqual(len(trace.get_contributions()), len(trace))
+        self.assertEqual(get_active_trace(), None)
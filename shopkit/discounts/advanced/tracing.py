@@ -0,0 +1,329 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Opt-in tracing for the discount engine.
+
+When tracing is active, every step in the `get_valid_discounts` chain and
+every contribution to `get_discount` is recorded in a :class:`DiscountTrace`
+with the time spent and the number of queries performed. Tracing can be
+activated for a block of code::
+
+    with trace_discounts() as trace:
+        cart.get_discount()
+
+    for entry in trace:
+        ...
+
+Alternatively, set `SHOPKIT_DISCOUNT_TRACING` to have every discount
+calculation store its trace in a `discount_trace` attribute. When tracing
+is not active, the overhead of the decorators in this module is limited to
+a single attribute lookup.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import threading
+import time
+
+from functools import wraps
+
+from django.db import connection
+from django.utils.html import escape
+
+from shopkit.discounts.settings import TRACING
+
+
+_local = threading.local()
+
+
+def get_active_trace():
+    """ Return the currently active trace or `None`. """
+    return getattr(_local, 'trace', None)
+
+
+def _get_owner(cls, name, wrapper):
+    """
+    Get the name of the class in the MRO of `cls` which defines the method
+    `name` as `wrapper`: the mixin a traced step belongs to.
+    """
+    for klass in cls.__mro__:
+        attr = klass.__dict__.get(name)
+
+        if getattr(attr, '__func__', attr) is wrapper:
+            return klass.__name__
+
+    return name
+
+
+class DiscountTrace(object):
+    """
+    Structured record of a discount evaluation. Entries are dictionaries
+    with the following keys:
+
+    * `kind`: either `'filter'` or `'discount'`
+    * `mixin`: name of the mixin class performing the step
+    * `subject`: textual representation of the cart, order or item evaluated
+    * `time`: time spent in the step itself, in seconds
+    * `queries`: number of queries performed by the step itself
+
+    Filter steps furthermore contain `valid`, `admitted` and `rejected`
+    lists of discount primary keys. Discount steps contain the `discount`,
+    the `amount` yielded at this point and the `contribution` of the mixin.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.subject = None
+        self._stack = []
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _enter(self):
+        """ Register the start of a traced step. """
+        frame = {'start': time.time(),
+                 'queries': len(connection.queries),
+                 'child_time': 0.0,
+                 'child_queries': 0,
+                 'child_result': None}
+        self._stack.append(frame)
+
+        return frame
+
+    def _leave(self, frame, result, overhead=(0.0, 0)):
+        """
+        Register the end of a traced step, returning the time and number
+        of queries spent in the step itself and the result of the step
+        nested inside it. The time and queries in `overhead`, spent on
+        tracing itself, are not accounted to the step.
+        """
+        assert self._stack[-1] is frame
+        self._stack.pop()
+
+        elapsed = time.time() - frame['start']
+        queries = len(connection.queries) - frame['queries']
+
+        if self._stack:
+            parent = self._stack[-1]
+            parent['child_time'] += elapsed
+            parent['child_queries'] += queries
+            parent['child_result'] = result
+
+        return (elapsed - frame['child_time'] - overhead[0],
+                queries - frame['child_queries'] - overhead[1],
+                frame['child_result'])
+
+    def add(self, kind, mixin, **kwargs):
+        """ Add an entry to the trace. """
+        entry = {'kind': kind,
+                 'mixin': mixin,
+                 'subject': self.subject}
+        entry.update(kwargs)
+
+        logger.debug(u'Discount trace: %s', entry)
+
+        self.entries.append(entry)
+
+    def get_filter_steps(self):
+        """ Return all entries for steps of the `get_valid_discounts` chain. """
+        return [entry for entry in self.entries if entry['kind'] == 'filter']
+
+    def get_contributions(self):
+        """ Return all entries for contributions to `get_discount`. """
+        return [entry for entry in self.entries
+                if entry['kind'] == 'discount']
+
+    def get_total_time(self):
+        """ Total time spent in traced steps. """
+        return sum([entry['time'] for entry in self.entries])
+
+    def get_total_queries(self):
+        """ Total number of queries performed in traced steps. """
+        return sum([entry['queries'] for entry in self.entries])
+
+    def as_html(self):
+        """ Render the trace as a HTML table, ie. for display in the admin. """
+        rows = []
+        for entry in self.entries:
+            if entry['kind'] == 'filter':
+                details = u'admitted: %s, rejected: %s' % \
+                    (entry['admitted'], entry['rejected'])
+            else:
+                details = u'discount %s: %s (+%s)' % \
+                    (entry['discount'], entry['amount'],
+                     entry['contribution'])
+
+            rows.append(u'<tr><td>%s</td><td>%s</td><td>%s</td>'
+                        u'<td>%.2f ms</td><td>%d</td></tr>' % (
+                            escape(entry['subject']), escape(entry['mixin']),
+                            escape(details), entry['time']*1000,
+                            entry['queries']))
+
+        return u'<table>%s</table>' % u''.join(rows)
+
+
+class trace_discounts(object):
+    """
+    Context manager activating discount tracing for the current thread,
+    yielding a new :class:`DiscountTrace`. Nesting is allowed, in which case
+    the outer trace is used.
+
+    For the duration of the trace, queries are logged on the database
+    connection in order to be able to count them.
+    """
+
+    def __enter__(self):
+        self.trace = get_active_trace()
+
+        # An active trace without entries is still an active trace
+        if self.trace is not None:
+            self.owner = False
+        else:
+            self.owner = True
+            self.trace = DiscountTrace()
+            _local.trace = self.trace
+
+            self.use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+
+        return self.trace
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.owner:
+            _local.trace = None
+            connection.use_debug_cursor = self.use_debug_cursor
+
+
+def traced_filter(func):
+    """
+    Decorator for `get_valid_discounts` implementations, to be applied
+    below `@classmethod`. When tracing, the resulting queryset is evaluated
+    in order to record the discounts admitted and rejected by this step.
+    """
+
+    @wraps(func)
+    def wrapper(cls, *args, **kwargs):
+        trace = get_active_trace()
+
+        if trace is None:
+            return func(cls, *args, **kwargs)
+
+        frame = trace._enter()
+        try:
+            valid = func(cls, *args, **kwargs)
+        except:
+            trace._stack.remove(frame)
+            raise
+
+        # Evaluating the queryset is overhead of tracing, not of the step
+        start = time.time()
+        start_queries = len(connection.queries)
+
+        valid_ids = list(valid.values_list('pk', flat=True))
+
+        overhead = (time.time() - start,
+                    len(connection.queries) - start_queries)
+
+        (own_time, own_queries, previous_ids) = \
+            trace._leave(frame, valid_ids, overhead)
+
+        if previous_ids is None:
+            previous_ids = []
+
+        trace.add('filter', _get_owner(cls, func.__name__, wrapper),
+                  valid=valid_ids,
+                  admitted=[pk for pk in valid_ids if pk not in previous_ids],
+                  rejected=[pk for pk in previous_ids if pk not in valid_ids],
+                  time=own_time, queries=own_queries)
+
+        return valid
+
+    return wrapper
+
+
+def traced_discount(func):
+    """
+    Decorator for `get_discount` implementations of discount models,
+    recording the contribution of every mixin to the total discount.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        trace = get_active_trace()
+
+        if trace is None:
+            return func(self, *args, **kwargs)
+
+        frame = trace._enter()
+        try:
+            amount = func(self, *args, **kwargs)
+        except:
+            trace._stack.remove(frame)
+            raise
+
+        (own_time, own_queries, previous) = trace._leave(frame, amount)
+
+        if previous is None:
+            contribution = amount
+        else:
+            contribution = amount - previous
+
+        trace.add('discount', _get_owner(type(self), func.__name__, wrapper),
+                  discount=self.pk, amount=amount, contribution=contribution,
+                  time=own_time, queries=own_queries)
+
+        return amount
+
+    return wrapper
+
+
+def attach_trace(func):
+    """
+    Decorator for discount calculation methods of carts, orders and items.
+    When `SHOPKIT_DISCOUNT_TRACING` is enabled, the calculation is traced
+    and the result is stored in the `discount_trace` attribute of the
+    object. Within an active trace, entries are labeled with the object.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        trace = get_active_trace()
+
+        if trace is None and not TRACING:
+            return func(self, *args, **kwargs)
+
+        with trace_discounts() as trace:
+            previous_subject = trace.subject
+            trace.subject = unicode(self)
+
+            try:
+                result = func(self, *args, **kwargs)
+            finally:
+                trace.subject = previous_subject
+
+        if TRACING:
+            self.discount_trace = trace
+
+        return result
+
+    return wrapper
@@ -25,6 +25,8 @@ from shopkit.core.basemodels import AbstractPricedItemBase
 
 from django.utils.translation import ugettext_lazy as _
 
+from shopkit.currency.money import sum_decimals
+
 # Get the currently configured currency field, whatever it is
 from shopkit.currency.utils import get_currency_field
 PriceField = get_currency_field()
@@ -113,14 +115,15 @@ class DiscountedCartBase(DiscountedItemBase):
         Return the total discount. This consists of the sum of discounts
         applicable to orders and the discounts applicable to items.
         """
-        discount = self.get_order_discount(**kwargs)
+        discounts = [self.get_order_discount(**kwargs)]
 
         for item in self.get_items():
             item_discount = item.get_discount(**kwargs)
-            assert isinstance(item_discount, Decimal)
             assert item_discount <= item.get_price_without_discount(), \
                 'Discount is higher than item price - discounted price negative!'
-            discount += item_discount
+            discounts.append(item_discount)
+
+        discount = sum_decimals(discounts)
 
         # Make sure the discount is never higher than the price of
         # the oringal item
@@ -197,12 +200,12 @@ class DiscountedOrderBase(DiscountedItemBase):
         Return the total discount. This consists of the sum of discounts
         applicable to orders and the discounts applicable to items.
         """
-        discount = self.order_discount
+        discounts = [self.order_discount]
 
         for item in self.get_items():
-            item_discount = item.get_discount(**kwargs)
-            assert isinstance(item_discount, Decimal)
-            discount += item_discount
+            discounts.append(item.get_discount(**kwargs))
+
+        discount = sum_decimals(discounts)
 
         # Make sure the discount is never higher than the price of
         # the oringal item
@@ -33,3 +33,34 @@ COUPON_CHARACTERS = getattr(settings, 'SHOPKIT_COUPON_CHARACTERS', '23456789QWER
         the security of your coupon codes might weaken.
 
 """
+
+DATE_CACHE_TIMEOUT = getattr(settings, 'SHOPKIT_DISCOUNT_DATE_CACHE_TIMEOUT', 60*60*24)
+"""
+Number of seconds the set of discounts valid on a given date is kept in
+Django's cache. As cached sets are invalidated whenever a discount is saved
+or deleted, this defaults to a full day.
+"""
+
+TRACING = getattr(settings, 'SHOPKIT_DISCOUNT_TRACING', False)
+"""
+When `True`, every calculation of order or item discounts records a
+:class:`DiscountTrace <shopkit.discounts.advanced.tracing.DiscountTrace>`
+in the `discount_trace` attribute of the cart, order or item. As tracing
+evaluates intermediate querysets, this defaults to `False` and should only
+be enabled for debugging purposes.
+"""
+
+MAX_STACKED = getattr(settings, 'SHOPKIT_DISCOUNT_MAX_STACKED', None)
+"""
+Maximum number of discounts combined on a single order or item by
+:class:`BestCombinationDiscountMixin
+<shopkit.discounts.advanced.models.order_models.BestCombinationDiscountMixin>`.
+Defaults to `None`, imposing no limit.
+"""
+
+APPLIED_DISCOUNT_MODEL = getattr(settings, 'SHOPKIT_APPLIED_DISCOUNT_MODEL', None)
+"""
+(Optional) Model storing the discounts applied to orders and order items,
+along with their amounts. Should be a subclass of :class:`AppliedDiscountBase
+<shopkit.discounts.advanced.models.order_models.AppliedDiscountBase>`.
+"""
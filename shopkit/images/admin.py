@@ -25,8 +25,7 @@ from django.contrib import admin
 from django.utils.translation import ugettext_lazy as _
 
 from shopkit.images.settings import PRODUCTIMAGE_MODEL
-from shopkit.core.utils import get_model_from_string
-productimage_class = get_model_from_string(PRODUCTIMAGE_MODEL)
+from shopkit.core.utils import LazyModel
 
 try:
     from sorl.thumbnail.admin import AdminInlineImageMixin
@@ -47,7 +46,7 @@ except ImportError:
 class ProductImageInline(AdminInlineImageMixin, admin.TabularInline):
     """ Inline admin for product images. """
 
-    model = productimage_class
+    model = LazyModel(PRODUCTIMAGE_MODEL)
     extra = 1
 
 
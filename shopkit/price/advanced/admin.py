@@ -18,17 +18,16 @@
 
 from django.contrib import admin
 
-from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils import LazyModel
 
 from shopkit.price.advanced.forms import PriceInlineFormSet
 from shopkit.price.advanced.settings import PRICE_MODEL
-price_class = get_model_from_string(PRICE_MODEL)
 
 
 class PriceInline(admin.TabularInline):
     """ Inline price admin for prices belonging to products. """
     
-    model = price_class
+    model = LazyModel(PRICE_MODEL)
     
     extra = 1
     """ By default, onlye one extra form is shown, as to prevent clogging up
@@ -0,0 +1,321 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Bulk import of price lists.
+
+Price lists are read as CSV with a header row naming the columns `product`,
+`price` and, depending on the price model, `quantity`, `start_date` and
+`end_date`. Rows are streamed and processed in chunks: the products of a
+chunk are looked up with a single query, its rows are compared with the
+existing prices of these products and only the differences are written,
+using `bulk_create`, one `UPDATE` per distinct new price and batched
+deletes. Every chunk is committed in its own transaction.
+
+As prices of a product are compared as a whole, the rows of a product
+should be contiguous in the price list; sorting the list by product
+suffices.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import csv
+import datetime
+import time
+
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from shopkit.core.settings import PRODUCT_MODEL
+from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils.cache import bump_version
+
+from shopkit.price.advanced.settings import IMPORT_CHUNK_SIZE
+from shopkit.price.advanced.tiers import bump_product_version
+from shopkit.price.advanced.models import refresh_current_prices
+
+
+TIER_FIELDS = ('quantity', 'start_date', 'end_date')
+""" Fields identifying a price of a product, where present in the model. """
+
+DATE_FORMAT = '%Y-%m-%d'
+""" Format of dates in price lists. """
+
+
+class PriceImportError(ValueError):
+    """ Raised for rows of a price list which cannot be imported. """
+    pass
+
+
+class PriceImportReport(object):
+    """ Statistics and rejected rows of a price list import. """
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.chunks = 0
+
+        self.rejected = []
+        """ List of `(line number, message)` tuples. """
+
+        self.started = time.time()
+        self.finished = None
+
+    def get_duration(self):
+        """ Return the number of seconds the import took (so far). """
+        return (self.finished or time.time()) - self.started
+
+    def get_throughput(self):
+        """ Return the number of rows processed per second. """
+        duration = self.get_duration()
+
+        if not duration:
+            return 0.0
+
+        return self.rows / duration
+
+    def __unicode__(self):
+        return u'%d rows in %d chunks (%.0f rows/s): %d created, ' \
+               u'%d updated, %d deleted, %d unchanged, %d rejected' % \
+               (self.rows, self.chunks, self.get_throughput(), self.created,
+                self.updated, self.deleted, self.unchanged,
+                len(self.rejected))
+
+
+def to_text(value):
+    """ Return `value` read from CSV as a stripped unicode string. """
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+
+    return (value or u'').strip()
+
+
+class PriceImporter(object):
+    """
+    Importer for price lists into `price_class`, a subclass of
+    :class:`PriceBase <shopkit.price.advanced.models.PriceBase>` with
+    :class:`ProductPriceMixin <shopkit.price.advanced.models.ProductPriceMixin>`.
+
+    :param product_field: Field of the product model the `product` column
+                          refers to, ie. `pk` or a product code.
+    :param delete: When `True`, existing prices of the imported products
+                   which are absent from the price list are deleted.
+    """
+
+    def __init__(self, price_class, product_field='pk', delete=False,
+                 chunk_size=IMPORT_CHUNK_SIZE):
+        self.price_class = price_class
+        self.product_class = get_model_from_string(PRODUCT_MODEL)
+        self.product_field = product_field
+        self.delete = delete
+        self.chunk_size = chunk_size
+
+        field_names = [field.name for field in price_class._meta.fields]
+        self.tier_fields = [name for name in TIER_FIELDS
+                            if name in field_names]
+
+    def clean_row(self, row):
+        """
+        Return a tuple with the product key, the tier (a tuple with the
+        values of the tier fields) and the price for a CSV `row`.
+
+        :raises: :class:`PriceImportError` for invalid rows.
+        """
+
+        product = to_text(row.get('product'))
+        if not product:
+            raise PriceImportError(u'No product specified')
+
+        tier = []
+        for name in self.tier_fields:
+            value = to_text(row.get(name))
+
+            try:
+                if name == 'quantity':
+                    value = int(value or 0)
+                else:
+                    value = datetime.datetime.strptime(value,
+                                                       DATE_FORMAT).date()
+            except ValueError:
+                raise PriceImportError(u'Invalid %s: %r' % (name, value))
+
+            tier.append(value)
+
+        try:
+            price = Decimal(to_text(row.get('price')))
+        except InvalidOperation:
+            raise PriceImportError(u'Invalid price: %r' % row.get('price'))
+
+        return (product, tuple(tier), price)
+
+    def read_chunks(self, rows, report):
+        """
+        Clean `rows` and yield chunks of `(line, product, tier, price)`
+        tuples of about `chunk_size` rows, ending at product boundaries.
+        """
+
+        chunk = []
+        seen = set()
+        previous = None
+        for (line, row) in enumerate(rows, 2):
+            report.rows += 1
+
+            try:
+                (product, tier, price) = self.clean_row(row)
+            except PriceImportError as e:
+                report.rejected.append((line, unicode(e)))
+                continue
+
+            if product != previous:
+                if product in seen:
+                    report.rejected.append((line,
+                        u'Rows for product %s are not contiguous' % product))
+                    continue
+
+                if len(chunk) >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+
+                seen.add(product)
+                previous = product
+
+            chunk.append((line, product, tier, price))
+
+        if chunk:
+            yield chunk
+
+    def get_products(self, keys):
+        """ Return a dictionary mapping product `keys` to primary keys. """
+
+        lookup = {'%s__in' % self.product_field: keys}
+        products = self.product_class.objects.filter(**lookup)
+
+        rows = products.values_list(self.product_field, 'pk')
+
+        return dict([(unicode(key), pk) for (key, pk) in rows])
+
+    def get_existing(self, product_pks):
+        """
+        Return a dictionary mapping `(product pk, tier)` to `(pk, price)`
+        for the existing prices of `product_pks`.
+        """
+
+        fields = ['pk', 'product', 'price'] + self.tier_fields
+        prices = self.price_class.objects.filter(product__in=product_pks)
+
+        existing = {}
+        for values in prices.values_list(*fields):
+            (pk, product_pk, price) = values[:3]
+            existing[(product_pk, tuple(values[3:]))] = (pk, price)
+
+        return existing
+
+    def import_chunk(self, chunk, report):
+        """ Import the changes for a single `chunk` of cleaned rows. """
+
+        products = self.get_products(
+            list(set([product for (line, product, tier, price) in chunk])))
+
+        rows = {}
+        for (line, product, tier, price) in chunk:
+            if not product in products:
+                report.rejected.append((line,
+                    u'Product %s not found' % product))
+                continue
+
+            rows[(products[product], tier)] = price
+
+        existing = self.get_existing(list(set(products.values())))
+
+        create = []
+        updates = {}
+        for ((product_pk, tier), price) in rows.items():
+            if (product_pk, tier) in existing:
+                (pk, current) = existing[(product_pk, tier)]
+
+                if current == price:
+                    report.unchanged += 1
+                else:
+                    updates.setdefault(price, []).append(pk)
+            else:
+                values = dict(zip(self.tier_fields, tier))
+                create.append(self.price_class(product_id=product_pk,
+                                               price=price, **values))
+
+        delete = []
+        if self.delete:
+            delete = [pk for (key, (pk, current)) in existing.items()
+                      if not key in rows]
+
+        with transaction.commit_on_success():
+            if create:
+                self.price_class.objects.bulk_create(create)
+
+            for (price, pks) in updates.items():
+                self.price_class.objects.filter(pk__in=pks).update(
+                    price=price)
+
+            if delete:
+                self.price_class.objects.filter(pk__in=delete).delete()
+
+        report.created += len(create)
+        report.updated += sum([len(pks) for pks in updates.values()])
+        report.deleted += len(delete)
+        report.chunks += 1
+
+        # Bulk operations bypass save(), invalidate caches explicitly
+        if create or updates or delete:
+            bump_version('prices')
+
+            for product_pk in set(products.values()):
+                bump_product_version(product_pk)
+
+            refresh_current_prices(list(set(products.values())))
+
+        logger.debug(u'Imported chunk %d: %s', report.chunks,
+                     unicode(report))
+
+    def import_rows(self, rows):
+        """
+        Import an iterable of `rows`, dictionaries with values for the
+        columns, returning a :class:`PriceImportReport`.
+        """
+
+        report = PriceImportReport()
+
+        for chunk in self.read_chunks(rows, report):
+            self.import_chunk(chunk, report)
+
+        report.finished = time.time()
+
+        logger.info(u'Imported price list: %s', unicode(report))
+
+        return report
+
+    def import_file(self, csvfile, **kwargs):
+        """
+        Import the price list in the open file `csvfile`, passing `kwargs`
+        on to :class:`csv.DictReader`.
+        """
+
+        return self.import_rows(csv.DictReader(csvfile, **kwargs))
@@ -0,0 +1,66 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopkit.core.utils import get_model_from_string
+
+from shopkit.price.advanced.settings import PRICE_MODEL, IMPORT_CHUNK_SIZE
+from shopkit.price.advanced.importer import PriceImporter
+
+
+class Command(BaseCommand):
+    args = '<pricelist.csv>'
+    help = 'Import a CSV price list into the price model.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--product-field', dest='product_field', default='pk',
+                    help='Product field referred to by the product column.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=IMPORT_CHUNK_SIZE,
+                    help='Number of rows per transaction.'),
+        make_option('--delimiter', dest='delimiter', default=',',
+                    help='Column delimiter of the price list.'),
+        make_option('--delete', dest='delete', action='store_true',
+                    default=False,
+                    help='Delete prices of imported products which are '
+                         'absent from the price list.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Please specify a single price list.')
+
+        price_class = get_model_from_string(PRICE_MODEL)
+
+        importer = PriceImporter(price_class,
+                                 product_field=options['product_field'],
+                                 delete=options['delete'],
+                                 chunk_size=options['chunk_size'])
+
+        with open(args[0], 'rb') as csvfile:
+            report = importer.import_file(csvfile,
+                delimiter=str(options['delimiter']))
+
+        for (line, message) in report.rejected:
+            self.stderr.write('Line %d rejected: %s\n' % \
+                              (line, message.encode('utf-8')))
+
+        self.stdout.write('%s\n' % unicode(report).encode('utf-8'))
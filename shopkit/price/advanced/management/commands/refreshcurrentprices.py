@@ -0,0 +1,55 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import datetime
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopkit.core.settings import PRODUCT_MODEL
+from shopkit.core.utils import get_model_from_string
+
+from shopkit.price.advanced.models import CurrentPriceProductMixin
+
+
+class Command(BaseCommand):
+    help = 'Refresh the stored current prices of all products. Run this ' \
+           'daily, shortly after midnight.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--date', dest='date', default=None,
+                    help='Date (YYYY-MM-DD) to determine prices for, '
+                         'defaults to today.'),
+    )
+
+    def handle(self, *args, **options):
+        product_class = get_model_from_string(PRODUCT_MODEL)
+
+        if not issubclass(product_class, CurrentPriceProductMixin):
+            raise CommandError('The product model does not store current '
+                               'prices.')
+
+        date = options['date']
+        if date:
+            try:
+                date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid date: %s' % date)
+
+        product_class.refresh_current_prices(date=date)
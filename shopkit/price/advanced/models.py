@@ -16,16 +16,26 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import logging
+logger = logging.getLogger(__name__)
+
 import datetime
 
-from django.db import models
+from django.db import models, connections
 
 from django.utils.translation import ugettext_lazy as _
 
-from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils import get_model_from_string, get_pks
 from shopkit.core.settings import PRODUCT_MODEL
 from shopkit.core.basemodels import QuantizedItemBase
 from shopkit.price.models import PricedItemBase
+from shopkit.price.advanced.settings import \
+    PRICE_MODEL, TIER_CACHE_SIZE, CURRENT_PRICE_CHUNK_SIZE
+from shopkit.price.advanced.tiers import get_tier_cache, bump_product_version
+
+# Get the currently configured currency field, whatever it is
+from shopkit.currency.utils import get_currency_field
+PriceField = get_currency_field()
 
 
 class PriceBase(PricedItemBase):
@@ -42,14 +52,13 @@ class PriceBase(PricedItemBase):
     @staticmethod
     def _get_minimal_price(qs):
         """
-        Get the price object with the lowest price
-        within the given QuerySet.
-        """
+        Get the price object with the lowest price within the given
+        QuerySet, using a single query.
 
-        assert qs.count(), \
-            'FIXME: No prices found. This will raise an exception that should be called.'
+        :raises: `DoesNotExist` of the price model when no prices are found.
+        """
 
-        return qs.order_by('price')[0]
+        return qs.order_by('price', 'pk')[:1].get()
 
 
     @classmethod
@@ -101,16 +110,170 @@ class ProductPriceMixin(models.Model):
     """ Product this price relates to. """
 
     @classmethod
-    def get_valid_prices(cls, product, *args, **kwargs):
-        """ Return valid prices for a specified product """
+    def get_valid_prices(cls, product=None, products=None, *args, **kwargs):
+        """
+        Return valid prices for a specified `product`, or for any of the
+        `products` specified.
+        """
 
         valid = \
             super(ProductPriceMixin, cls).get_valid_prices(*args, **kwargs)
 
-        valid = valid.filter(product=product)
+        if not product is None:
+            valid = valid.filter(product=product)
+        elif not products is None:
+            valid = valid.filter(product__in=products)
 
         return valid
 
+    @classmethod
+    def get_cheapest_for(cls, products, **kwargs):
+        """
+        Return a dictionary mapping the primary keys of `products` to their
+        cheapest valid price, using a single query. Products without a valid
+        price are left out.
+
+        On databases supporting `DISTINCT ON` (PostgreSQL), only the
+        cheapest price per product is retrieved. Elsewhere, all valid
+        prices are scanned in order of price.
+
+        :param kwargs: Passed on to `get_valid_prices`, ie. `quantity` or
+                       `date`.
+        """
+
+        valid = cls.get_valid_prices(products=products, **kwargs)
+
+        features = connections[valid.db].features
+
+        cheapest = {}
+        if getattr(features, 'can_distinct_on_fields', False):
+            # Order by the column itself rather than the relation, which
+            # would expand to the `Meta.ordering` of the product model and
+            # no longer match the DISTINCT ON expression
+            valid = valid.order_by('product__id', 'price', 'pk')
+            valid = valid.distinct('product__id')
+
+            for price in valid:
+                cheapest[price.product_id] = price
+
+        else:
+            for price in valid.order_by('price', 'pk'):
+                cheapest.setdefault(price.product_id, price)
+
+        return cheapest
+
+    def save(self, *args, **kwargs):
+        """ Invalidate cached price tiers for the product upon saving. """
+        super(ProductPriceMixin, self).save(*args, **kwargs)
+
+        bump_product_version(self.product_id)
+        refresh_current_prices([self.product_id])
+
+    def delete(self, *args, **kwargs):
+        """ Invalidate cached price tiers for the product upon deletion. """
+        product_pk = self.product_id
+
+        super(ProductPriceMixin, self).delete(*args, **kwargs)
+
+        bump_product_version(product_pk)
+        refresh_current_prices([product_pk])
+
+
+def refresh_current_prices(products):
+    """
+    Refresh the current prices of `products` when the product model is a
+    subclass of :class:`CurrentPriceProductMixin`.
+    """
+    product_class = get_model_from_string(PRODUCT_MODEL)
+
+    if issubclass(product_class, CurrentPriceProductMixin):
+        product_class.refresh_current_prices(products)
+
+
+class CurrentPriceProductMixin(models.Model):
+    """
+    Mixin for products storing their current price: the cheapest price for
+    a single piece today. This allows for catalog views to show, sort and
+    filter by price without evaluating prices for every product.
+
+    The current price is refreshed whenever a price of the product is saved
+    or deleted. As prices might become valid or invalid at day boundaries,
+    the `refreshcurrentprices` management command should be run daily,
+    shortly after midnight.
+    """
+
+    class Meta:
+        abstract = True
+
+    current_price = PriceField(verbose_name=_('current price'),
+                               null=True, blank=True, db_index=True,
+                               editable=False)
+    """ Cheapest price for a single piece on `current_price_date`. """
+
+    current_price_date = models.DateField(verbose_name=_('current price date'),
+                                          null=True, blank=True,
+                                          editable=False)
+    """ Date for which `current_price` has been determined. """
+
+    @classmethod
+    def refresh_current_prices(cls, products=None, date=None):
+        """
+        Store the current prices for `products` (defaulting to all
+        products) on `date` (defaulting to today). Prices are determined
+        for `CURRENT_PRICE_CHUNK_SIZE` products per query and written with
+        one `UPDATE` per distinct price.
+        """
+
+        price_class = get_model_from_string(PRICE_MODEL)
+
+        if not date:
+            date = datetime.date.today()
+
+        if products is None:
+            product_pks = list(cls.objects.values_list('pk', flat=True))
+        else:
+            product_pks = list(get_pks(products))
+
+        for start in range(0, len(product_pks), CURRENT_PRICE_CHUNK_SIZE):
+            chunk = product_pks[start:start+CURRENT_PRICE_CHUNK_SIZE]
+
+            cheapest = price_class.get_cheapest_for(chunk, quantity=1,
+                                                    date=date)
+
+            updates = {}
+            for product_pk in chunk:
+                price = cheapest.get(product_pk, None)
+
+                if price is None:
+                    value = None
+                else:
+                    value = price.get_price()
+
+                updates.setdefault(value, []).append(product_pk)
+
+            for (value, pks) in updates.items():
+                cls.objects.filter(pk__in=pks).update(current_price=value,
+                                                      current_price_date=date)
+
+        logger.debug(u'Refreshed current prices of %d products for %s',
+                     len(product_pks), date)
+
+    def get_current_price(self):
+        """
+        Return the current price for this product. When the stored price
+        has not been refreshed today, the price is looked up instead.
+
+        :raises: `DoesNotExist` of the price model when no prices are found.
+        """
+
+        if self.current_price_date == datetime.date.today() and \
+                not self.current_price is None:
+            return self.current_price
+
+        price_class = get_model_from_string(PRICE_MODEL)
+
+        return price_class.get_cheapest(product=self, quantity=1).get_price()
+
 
 class DateRangedPriceMixin(models.Model):
     """ Base class for a price that is only valid within a given date range.
@@ -135,11 +298,11 @@ class DateRangedPriceMixin(models.Model):
 
         # If no date is set, take today.
         if not date:
-            date = datetime.datetime.today()
+            date = datetime.date.today()
 
         # First get valid prices for the current situation
-        valid = valid.filter(start_date__gte=date,
-                             end_date__lte=date)
+        valid = valid.filter(start_date__lte=date,
+                             end_date__gte=date)
 
         return valid
 
@@ -161,12 +324,58 @@ class QuantifiedPriceMixin(QuantizedItemBase):
         valid = \
             super(QuantifiedPriceMixin, cls).get_valid_prices(*args, **kwargs)
 
-        # First get valid prices for the current situation
-        valid = valid.filter(quantity__gte=quantity)
+        # Prices apply from their quantity on
+        valid = valid.filter(quantity__lte=quantity)
 
         return valid
 
 
+class TieredPriceMixin(models.Model):
+    """
+    Mixin for price models which looks up the cheapest price for a product
+    in an in-memory :class:`PriceTiers
+    <shopkit.price.advanced.tiers.PriceTiers>` index rather than querying
+    the database. Tiers are loaded per product on first use and reloaded
+    after any price of the product has been saved or deleted.
+
+    The index implements the validity rules of :class:`ProductPriceMixin`,
+    :class:`DateRangedPriceMixin` and :class:`QuantifiedPriceMixin`. When
+    `get_cheapest` is called with any other arguments, the lookup is passed
+    on to the regular `get_valid_prices` chain. This class should be listed
+    first among the base classes of the price model.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_cheapest(cls, product=None, quantity=1, date=None, **kwargs):
+        """
+        Get the cheapest available price for `product`.
+
+        :raises: `DoesNotExist` of the price model when no prices are found.
+        """
+
+        if kwargs or product is None:
+            superclass = super(TieredPriceMixin, cls)
+
+            if not product is None:
+                kwargs['product'] = product
+
+            return superclass.get_cheapest(quantity=quantity, date=date,
+                                           **kwargs)
+
+        tiers = get_tier_cache(cls, TIER_CACHE_SIZE).get_tiers(
+            getattr(product, 'pk', product))
+
+        cheapest = tiers.get_cheapest(quantity, date)
+
+        if cheapest is None:
+            raise cls.DoesNotExist('No valid price found for %s' % product)
+
+        return cheapest
+
+
 # class PricedItemBase(models.Model):
 #     """ Abstract base class for an advanced priced product.
 #         This base class allows for more complex pricing of articles, it
@@ -19,3 +19,23 @@
 from django.conf import settings
 
 PRICE_MODEL = getattr(settings, 'SHOPKIT_PRICE_MODEL')
+""" Model used for prices. """
+
+TIER_CACHE_SIZE = getattr(settings, 'SHOPKIT_PRICE_TIER_CACHE_SIZE', 1000)
+"""
+Maximal number of products for which price tiers are kept in memory by
+:class:`TieredPriceMixin`. When exceeded, the least recently used
+products are evicted.
+"""
+
+IMPORT_CHUNK_SIZE = getattr(settings, 'SHOPKIT_PRICE_IMPORT_CHUNK_SIZE', 1000)
+"""
+Approximate number of rows processed per transaction when importing price
+lists. Chunks are only ended at product boundaries.
+"""
+
+CURRENT_PRICE_CHUNK_SIZE = getattr(settings, 'SHOPKIT_PRICE_CURRENT_PRICE_CHUNK_SIZE', 500)
+"""
+Number of products for which current prices are refreshed per query by
+:class:`CurrentPriceProductMixin`.
+"""
@@ -0,0 +1,204 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+In-memory index of price tiers.
+
+Prices can depend on the quantity ordered and the date, both of which
+translate into a filtered query for every lookup. As the tiers of a product
+rarely change, they are loaded once into a :class:`PriceTiers` structure
+answering lookups with two bisections. Tiers are loaded lazily per product,
+kept for a limited number of recently used products and reloaded after a
+price of the product has been saved or deleted.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import datetime
+import threading
+
+from bisect import bisect_right
+from collections import OrderedDict
+
+from shopkit.core.utils.cache import get_version, bump_version
+
+
+def get_product_version_name(product_pk):
+    """ Return the cache version name for the prices of a product. """
+    return 'prices:%s' % product_pk
+
+
+def bump_product_version(product_pk):
+    """ Invalidate the cached tiers for the product with `product_pk`. """
+    return bump_version(get_product_version_name(product_pk))
+
+
+class PriceTiers(object):
+    """
+    Prices of a single product compiled into segments of dates in which the
+    same prices are valid. Within each segment, prices are sorted by their
+    minimal quantity and, for every quantity, the cheapest price valid from
+    that quantity on is stored.
+
+    Prices without a `start_date`, `end_date` or `quantity` are valid from
+    and until any date or for any quantity, respectively.
+    """
+
+    def __init__(self, prices):
+        """ Compile tiers from an iterable of `prices`. """
+
+        rows = []
+        boundaries = set()
+        for price in prices:
+            start_date = getattr(price, 'start_date', None)
+            end_date = getattr(price, 'end_date', None)
+
+            if start_date:
+                boundaries.add(start_date)
+
+            if end_date:
+                boundaries.add(end_date + datetime.timedelta(days=1))
+
+            rows.append((start_date, end_date,
+                         getattr(price, 'quantity', 0) or 0, price))
+
+        # Segment i spans the dates from boundary i-1 until boundary i
+        self.boundaries = sorted(boundaries)
+
+        self.segments = [self.compile(rows, None)]
+        for boundary in self.boundaries:
+            self.segments.append(self.compile(rows, boundary))
+
+    @staticmethod
+    def compile(rows, date):
+        """
+        Compile the `rows` valid on `date`, or before the first boundary
+        when `date` is `None`, into a tuple with a list of ascending
+        quantities and a list with, for every quantity, the cheapest price
+        with this or a lower quantity.
+        """
+
+        active = []
+        for (start_date, end_date, quantity, price) in rows:
+            if date is None:
+                if start_date:
+                    continue
+            elif (start_date and start_date > date) or \
+                    (end_date and end_date < date):
+                continue
+
+            active.append((quantity, price))
+
+        active.sort(key=lambda row: row[0])
+
+        quantities = []
+        cheapest = []
+
+        best = None
+        for (quantity, price) in active:
+            if best is None or \
+                    (price.price, price.pk) < (best.price, best.pk):
+                best = price
+
+            quantities.append(quantity)
+            cheapest.append(best)
+
+        return (quantities, cheapest)
+
+    def get_cheapest(self, quantity=1, date=None):
+        """
+        Return the cheapest price for `quantity` on `date`, or `None` if no
+        price is valid.
+        """
+
+        if not date:
+            date = datetime.date.today()
+
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+
+        (quantities, cheapest) = \
+            self.segments[bisect_right(self.boundaries, date)]
+
+        index = bisect_right(quantities, quantity)
+
+        if not index:
+            return None
+
+        return cheapest[index-1]
+
+
+class PriceTierCache(object):
+    """
+    Least recently used cache of :class:`PriceTiers` for the products of
+    `price_class`, holding at most `size` products.
+    """
+
+    def __init__(self, price_class, size):
+        self.price_class = price_class
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_tiers(self, product_pk):
+        """ Return the :class:`PriceTiers` for the product `product_pk`. """
+
+        version = get_version(get_product_version_name(product_pk))
+
+        with self._lock:
+            entry = self._entries.pop(product_pk, None)
+
+            if entry and entry[0] == version:
+                # Mark as most recently used
+                self._entries[product_pk] = entry
+
+                return entry[1]
+
+        logger.debug(u'Loading price tiers for product %s', product_pk)
+
+        prices = self.price_class.objects.filter(product=product_pk)
+        tiers = PriceTiers(prices)
+
+        with self._lock:
+            self._entries[product_pk] = (version, tiers)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+        return tiers
+
+    def clear(self):
+        """ Discard all tiers cached in this process. """
+        with self._lock:
+            self._entries.clear()
+
+
+_tier_caches = {}
+
+
+def get_tier_cache(price_class, size):
+    """ Return the :class:`PriceTierCache` for `price_class`. """
+
+    key = (price_class._meta.app_label, price_class._meta.object_name)
+
+    if not key in _tier_caches:
+        _tier_caches[key] = PriceTierCache(price_class, size)
+
+    return _tier_caches[key]
@@ -0,0 +1,205 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import logging
+logger = logging.getLogger(__name__)
+
+import datetime
+
+from django.db import models, connections
+from django.db.models.query import QuerySet
+
+from shopkit.core.utils import get_model_from_string
+
+
+PRICE_ALIAS = 'shopkit_price'
+""" Table alias for prices in the effective price subquery. """
+
+
+def get_price_class():
+    """
+    Return the advanced price model, or `None` when the advanced price
+    module is not in use.
+    """
+    try:
+        from shopkit.price.advanced.settings import PRICE_MODEL
+    except AttributeError:
+        return None
+
+    return get_model_from_string(PRICE_MODEL)
+
+
+class PricedProductQuerySet(QuerySet):
+    """
+    `QuerySet` for products which can order and filter by the effective
+    price in the database. The effective price is obtained from:
+
+    1. The `current_price` column of :class:`CurrentPriceProductMixin
+       <shopkit.price.advanced.models.CurrentPriceProductMixin>`, when
+       neither a date nor a quantity other than 1 is specified. Products of
+       which the current price has not been refreshed today fall back to
+       the subquery of 3.
+    2. The `price` column of :class:`PricedItemBase
+       <shopkit.price.models.PricedItemBase>`.
+    3. A subquery for the cheapest valid advanced price otherwise.
+    """
+
+    def get_price_expression(self, date=None, quantity=1):
+        """
+        Return a tuple with SQL for the effective price of products and
+        a list of parameters for it.
+        """
+
+        qn = connections[self.db].ops.quote_name
+        opts = self.model._meta
+
+        field_names = [field.name for field in opts.fields]
+
+        if 'current_price' in field_names and date is None and quantity == 1:
+            today = datetime.date.today()
+
+            def product_column(name):
+                return '%s.%s' % (qn(opts.db_table),
+                                  qn(opts.get_field(name).column))
+
+            (sql, params) = self.get_cheapest_expression(today, quantity)
+
+            sql = 'CASE WHEN %s = %%s THEN %s ELSE %s END' % \
+                  (product_column('current_price_date'),
+                   product_column('current_price'), sql)
+
+            return (sql, [today] + params)
+
+        if 'price' in field_names:
+            column = opts.get_field('price').column
+
+            return ('%s.%s' % (qn(opts.db_table), qn(column)), [])
+
+        return self.get_cheapest_expression(date, quantity)
+
+    def get_cheapest_expression(self, date=None, quantity=1):
+        """
+        Return a tuple with SQL for a subquery selecting the cheapest valid
+        advanced price of products and a list of parameters for it.
+        """
+
+        qn = connections[self.db].ops.quote_name
+        opts = self.model._meta
+
+        price_class = get_price_class()
+        assert price_class, \
+            'No price field or advanced price model to determine prices from.'
+
+        price_opts = price_class._meta
+        price_fields = [field.name for field in price_opts.fields]
+
+        def column(name):
+            return '%s.%s' % (qn(PRICE_ALIAS),
+                              qn(price_opts.get_field(name).column))
+
+        if not date:
+            date = datetime.date.today()
+
+        conditions = ['%s = %s.%s' % (column('product'), qn(opts.db_table),
+                                      qn(opts.pk.column))]
+        params = []
+
+        if 'start_date' in price_fields:
+            conditions.append('%s <= %%s' % column('start_date'))
+            params.append(date)
+
+        if 'end_date' in price_fields:
+            conditions.append('%s >= %%s' % column('end_date'))
+            params.append(date)
+
+        if 'quantity' in price_fields:
+            conditions.append('%s <= %%s' % column('quantity'))
+            params.append(quantity)
+
+        sql = '(SELECT MIN(%s) FROM %s %s WHERE %s)' % \
+              (column('price'), qn(price_opts.db_table), qn(PRICE_ALIAS),
+               ' AND '.join(conditions))
+
+        return (sql, params)
+
+    def with_price(self, date=None, quantity=1):
+        """
+        Annotate products with their effective price as `effective_price`.
+        Depending on the database backend, this might be a float.
+        """
+        (sql, params) = self.get_price_expression(date, quantity)
+
+        return self.extra(select={'effective_price': sql},
+                          select_params=params)
+
+    def filter_price(self, min_price=None, max_price=None, date=None,
+                     quantity=1):
+        """
+        Return products of which the effective price lies between
+        `min_price` and `max_price` (inclusive).
+        """
+        (sql, params) = self.get_price_expression(date, quantity)
+
+        qs = self
+        if not min_price is None:
+            qs = qs.extra(where=['%s >= %%s' % sql],
+                          params=params + [min_price])
+
+        if not max_price is None:
+            qs = qs.extra(where=['%s <= %%s' % sql],
+                          params=params + [max_price])
+
+        return qs
+
+    def order_by_price(self, descending=False, date=None, quantity=1):
+        """
+        Order products by their effective price, annotating them with
+        `effective_price`.
+        """
+        qs = self.with_price(date, quantity)
+
+        if descending:
+            return qs.extra(order_by=['-effective_price'])
+
+        return qs.extra(order_by=['effective_price'])
+
+
+class PricedProductManager(models.Manager):
+    """
+    Manager for products exposing the methods of
+    :class:`PricedProductQuerySet`, such that products can be ordered,
+    filtered and paginated by price in the database::
+
+        class Product(...):
+            objects = PricedProductManager()
+
+        Product.objects.filter_price(10, 50).order_by_price()
+
+    """
+
+    def get_query_set(self):
+        return PricedProductQuerySet(self.model, using=self._db)
+
+    def with_price(self, *args, **kwargs):
+        return self.get_query_set().with_price(*args, **kwargs)
+
+    def filter_price(self, *args, **kwargs):
+        return self.get_query_set().filter_price(*args, **kwargs)
+
+    def order_by_price(self, *args, **kwargs):
+        return self.get_query_set().order_by_price(*args, **kwargs)
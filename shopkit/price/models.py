@@ -21,6 +21,7 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
 from shopkit.core.basemodels import AbstractPricedItemBase
+from shopkit.core.utils.cache import bump_version
 
 # Get the currently configured currency field, whatever it is
 from shopkit.currency.utils import get_currency_field
@@ -42,3 +43,15 @@ class PricedItemBase(AbstractPricedItemBase):
     def get_price(self, **kwargs):
         """ Returns the price property of the current product. """
         return self.price
+
+    def save(self, *args, **kwargs):
+        """ Invalidate cached price data upon saving. """
+        super(PricedItemBase, self).save(*args, **kwargs)
+
+        bump_version('prices')
+
+    def delete(self, *args, **kwargs):
+        """ Invalidate cached price data upon deletion. """
+        super(PricedItemBase, self).delete(*args, **kwargs)
+
+        bump_version('prices')
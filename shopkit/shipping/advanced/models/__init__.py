@@ -20,3 +20,4 @@ from shopkit.shipping.models import \
     ShippableCustomerMixin
 from shopkit.shipping.advanced.models.shipping_models import *
 from shopkit.shipping.advanced.models.order_models import *
+from shopkit.shipping.advanced.models.product_models import *
@@ -25,8 +25,13 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
 from shopkit.core.basemodels import AbstractPricedItemBase
+from shopkit.core.settings import ORDERITEM_MODEL
 from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils.cache import get_version
 
+from shopkit.currency.money import sum_decimals
+
+from shopkit.shipping.advanced.packing import get_parcels
 from shopkit.shipping.advanced.settings import \
     SHIPPING_METHOD_MODEL
 
@@ -68,16 +73,13 @@ class CheapestShippingMixin(AutomaticShippingMixin):
 
         shipping_method_class = get_model_from_string(SHIPPING_METHOD_MODEL)
 
-        shipping_address = getattr(self, 'shipping_address', None)
-        if not 'country' in kwargs and shipping_address:
-            assert self.shipping_address.country
-
-            country = self.shipping_address.country
+        parameters = self.get_shipping_parameters()
+        for (key, value) in parameters.items():
+            if not key in kwargs:
+                logger.debug(u'Using %s %s to find cheapest shipping method for %s',
+                             key, value, self)
 
-            logger.debug(u'Using country %s to find cheapest shipping method for %s',
-                         country, self)
-
-            kwargs['country'] = country
+                kwargs[key] = value
 
         shipping_method = shipping_method_class.get_cheapest(**kwargs)
 
@@ -86,14 +88,153 @@ class CheapestShippingMixin(AutomaticShippingMixin):
         return shipping_method
 
 
+    def get_shipping_parameters(self):
+        """
+        Return a dictionary with the properties of this item used to find
+        valid shipping methods, ie. the `country` of the shipping address.
+        Subclasses can extend this.
+        """
+        parameters = {}
+
+        shipping_address = getattr(self, 'shipping_address', None)
+        if shipping_address:
+            assert shipping_address.country
+
+            parameters['country'] = shipping_address.country
+
+        return parameters
+
+
+class WeightedShippingItemMixin(object):
+    """
+    Mixin for cart and order items of which the weight and volume of the
+    product are used to find valid shipping methods. The product model
+    should be a subclass of :class:`WeightedProductMixin`. List this class
+    before :class:`ShippedCartItemMixin` or :class:`ShippedOrderItemMixin`.
+    """
+
+    def get_shipping_dimensions(self):
+        """
+        Return a tuple with the total weight and volume for this item,
+        either of which is `None` when unknown for the product.
+        """
+        weight = self.product.weight
+        if weight is not None:
+            weight *= self.quantity
+
+        volume = self.product.volume
+        if volume is not None:
+            volume *= self.quantity
+
+        return (weight, volume)
+
+    def get_shipping_parameters(self):
+        """ Add `weight` and `volume` to the shipping parameters. """
+        superclass = super(WeightedShippingItemMixin, self)
+        parameters = superclass.get_shipping_parameters()
+
+        (weight, volume) = self.get_shipping_dimensions()
+
+        if weight is not None:
+            parameters['weight'] = weight
+
+        if volume is not None:
+            parameters['volume'] = volume
+
+        return parameters
+
+
+class WeightedShippingOrderMixin(WeightedShippingItemMixin):
+    """
+    Mixin for carts and orders of which the total weight and volume of the
+    items are used to find valid shipping methods. List this class before
+    :class:`ShippedCartMixin` or :class:`ShippedOrderMixin`.
+    """
+
+    def get_shipping_dimensions(self):
+        """
+        Return a tuple with the total weight and volume of all items,
+        aggregated in a single query. Products without a weight or volume
+        do not contribute to the respective total.
+        """
+        weight = Decimal('0')
+        volume = Decimal('0')
+
+        items = self.get_items().values_list('quantity', 'product__weight',
+                                             'product__volume')
+
+        for (quantity, item_weight, item_volume) in items:
+            if item_weight is not None:
+                weight += item_weight * quantity
+
+            if item_volume is not None:
+                volume += item_volume * quantity
+
+        return (weight, volume)
+
+
+class ShippingQuote(object):
+    """
+    Shipping costs for a cart or order and all of its items, as returned by
+    :meth:`CalculatedShippingOrderMixin.get_shipping_quote`. Iterating over
+    a quote yields an `(item, method, costs)` tuple for every item.
+    """
+
+    def __init__(self, order_method, order_costs, lines, parcels=None):
+        self.order_method = order_method
+        """ Shipping method for the whole order, or `None`. """
+
+        self.order_costs = order_costs
+        """ Shipping costs for the whole order. """
+
+        self.lines = lines
+        """ List of `(item, method, costs)` tuples. """
+
+        self.parcels = parcels or []
+        """
+        List of `(parcel, method, costs)` tuples when the order has been
+        packed into parcels, empty otherwise.
+        """
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def get_item_costs(self):
+        """ Return the sum of the shipping costs for all items. """
+        return sum_decimals([item_costs
+                             for (item, method, item_costs) in self.lines])
+
+    def get_total_costs(self):
+        """ Return the total shipping costs for order and items. """
+        return sum_decimals([self.order_costs, self.get_item_costs()])
+
+
+def get_method_costs(method):
+    """ Return the costs for `method`, which might be `None`. """
+    if method:
+        costs = method.get_cost()
+    else:
+        costs = Decimal('0.00')
+
+    return costs
+
+
 class CalculatedShippingItemMixin(object):
-    def get_shipping_method(self, **kwargs):
+    def get_shipping_method(self, item_price=None, **kwargs):
+        """
+        Return the shipping method for this item. When `item_price` is
+        specified, it is used instead of calculating the price.
+        """
         superclass = super(CalculatedShippingItemMixin, self)
 
-        price = self.get_price_without_shipping()
+        if item_price is None:
+            item_price = self.get_price_without_shipping()
 
         method = superclass.get_shipping_method(item_methods=True,
-                                                item_price=price)
+                                                item_price=item_price)
 
         return method
 
@@ -101,7 +242,6 @@ class CalculatedShippingItemMixin(object):
         method = self.get_shipping_method(**kwargs)
 
         if method:
-            costs = method.get_cost()
             logger.info(u'Shipping method %s found for object %s with args %s',
                         method, self, kwargs)
 
@@ -109,26 +249,73 @@ class CalculatedShippingItemMixin(object):
             logger.info(u'No shipping method found for kwargs %s and object %s',
                         kwargs, self)
 
-            costs = Decimal('0.00')
-
-        assert isinstance(costs, Decimal)
-
-        return costs
+        return get_method_costs(method)
 
 class CalculatedShippingOrderMixin(CalculatedShippingItemMixin):
-    def get_shipping_method(self, **kwargs):
+    def get_shipping_method(self, order_price=None, **kwargs):
+        """
+        Return the shipping method for the whole order. When `order_price`
+        is specified, it is used instead of calculating the price.
+        """
         superclass = super(CalculatedShippingItemMixin, self)
 
-        price = self.get_price_without_shipping()
+        if order_price is None:
+            order_price = self.get_price_without_shipping()
 
         method = superclass.get_shipping_method(order_methods=True,
-                                                order_price=price)
+                                                order_price=order_price)
 
         return method
 
     def get_order_shipping_costs(self, **kwargs):
-        superclass = super(CalculatedShippingOrderMixin, self)
-        return superclass.get_total_shipping_costs()
+        order_price = self.get_price_without_shipping()
+
+        return self.get_order_shipping(order_price)[1]
+
+    def get_shipping_quote(self, **kwargs):
+        """
+        Calculate the shipping methods and costs for the order and all of its
+        items in a single pass, returning a :class:`ShippingQuote`.
+
+        The price of every item is calculated only once. As the shipping
+        method for an item depends on its price and shipping parameters
+        only, items for which these are equal share a single lookup.
+        """
+
+        order_price = self.get_price_without_shipping()
+        (order_method, order_costs, parcels) = \
+            self.get_order_shipping(order_price)
+
+        methods = {}
+        lines = []
+        for item in self.get_items().select_related('product'):
+            item_price = item.get_price_without_shipping()
+
+            # Items with equal prices and parameters share their method
+            key = (item_price,
+                   tuple(sorted(item.get_shipping_parameters().items())))
+
+            if not key in methods:
+                methods[key] = item.get_shipping_method(item_price=item_price)
+
+            method = methods[key]
+            lines.append((item, method, get_method_costs(method)))
+
+        logger.debug(u'Shipping quote for %s: %s, %s',
+                     self, order_method, lines)
+
+        return ShippingQuote(order_method, order_costs, lines, parcels)
+
+    def get_order_shipping(self, order_price):
+        """
+        Return a tuple with the shipping method and costs for the whole
+        order and a list of `(parcel, method, costs)` tuples, which is empty
+        unless the order is packed into parcels.
+        """
+        order_method = CalculatedShippingOrderMixin.get_shipping_method(
+            self, order_price=order_price)
+
+        return (order_method, get_method_costs(order_method), [])
 
 
 class PersistentShippedItemBase(models.Model):
@@ -165,11 +352,112 @@ class PersistentShippedItemBase(models.Model):
         self.shipping_method = method
 
 
+class PackedShippingOrderMixin(object):
+    """
+    Mixin for carts and orders which are shipped in parcels under the
+    carrier limits in the settings. Every parcel is priced as an order of
+    its own through the shipping method chain, with the weight and volume
+    of the parcel. The products should be subclasses of
+    :class:`WeightedProductMixin`. List this class before
+    :class:`ShippedCartMixin` or :class:`ShippedOrderMixin`.
+    """
+
+    def get_parcels(self):
+        """
+        Return a list of :class:`Parcel
+        <shopkit.shipping.advanced.packing.Parcel>` objects with the pieces
+        of the items, referring to the items by their primary key.
+        """
+
+        lines = self.get_items().values_list('pk', 'quantity',
+                                             'product__weight',
+                                             'product__volume')
+
+        return get_parcels(lines)
+
+    def get_order_shipping(self, order_price):
+        """
+        Return a tuple with the shipping method of the first (heaviest)
+        parcel, the summed costs of all parcels and a list of
+        `(parcel, method, costs)` tuples.
+        """
+
+        prices = {}
+        for item in self.get_items():
+            prices[item.pk] = item.get_piece_price()
+
+        superclass = super(CalculatedShippingItemMixin, self)
+
+        parcels = []
+        for parcel in self.get_parcels():
+            parcel_price = sum_decimals([prices[item_pk] * count
+                                         for (item_pk, count) in parcel.contents])
+
+            method = superclass.get_shipping_method(
+                order_methods=True, order_price=parcel_price,
+                weight=parcel.weight, volume=parcel.volume)
+
+            if not method:
+                logger.warning(u'No shipping method found for parcel %s of %s',
+                               parcel, self)
+
+            parcel_costs = get_method_costs(method)
+            parcels.append((parcel, method, parcel_costs))
+
+        costs = sum_decimals([parcel_costs
+                              for (parcel, method, parcel_costs) in parcels])
+
+        if parcels:
+            order_method = parcels[0][1]
+        else:
+            order_method = None
+
+        return (order_method, costs, parcels)
+
+
 class ShippedCartMixin(CalculatedShippingOrderMixin, CheapestShippingMixin, ShippedCartBase):
     """ Base class for shopping carts with shippable items. """
     class Meta:
         abstract = True
 
+    def get_total_shipping_costs(self, **kwargs):
+        """
+        Get the total shipping costs for this `Cart`, summing up the
+        shipping costs for the whole order and those for individual items
+        as calculated by `get_shipping_quote`.
+        """
+        return self.get_shipping_quote(**kwargs).get_total_costs()
+
+    def get_fingerprint_parts(self):
+        """
+        Add the shipping parameters, ie. the country, and the version of
+        the shipping methods.
+        """
+        parts = super(ShippedCartMixin, self).get_fingerprint_parts()
+
+        parts.append(sorted(self.get_shipping_parameters().items()))
+        parts.append(get_version('shipping'))
+
+        return parts
+
+    def get_quote_data(self):
+        """
+        Add the shipping costs for the order and the `(item pk, method pk,
+        costs)` for every item.
+        """
+        data = super(ShippedCartMixin, self).get_quote_data()
+
+        quote = self.get_shipping_quote()
+
+        data['shipping_costs'] = quote.get_total_costs()
+        data['order_shipping_costs'] = quote.order_costs
+        data['order_shipping_method'] = getattr(quote.order_method, 'pk', None)
+        data['item_shipping'] = \
+            [(item.pk, getattr(method, 'pk', None), costs)
+             for (item, method, costs) in quote]
+
+        return data
+
 
 class ShippedCartItemMixin(CalculatedShippingItemMixin, CheapestShippingMixin, ShippedCartItemBase):
     """ Base class for shopping cart items which are shippable. """
@@ -186,6 +474,53 @@ class ShippedOrderMixin(PersistentShippedItemBase,
     class Meta:
         abstract = True
 
+    def update_shipping(self):
+        """
+        Update the shipping costs and methods for the order and its items
+        from a single :class:`ShippingQuote`. Changed items are written with
+        one `UPDATE` per distinct combination of costs and method rather than
+        one save per item. Like with :class:`ShippedOrderBase`, the order
+        itself is not saved.
+        """
+
+        assert self.pk, 'Object not saved, need PK for assigning method'
+
+        quote = self.get_shipping_quote()
+
+        self.order_shipping_costs = quote.order_costs
+        self.shipping_method = quote.order_method
+
+        logger.debug(u'Updating order shipping costs for %s to %s',
+                     self, self.order_shipping_costs)
+
+        orderitem_class = get_model_from_string(ORDERITEM_MODEL)
+
+        updates = {}
+        for (item, method, costs) in quote:
+            persist_method = hasattr(item, 'shipping_method_id')
+
+            if persist_method:
+                method_pk = getattr(method, 'pk', None)
+                changed = item.shipping_method_id != method_pk
+            else:
+                method_pk = None
+                changed = False
+
+            if changed or item.shipping_costs != costs:
+                key = (costs, persist_method, method_pk)
+                updates.setdefault(key, (method, []))[1].append(item.pk)
+
+        for ((costs, persist_method, method_pk), (method, pks)) in \
+                updates.items():
+            values = {'shipping_costs': costs}
+            if persist_method:
+                values['shipping_method'] = method
+
+            logger.debug(u'Updating shipping for order items %s to %s',
+                         pks, values)
+
+            orderitem_class.objects.filter(pk__in=pks).update(**values)
+
 
 class ShippedOrderItemMixin(PersistentShippedItemBase,
                             CalculatedShippingItemMixin,
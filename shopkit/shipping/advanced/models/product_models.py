@@ -0,0 +1,45 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import logging
+logger = logging.getLogger(__name__)
+
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class WeightedProductMixin(models.Model):
+    """
+    Mixin for products with a weight and volume, used to find valid
+    shipping methods.
+    """
+
+    class Meta:
+        abstract = True
+
+    weight = models.DecimalField(verbose_name=_('weight'),
+                                 max_digits=10, decimal_places=3,
+                                 blank=True, null=True,
+                                 help_text=_('Weight in kilograms.'))
+    """ Weight of a single product in kilograms. """
+
+    volume = models.DecimalField(verbose_name=_('volume'),
+                                 max_digits=10, decimal_places=3,
+                                 blank=True, null=True,
+                                 help_text=_('Volume in litres.'))
+    """ Volume of a single product in litres. """
@@ -23,17 +23,36 @@ from django.db import models
 from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 
+from shopkit.core.utils import get_model_from_string, implements_predicates
+from shopkit.core.utils.cache import bump_version, VersionedManager
+
+from shopkit.shipping.advanced.settings import ZONE_MODEL
+from shopkit.shipping.advanced.ratetable import get_rate_table
+from shopkit.shipping.advanced.zones import parse_countries, get_zone_index
+
 # Get the currently configured currency field, whatever it is
 from shopkit.currency.utils import get_currency_field
 PriceField = get_currency_field()
 
 
+class ShippingManager(VersionedManager):
+    """
+    Manager for shipping methods and zones, bumping the `shipping` version
+    upon bulk changes.
+    """
+
+    version_name = 'shipping'
+
+
 class ShippingMethodBase(models.Model):
     """ Base class for shipping methods. """
 
     class Meta:
         abstract = True
 
+    objects = ShippingManager()
+    """ Manager invalidating cached data upon bulk changes as well. """
+
     @classmethod
     def get_valid_methods(cls, **kwargs):
         """
@@ -43,21 +62,45 @@ class ShippingMethodBase(models.Model):
 
         return cls.objects.all()
 
-    def is_valid(self, **kwargs):
+    def check_valid(self, **kwargs):
         """
-        Check to see whether an individual method is valid under the
-        given circumstances.
+        Evaluate whether this method is valid for the given `kwargs` on the
+        instance itself, without querying the database. Every mixin
+        implementing `get_valid_methods` should implement the equivalent
+        predicate here. By default, all methods are valid.
         """
 
-        valid = self.get_valid_methods(**kwargs)
+        return True
+
+    def is_valid_query(self, **kwargs):
+        """
+        Check whether this method is part of the `QuerySet` returned by
+        `get_valid_methods` for the given `kwargs`.
+        """
 
         assert self.pk, \
         "This method has not yet been saved, which is required in order \
-         to determine it's validity (for now)."
+         to determine it's validity through the database."
 
-        valid.filter(pk=self.pk)
+        valid = self.get_valid_methods(**kwargs)
 
-        return valid.exists()
+        return valid.filter(pk=self.pk).exists()
+
+    def is_valid(self, **kwargs):
+        """
+        Check to see whether an individual method is valid under the
+        given circumstances.
+
+        When every mixin implementing `get_valid_methods` implements
+        `check_valid` as well, validity is evaluated on the instance without
+        queries. Otherwise, `is_valid_query` is used.
+        """
+
+        if implements_predicates(type(self), 'get_valid_methods',
+                                 'check_valid'):
+            return self.check_valid(**kwargs)
+
+        return self.is_valid_query(**kwargs)
 
 
     def get_cost(self, **kwargs):
@@ -68,6 +111,18 @@ class ShippingMethodBase(models.Model):
         """
         raise NotImplementedError
 
+    def save(self, *args, **kwargs):
+        """ Invalidate cached shipping data upon saving. """
+        super(ShippingMethodBase, self).save(*args, **kwargs)
+
+        bump_version('shipping')
+
+    def delete(self, *args, **kwargs):
+        """ Invalidate cached shipping data upon deletion. """
+        super(ShippingMethodBase, self).delete(*args, **kwargs)
+
+        bump_version('shipping')
+
 
 class OrderShippingMethodMixin(models.Model):
     """
@@ -108,6 +163,17 @@ class OrderShippingMethodMixin(models.Model):
 
         return valid
 
+    def check_valid(self, order_methods=None, **kwargs):
+        """ Instance equivalent of `get_valid_methods`. """
+        superclass = super(OrderShippingMethodMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        if not order_methods is None:
+            valid = valid and \
+                (self.order_cost is None) == (not order_methods)
+
+        return valid
+
     @classmethod
     def get_cheapest(self, **kwargs):
         """
@@ -175,6 +241,17 @@ class ItemShippingMethodMixin(models.Model):
 
         return valid
 
+    def check_valid(self, item_methods=None, **kwargs):
+        """ Instance equivalent of `get_valid_methods`. """
+        superclass = super(ItemShippingMethodMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        if not item_methods is None:
+            valid = valid and \
+                (self.item_cost is None) == (not item_methods)
+
+        return valid
+
     @classmethod
     def get_cheapest(self, **kwargs):
         """
@@ -242,6 +319,17 @@ class MinimumOrderAmountShippingMixin(models.Model):
 
         return valid
 
+    def check_valid(self, order_price=None, **kwargs):
+        """ Instance equivalent of `get_valid_methods`. """
+        superclass = super(MinimumOrderAmountShippingMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        if self.minimal_order_price is None:
+            return valid
+
+        return valid and bool(order_price) and \
+            self.minimal_order_price <= order_price
+
 
 class MinimumItemAmountShippingMixin(models.Model):
     """ Shipping mixin for methods valid only from a specified order amount. """
@@ -277,3 +365,238 @@ class MinimumItemAmountShippingMixin(models.Model):
             valid = valid.filter(minimal_item_price__isnull=True)
 
         return valid
+
+    def check_valid(self, item_price=None, **kwargs):
+        """ Instance equivalent of `get_valid_methods`. """
+        superclass = super(MinimumItemAmountShippingMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        if self.minimal_item_price is None:
+            return valid
+
+        return valid and bool(item_price) and \
+            self.minimal_item_price <= item_price
+
+
+class WeightShippingMethodMixin(models.Model):
+    """
+    Shipping mixin for methods valid only up to a maximal weight and/or
+    volume. Together with order or item costs, methods act as rate tiers:
+    the cheapest method with sufficient limits is used.
+    """
+
+    class Meta:
+        abstract = True
+
+    maximal_weight = models.DecimalField(verbose_name=_('maximal weight'),
+                                         max_digits=10, decimal_places=3,
+                                         blank=True, null=True, db_index=True)
+    """ Maximal weight in kilograms for which this method is valid. """
+
+    maximal_volume = models.DecimalField(verbose_name=_('maximal volume'),
+                                         max_digits=10, decimal_places=3,
+                                         blank=True, null=True, db_index=True)
+    """ Maximal volume in litres for which this method is valid. """
+
+    @classmethod
+    def get_valid_methods(cls, weight=None, volume=None, **kwargs):
+        """
+        Return shipping methods of which the maximal weight and volume are
+        not exceeded or for which no maximum has been specified.
+
+        :param weight: Weight of the current order or item.
+        :param volume: Volume of the current order or item.
+        """
+        superclass = super(WeightShippingMethodMixin, cls)
+
+        valid = superclass.get_valid_methods(**kwargs)
+
+        if not weight is None:
+            valid = valid.filter(Q(maximal_weight__gte=weight) | \
+                                 Q(maximal_weight__isnull=True))
+
+        if not volume is None:
+            valid = valid.filter(Q(maximal_volume__gte=volume) | \
+                                 Q(maximal_volume__isnull=True))
+
+        return valid
+
+    def check_valid(self, weight=None, volume=None, **kwargs):
+        """ Instance equivalent of `get_valid_methods`. """
+        superclass = super(WeightShippingMethodMixin, self)
+        valid = superclass.check_valid(**kwargs)
+
+        if not (weight is None or self.maximal_weight is None):
+            valid = valid and weight <= self.maximal_weight
+
+        if not (volume is None or self.maximal_volume is None):
+            valid = valid and volume <= self.maximal_volume
+
+        return valid
+
+
+class RateTableShippingMixin(models.Model):
+    """
+    Mixin for shipping methods which looks up the cheapest method in an
+    in-memory :class:`ShippingRateTable
+    <shopkit.shipping.advanced.ratetable.ShippingRateTable>` rather than
+    querying the database.
+
+    The table implements the validity rules of the order, item, minimum
+    amount, weight and zone mixins in this module. When `get_cheapest` is called with
+    any other arguments, the lookup is passed on to the regular
+    `get_valid_methods` chain. This class should be listed first among the
+    base classes of the shipping method model.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_cheapest(cls, order_methods=None, item_methods=None,
+                     order_price=None, item_price=None, country=None,
+                     weight=None, volume=None, **kwargs):
+        """
+        Return the cheapest order method if `order_methods` is specified,
+        the cheapest item method if `item_methods` is specified and
+        whatever the superclass returns otherwise.
+        """
+
+        if kwargs or not (order_methods or item_methods):
+            superclass = super(RateTableShippingMixin, cls)
+
+            return superclass.get_cheapest(order_methods=order_methods,
+                                           item_methods=item_methods,
+                                           order_price=order_price,
+                                           item_price=item_price,
+                                           country=country,
+                                           weight=weight, volume=volume,
+                                           **kwargs)
+
+        table = get_rate_table(cls)
+
+        if order_methods:
+            return table.get_cheapest('order', order_price, country,
+                                      weight, volume)
+        else:
+            return table.get_cheapest('item', item_price, country,
+                                      weight, volume)
+
+
+class ShippingZoneBase(models.Model):
+    """
+    Base class for shipping zones: named sets of countries to which
+    shipping methods can be limited.
+    """
+
+    class Meta:
+        abstract = True
+        verbose_name = _('shipping zone')
+        verbose_name_plural = _('shipping zones')
+
+    objects = ShippingManager()
+    """ Manager invalidating cached data upon bulk changes as well. """
+
+    name = models.CharField(max_length=255, verbose_name=_('name'))
+    """ Name of this zone. """
+
+    countries = models.TextField(verbose_name=_('countries'),
+        help_text=_('Comma separated list of ISO country codes.'))
+    """ Comma separated list of ISO country codes in this zone. """
+
+    def __unicode__(self):
+        return self.name
+
+    def get_country_codes(self):
+        """ Return a list of upper case country codes for this zone. """
+        return parse_countries(self.countries)
+
+    def save(self, *args, **kwargs):
+        """ Invalidate cached shipping data upon saving. """
+        super(ShippingZoneBase, self).save(*args, **kwargs)
+
+        bump_version('shipping')
+
+    def delete(self, *args, **kwargs):
+        """ Invalidate cached shipping data upon deletion. """
+        super(ShippingZoneBase, self).delete(*args, **kwargs)
+
+        bump_version('shipping')
+
+
+if ZONE_MODEL:
+    class ZoneShippingMethodMixin(models.Model):
+        """
+        Mixin for shipping methods valid only for the countries in a
+        shipping zone. Methods without a zone are valid for all countries.
+
+        Zones are looked up in a :class:`ShippingZoneIndex
+        <shopkit.shipping.advanced.zones.ShippingZoneIndex>`, so determining
+        the valid methods for a country does not join over zones. Combined
+        with :class:`RateTableShippingMixin`, finding the cheapest method
+        for a country requires no queries at all.
+        """
+
+        class Meta:
+            abstract = True
+
+        zone = models.ForeignKey(ZONE_MODEL, blank=True, null=True,
+                                 verbose_name=_('zone'))
+        """ Zone this method is limited to. """
+
+        @classmethod
+        def get_valid_methods(cls, country=None, **kwargs):
+            """
+            Return shipping methods valid for `country` or ones for which
+            no zone has been specified.
+
+            :param country: Country code or country object with a `code`
+                            for the current shipping address.
+            """
+            superclass = super(ZoneShippingMethodMixin, cls)
+
+            valid = superclass.get_valid_methods(**kwargs)
+
+            zones = None
+            if country:
+                zone_class = get_model_from_string(ZONE_MODEL)
+                zones = get_zone_index(zone_class).get_zones(country)
+
+            if zones:
+                valid = valid.filter(Q(zone__isnull=True) | \
+                                     Q(zone__in=zones))
+            else:
+                valid = valid.filter(zone__isnull=True)
+
+            return valid
+
+        def check_valid(self, country=None, **kwargs):
+            """ Instance equivalent of `get_valid_methods`. """
+            superclass = super(ZoneShippingMethodMixin, self)
+            valid = superclass.check_valid(**kwargs)
+
+            if self.zone_id is None:
+                return valid
+
+            if not country:
+                return False
+
+            zone_class = get_model_from_string(ZONE_MODEL)
+            zones = get_zone_index(zone_class).get_zones(country)
+
+            return valid and self.zone_id in zones
+
+        def get_countries(self):
+            """
+            Return the country codes for the zone of this method or `None`
+            when the method is valid for all countries.
+            """
+            if self.zone_id is None:
+                return None
+
+            zone_class = get_model_from_string(ZONE_MODEL)
+
+            return get_zone_index(zone_class).get_countries(self.zone_id)
+
+else:
+    logger.info(u'No shipping zone model defined, not loading zone shipping.')
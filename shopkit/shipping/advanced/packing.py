@@ -0,0 +1,202 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Packing of order items into parcels.
+
+Carriers limit the weight and volume of parcels and charge per parcel, so
+large orders are split over several parcels, each of which is priced
+separately. Items are packed with a first fit decreasing heuristic: the
+heaviest items are placed first, each into the first parcel with room
+left. As quantities are packed per item rather than per piece, large
+quantities do not slow packing down. A time budget bounds the work for
+orders with many distinct items.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import hashlib
+import time
+
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from shopkit.core.utils.cache import make_key
+
+from shopkit.shipping.advanced.settings import \
+    PARCEL_MAX_WEIGHT, PARCEL_MAX_VOLUME, \
+    PACKING_TIME_BUDGET, PACKING_CACHE_TIMEOUT
+
+
+def to_decimal(value):
+    """ Convert a limit from settings into a `Decimal`, keeping `None`. """
+    if value is None:
+        return None
+
+    return Decimal(str(value))
+
+
+class Parcel(object):
+    """
+    A parcel with contents, limited to a maximal weight and volume. The
+    contents are a list of `(key, count)` tuples, referring to the pieces
+    of items packed into this parcel.
+    """
+
+    def __init__(self, max_weight=None, max_volume=None):
+        self.max_weight = max_weight
+        self.max_volume = max_volume
+
+        self.contents = []
+        self.weight = Decimal('0')
+        self.volume = Decimal('0')
+
+    def __repr__(self):
+        return '<Parcel %r (%s, %s)>' % (self.contents,
+                                         self.weight, self.volume)
+
+    def get_capacity(self, weight=None, volume=None):
+        """
+        Return the number of pieces with the given `weight` and `volume`
+        which still fit into this parcel, or `None` if unlimited.
+        """
+
+        capacity = None
+
+        for (limit, used, size) in ((self.max_weight, self.weight, weight),
+                                    (self.max_volume, self.volume, volume)):
+            if limit is None or not size:
+                continue
+
+            fits = max(int((limit - used) // size), 0)
+
+            if capacity is None or fits < capacity:
+                capacity = fits
+
+        return capacity
+
+    def add(self, key, count, weight=None, volume=None):
+        """ Add `count` pieces with a `weight` and `volume` each. """
+        self.contents.append((key, count))
+
+        if weight:
+            self.weight += weight * count
+
+        if volume:
+            self.volume += volume * count
+
+
+def pack(lines, max_weight=None, max_volume=None, time_budget=None):
+    """
+    Pack `lines` of `(key, quantity, weight, volume)`, with the weight and
+    volume of a single piece, into a list of :class:`Parcel` objects.
+
+    Pieces which by themselves exceed the limits are shipped in a parcel
+    of their own. After `time_budget` seconds, pieces are only added to the
+    last parcel or new ones.
+    """
+
+    if time_budget:
+        deadline = time.time() + time_budget
+    else:
+        deadline = None
+
+    lines = sorted(lines, reverse=True,
+                   key=lambda line: (line[2] or 0, line[3] or 0))
+
+    parcels = []
+    for (key, quantity, weight, volume) in lines:
+        remaining = quantity
+
+        if deadline and time.time() > deadline:
+            candidates = parcels[-1:]
+        else:
+            candidates = parcels
+
+        for parcel in candidates:
+            if not remaining:
+                break
+
+            capacity = parcel.get_capacity(weight, volume)
+
+            if capacity is None:
+                count = remaining
+            else:
+                count = min(capacity, remaining)
+
+            if count:
+                parcel.add(key, count, weight, volume)
+                remaining -= count
+
+        while remaining:
+            parcel = Parcel(max_weight, max_volume)
+            parcels.append(parcel)
+
+            capacity = parcel.get_capacity(weight, volume)
+
+            if capacity is None:
+                count = remaining
+            else:
+                # Oversized pieces get a parcel of their own
+                count = min(max(capacity, 1), remaining)
+
+            parcel.add(key, count, weight, volume)
+            remaining -= count
+
+    logger.debug(u'Packed %d lines into %d parcels', len(lines), len(parcels))
+
+    return parcels
+
+
+def get_fingerprint(lines, max_weight=None, max_volume=None):
+    """
+    Return a fingerprint for packing `lines` with the given limits. As the
+    weight and volume are part of the lines, changes to products result in
+    a different fingerprint.
+    """
+
+    data = repr((sorted(lines), max_weight, max_volume))
+
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def get_parcels(lines):
+    """
+    Pack `lines` into parcels under the carrier limits from the settings.
+    Packings are cached by the fingerprint of the lines, so rendering the
+    same cart again does not repack it.
+    """
+
+    max_weight = to_decimal(PARCEL_MAX_WEIGHT)
+    max_volume = to_decimal(PARCEL_MAX_VOLUME)
+
+    lines = list(lines)
+
+    key = make_key('parcels',
+                   get_fingerprint(lines, max_weight, max_volume))
+
+    parcels = cache.get(key)
+
+    if parcels is None:
+        parcels = pack(lines, max_weight, max_volume, PACKING_TIME_BUDGET)
+
+        cache.set(key, parcels, PACKING_CACHE_TIMEOUT)
+
+    return parcels
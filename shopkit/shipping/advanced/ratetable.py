@@ -0,0 +1,233 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+In-memory shipping rate table.
+
+Shipping methods change rarely but the cheapest method is looked up for the
+order and for every item whenever a cart is rendered. The table in this
+module is compiled from all shipping methods once per process and answers
+these lookups with a bisection, without querying the database. It is
+recompiled whenever a shipping method is saved or deleted.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from bisect import bisect_right
+from decimal import Decimal
+
+from shopkit.core.utils.cache import VersionedCache
+
+
+NO_THRESHOLD = Decimal('-Infinity')
+""" Sort key for methods without a minimal price. """
+
+SCOPES = ('order', 'item')
+""" Scopes for which a method can have a cost. """
+
+
+def get_country_code(country):
+    """
+    Normalize a country, which can be either a model instance with a `code`
+    or a country code, to an upper case country code.
+    """
+    if country is None:
+        return None
+
+    code = getattr(country, 'code', country)
+
+    return unicode(code).upper()
+
+
+class ShippingRateTable(object):
+    """
+    Shipping methods compiled into a lookup table per scope (order or item)
+    and country. Every table holds the minimal prices (thresholds) of its
+    methods in ascending order and, for every threshold, the cheapest method
+    valid from that threshold on. The cheapest valid method for a given price
+    is then found by bisecting the thresholds.
+
+    The table mirrors the validity rules of
+    :class:`OrderShippingMethodMixin`, :class:`ItemShippingMethodMixin`,
+    :class:`MinimumOrderAmountShippingMixin` and
+    :class:`MinimumItemAmountShippingMixin`. Methods can be limited to
+    countries by implementing `get_countries()`, returning a list of country
+    codes or `None` for methods valid for all countries.
+
+    The maximal weights and volumes of :class:`WeightShippingMethodMixin`
+    are kept in arrays parallel to the thresholds. For lookups with a weight
+    or volume, the limits of all methods below the price threshold are
+    evaluated in a single pass over these arrays.
+    """
+
+    def __init__(self, methods):
+        """ Compile a table from an iterable of shipping `methods`. """
+
+        rows = {}
+        for method in methods:
+            if hasattr(method, 'get_countries'):
+                countries = method.get_countries()
+            else:
+                countries = None
+
+            if countries is None:
+                countries = [None]
+
+            for scope in SCOPES:
+                cost = getattr(method, '%s_cost' % scope, None)
+
+                if cost is None:
+                    continue
+
+                # A lookup for one scope does not pass the price for the
+                # other, so a minimum for the other scope is never met
+                for other in SCOPES:
+                    if other != scope and \
+                            getattr(method, 'minimal_%s_price' % other, None) \
+                            is not None:
+                        cost = None
+
+                if cost is None:
+                    continue
+
+                threshold = getattr(method, 'minimal_%s_price' % scope, None)
+                if threshold is None:
+                    threshold = NO_THRESHOLD
+
+                for country in countries:
+                    key = (scope, get_country_code(country))
+                    rows.setdefault(key, []).append((threshold, cost, method))
+
+        self.tables = {}
+        for ((scope, country), entries) in rows.items():
+            if country is not None:
+                # Methods for all countries are also valid for this one
+                entries = entries + rows.get((scope, None), [])
+
+            self.tables[(scope, country)] = self.compile(entries)
+
+        logger.debug(u'Compiled shipping rate table with %d tables',
+                     len(self.tables))
+
+    @staticmethod
+    def compile(entries):
+        """
+        Compile `(threshold, cost, method)` entries into a tuple with a list
+        of ascending thresholds, a list with, for every threshold, the
+        cheapest method with this or a lower threshold and a tuple of
+        parallel lists with the sort keys, maximal weights, maximal volumes
+        and methods of all entries.
+        """
+
+        entries = sorted(entries, key=lambda entry: entry[0])
+
+        thresholds = []
+        cheapest = []
+
+        keys = []
+        weights = []
+        volumes = []
+        methods = []
+
+        best = None
+        for (threshold, cost, method) in entries:
+            if best is None or (cost, method.pk) < (best[0], best[1].pk):
+                best = (cost, method)
+
+            thresholds.append(threshold)
+            cheapest.append(best[1])
+
+            keys.append((cost, method.pk))
+            weights.append(getattr(method, 'maximal_weight', None))
+            volumes.append(getattr(method, 'maximal_volume', None))
+            methods.append(method)
+
+        return (thresholds, cheapest, (keys, weights, volumes, methods))
+
+    @staticmethod
+    def select(candidates, count, weight=None, volume=None):
+        """
+        Return the cheapest of the first `count` `candidates` of which the
+        maximal weight and volume are not exceeded, or `None`.
+        """
+
+        (keys, weights, volumes, methods) = candidates
+
+        valid = [(key, index) for (index, key, max_weight, max_volume) in
+                    zip(range(count), keys, weights, volumes)
+                 if (weight is None or max_weight is None or
+                     weight <= max_weight) and
+                    (volume is None or max_volume is None or
+                     volume <= max_volume)]
+
+        if not valid:
+            return None
+
+        return methods[min(valid)[1]]
+
+    def get_cheapest(self, scope, price=None, country=None,
+                     weight=None, volume=None):
+        """
+        Return the cheapest method for `scope` valid for `price`, `country`,
+        `weight` and `volume`, or `None` if no method is valid.
+        """
+
+        country = get_country_code(country)
+
+        table = self.tables.get((scope, country), None)
+        if table is None:
+            table = self.tables.get((scope, None), None)
+
+            if table is None:
+                return None
+
+        (thresholds, cheapest, candidates) = table
+
+        # Without a price, only methods without a minimum are valid
+        if not price:
+            price = NO_THRESHOLD
+
+        index = bisect_right(thresholds, price)
+
+        if not index:
+            return None
+
+        if weight is None and volume is None:
+            return cheapest[index-1]
+
+        return self.select(candidates, index, weight, volume)
+
+
+_rate_tables = {}
+
+
+def get_rate_table(method_class):
+    """
+    Return the :class:`ShippingRateTable` for `method_class`, compiling it
+    when the shipping methods have changed.
+    """
+
+    key = (method_class._meta.app_label, method_class._meta.object_name)
+
+    if not key in _rate_tables:
+        loader = lambda: ShippingRateTable(method_class.objects.all())
+
+        _rate_tables[key] = VersionedCache('shipping', loader)
+
+    return _rate_tables[key].get()
@@ -21,3 +21,30 @@ from shopkit.shipping.settings import *
 
 SHIPPING_METHOD_MODEL = getattr(settings, 'SHOPKIT_SHIPPING_METHOD_MODEL')
 """ Model for shipping method. """
+
+ZONE_MODEL = getattr(settings, 'SHOPKIT_SHIPPING_ZONE_MODEL', None)
+"""
+Model for shipping zones. When specified, shipping methods can be limited
+to the countries of a zone.
+"""
+
+PARCEL_MAX_WEIGHT = getattr(settings, 'SHOPKIT_SHIPPING_PARCEL_MAX_WEIGHT', None)
+"""
+Maximal weight in kilograms of a single parcel, as imposed by the carrier.
+When `None`, parcels are not limited in weight.
+"""
+
+PARCEL_MAX_VOLUME = getattr(settings, 'SHOPKIT_SHIPPING_PARCEL_MAX_VOLUME', None)
+"""
+Maximal volume in litres of a single parcel, as imposed by the carrier.
+When `None`, parcels are not limited in volume.
+"""
+
+PACKING_TIME_BUDGET = getattr(settings, 'SHOPKIT_SHIPPING_PACKING_TIME_BUDGET', 0.1)
+"""
+Number of seconds spent on finding a dense packing. Once exceeded, the
+remaining items are packed into the last parcel or new ones only.
+"""
+
+PACKING_CACHE_TIMEOUT = getattr(settings, 'SHOPKIT_SHIPPING_PACKING_CACHE_TIMEOUT', 60*60)
+""" Number of seconds packings are kept in Django's cache. """
@@ -0,0 +1,99 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+from decimal import Decimal
+
+from django.conf import settings
+
+from shopkit.core.utils import get_model_from_string
+
+
+class AdvancedShippingTestMixin(object):
+    """
+    Base class for testing advanced shipping. Subclasses should implement
+    `make_methods` to create shipping methods covering the mixins used by
+    the `ShippingMethod` model of the project.
+    """
+
+    def setUp(self):
+        """
+        This makes the `ShippingMethod` class from the
+        `SHOPKIT_SHIPPING_METHOD_MODEL` available as `self.method_class`
+        for unittests to make use of.
+        """
+
+        super(AdvancedShippingTestMixin, self).setUp()
+
+        self.method_class = \
+            get_model_from_string(settings.SHOPKIT_SHIPPING_METHOD_MODEL)
+
+    def make_methods(self):
+        """
+        Abstract function for creating a list of saved test shipping
+        methods. As the actual properties of methods depend on the classes
+        actually implementing them, this function must be overridden in
+        subclasses.
+        """
+        raise NotImplementedError
+
+    def get_validity_kwargs(self):
+        """
+        Return a list of keyword arguments under which validity of the
+        test methods is checked. Subclasses can extend this, ie. with
+        countries.
+        """
+
+        return [
+            {},
+            {'order_methods': True},
+            {'order_methods': True, 'order_price': Decimal('10.00')},
+            {'order_methods': True, 'order_price': Decimal('1000.00')},
+            {'item_methods': True},
+            {'item_methods': True, 'item_price': Decimal('10.00')},
+            {'item_methods': False, 'item_price': Decimal('1000.00')},
+            {'order_methods': True, 'weight': Decimal('1.000'),
+             'volume': Decimal('1.000')},
+            {'order_methods': True, 'weight': Decimal('1000.000')},
+        ]
+
+    def test_is_valid_agrees(self):
+        """
+        Test whether `check_valid` and `is_valid_query` agree for all
+        test methods.
+        """
+
+        self.make_methods()
+
+        for method in self.method_class.objects.all():
+            for kwargs in self.get_validity_kwargs():
+                self.assertEqual(method.check_valid(**kwargs),
+                                 method.is_valid_query(**kwargs),
+                                 'Validity of %s differs for %s' % \
+                                    (method, kwargs))
+
+    def test_is_valid_queries(self):
+        """ Test whether `is_valid` runs no queries. """
+
+        self.make_methods()
+
+        methods = list(self.method_class.objects.all())
+
+        with self.assertNumQueries(0):
+            for method in methods:
+                for kwargs in self.get_validity_kwargs():
+                    method.is_valid(**kwargs)
@@ -0,0 +1,101 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+In-memory index of shipping zones.
+
+Zones are named sets of countries to which shipping methods can be limited.
+The index maps every country code to the zones containing it so that the
+methods valid for a shipping address can be determined without a join over
+zones and countries. It is rebuilt whenever a zone or shipping method is
+saved or deleted.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from shopkit.core.utils.cache import VersionedCache
+
+from shopkit.shipping.advanced.ratetable import get_country_code
+
+
+def parse_countries(countries):
+    """
+    Parse a comma separated string of country codes into a list of upper
+    case country codes.
+    """
+    codes = []
+
+    for code in (countries or u'').split(','):
+        code = code.strip()
+
+        if code:
+            codes.append(get_country_code(code))
+
+    return codes
+
+
+class ShippingZoneIndex(object):
+    """
+    Lookup from country codes to zone ids and vice versa, compiled from
+    an iterable of zones implementing `get_country_codes()`.
+    """
+
+    def __init__(self, zones):
+        self.zone_countries = {}
+        self.country_zones = {}
+
+        for zone in zones:
+            codes = zone.get_country_codes()
+
+            self.zone_countries[zone.pk] = codes
+
+            for code in codes:
+                self.country_zones.setdefault(code, set()).add(zone.pk)
+
+        logger.debug(u'Compiled shipping zone index for %d zones',
+                     len(self.zone_countries))
+
+    def get_zones(self, country):
+        """ Return a frozenset with the ids of all zones for `country`. """
+        code = get_country_code(country)
+
+        return frozenset(self.country_zones.get(code, ()))
+
+    def get_countries(self, zone_id):
+        """ Return a list with the country codes for the zone `zone_id`. """
+        return self.zone_countries.get(zone_id, [])
+
+
+_zone_indexes = {}
+
+
+def get_zone_index(zone_class):
+    """
+    Return the :class:`ShippingZoneIndex` for `zone_class`, compiling it
+    when zones have changed.
+    """
+
+    key = (zone_class._meta.app_label, zone_class._meta.object_name)
+
+    if not key in _zone_indexes:
+        loader = lambda: ShippingZoneIndex(zone_class.objects.all())
+
+        _zone_indexes[key] = VersionedCache('shipping', loader)
+
+    return _zone_indexes[key].get()
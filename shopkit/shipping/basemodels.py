@@ -24,6 +24,8 @@ from decimal import Decimal
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
+from shopkit.currency.money import sum_decimals
+
 # Get the currently configured currency field, whatever it is
 from shopkit.currency.utils import get_currency_field
 PriceField = get_currency_field()
@@ -139,14 +141,12 @@ class ShippedOrderBase(ShippedItemBase):
         costs for the whole order and those for individual items (where
         applicable).
         """
-        costs = self.get_order_shipping_costs()
+        costs = [self.get_order_shipping_costs()]
 
         for item in self.get_items():
-            item_costs = item.get_shipping_costs()
-            assert isinstance(item_costs, Decimal)
-            costs += item_costs
+            costs.append(item.get_shipping_costs())
 
-        return costs
+        return sum_decimals(costs)
 
     def update_shipping(self):
         """ Update the shipping costs for order and order items. """
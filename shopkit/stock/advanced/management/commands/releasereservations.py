@@ -0,0 +1,47 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopkit.stock.advanced.models import get_reservation_class
+from shopkit.stock.advanced.settings import RESERVATION_SWEEP_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Release the stock held by expired reservations. Run this ' \
+           'periodically, ie. every few minutes.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=RESERVATION_SWEEP_CHUNK_SIZE,
+                    help='Number of reservations deleted per query.'),
+    )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('Invalid chunk size: %s' % chunk_size)
+
+        reservation_class = get_reservation_class()
+
+        released = reservation_class.release_expired(chunk_size=chunk_size)
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Released %d expired reservations\n' % released)
@@ -19,9 +19,19 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from django.db import models
+import datetime
+
+from django.db import models, transaction, connections, IntegrityError
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from shopkit.core.settings import CART_MODEL
+from shopkit.core.utils import get_model_from_string
+
+from shopkit.stock.advanced.settings import \
+    STOCKED_ITEM_MODEL, RESERVATION_MODEL, RESERVATION_TTL, \
+    RESERVATION_SWEEP_CHUNK_SIZE
+from shopkit.stock.exceptions import NoStockAvailableException
 from shopkit.stock.models import \
     StockedCartItemBase, StockedCartBase, StockedOrderItemBase, \
     StockedOrderBase, StockedItemBase
@@ -49,26 +59,54 @@ class StockedOrderItemMixin(StockedItemBase, StockedOrderItemBase):
     def confirm(self):
         """
         Register lowering of the current item's stock.
-        """
 
-        super(StockedOrderItemMixin, self).confirm()
+        The stock is decremented with a single conditional `UPDATE` by
+        :meth:`StockedItemMixin.decrement_stock`, which raises
+        :class:`NoStockAvailableException` when another order has taken the
+        remaining stock in the meanwhile.
+
+        At this point the order has already been marked as confirmed, so
+        the exception aborts a partially applied confirmation. Use this
+        class together with :class:`StockedOrderMixin`, which performs the
+        confirmation in a transaction that is rolled back in that case.
+        """
 
         stocked_item = self.get_stocked_item()
 
-        logger.debug(u'Lowering stock of %d for %s with %d',
-                     stocked_item.stock,
-                     stocked_item,
-                     self.quantity)
+        logger.debug(u'Lowering stock for %s with %d',
+                     stocked_item, self.quantity)
 
-        stocked_item.stock -= self.quantity
-        stocked_item.save()
+        stocked_item.decrement_stock(self.quantity)
+
+        # Skip the availability assertion in `StockedOrderItemBase`
+        super(StockedOrderItemBase, self).confirm()
 
 
 class StockedOrderMixin(StockedOrderBase):
     """
     Mixin class for `Order`'s containing items for which stock is kept.
     """
-    pass
+
+    def confirm(self):
+        """
+        Confirm the order within a transaction. When the stock for one of
+        the items is no longer available, :class:`NoStockAvailableException`
+        is raised and the confirmation, the deletion of the cart and the
+        stock decrements of earlier items are rolled back.
+
+        As the instance itself is not restored, reload the order from the
+        database after such a failure.
+
+        Up to Django 1.5, `commit_on_success` does not nest: it commits
+        when leaving the block, including any changes made before in a
+        transaction managed by the caller. Do not call this method within
+        a transaction of which the changes should be rolled back later on.
+
+        :raises: NoStockAvailableException
+        """
+
+        with transaction.commit_on_success(using=self._state.db):
+            super(StockedOrderMixin, self).confirm()
 
 
 class StockedItemMixin(models.Model, StockedItemBase):
@@ -97,3 +135,317 @@ class StockedItemMixin(models.Model, StockedItemBase):
 
         return False
 
+    def get_decrement_queryset(self, quantity):
+        """
+        Return a `QuerySet` matching this item only when `quantity` can be
+        taken from its stock.
+        """
+        return self.__class__._default_manager.filter(pk=self.pk,
+                                                      stock__gte=quantity)
+
+    def decrement_stock(self, quantity):
+        """
+        Atomically lower the stock by `quantity` with a single
+        `UPDATE ... SET stock = stock - quantity WHERE stock >= quantity`,
+        without saving any other fields.
+
+        :raises: NoStockAvailableException
+        """
+        assert self.pk, 'Object not saved, cannot decrement stock'
+
+        qs = self.get_decrement_queryset(quantity)
+        updated = qs.update(stock=models.F('stock') - quantity)
+
+        if not updated:
+            logger.info(u'Not enough stock for %s to decrement with %d',
+                        self, quantity)
+
+            raise NoStockAvailableException(item=self)
+
+        # Reflect the change without reading the row back
+        self.stock -= quantity
+
+
+def get_reservation_class():
+    """ Return the model class holding stock for shopping carts. """
+    assert RESERVATION_MODEL, \
+        'SHOPKIT_STOCK_RESERVATION_MODEL should be set to reserve stock.'
+
+    return get_model_from_string(RESERVATION_MODEL)
+
+
+class ReservationBase(models.Model):
+    """
+    Abstract base class for stock held for a shopping cart until `expires`.
+    Reserved quantities are not available to other carts, so limited items
+    are not oversold when orders are confirmed.
+    """
+
+    class Meta:
+        abstract = True
+        verbose_name = _('reservation')
+        verbose_name_plural = _('reservations')
+        unique_together = ('cart', 'stocked_item')
+
+    cart = models.ForeignKey(CART_MODEL, related_name='reservations',
+                             verbose_name=_('cart'))
+    """
+    Cart the stock is held for. Reservations are deleted along with their
+    cart, ie. when confirming an order.
+    """
+
+    stocked_item = models.ForeignKey(STOCKED_ITEM_MODEL,
+                                     related_name='reservations',
+                                     verbose_name=_('stocked item'))
+    """ Item stock is held of. """
+
+    quantity = models.PositiveIntegerField(verbose_name=_('quantity'))
+    """ Quantity held. """
+
+    expires = models.DateTimeField(db_index=True, verbose_name=_('expires'))
+    """ Date and time after which the stock is released. """
+
+    def __unicode__(self):
+        return _(u'%(quantity)d of %(item)s until %(expires)s') % {
+            'quantity': self.quantity,
+            'item': self.stocked_item,
+            'expires': self.expires
+        }
+
+    @classmethod
+    def get_active(cls, stocked_item, exclude_cart=None):
+        """
+        Return a `QuerySet` with the unexpired reservations for
+        `stocked_item`, excluding those for `exclude_cart`.
+        """
+        qs = cls.objects.filter(stocked_item=stocked_item,
+                                expires__gt=timezone.now())
+
+        if exclude_cart is not None and exclude_cart.pk:
+            qs = qs.exclude(cart=exclude_cart)
+
+        return qs
+
+    @classmethod
+    def get_reserved_quantity(cls, stocked_item, exclude_cart=None):
+        """
+        Return the total quantity of `stocked_item` held for carts other
+        than `exclude_cart`, using a single aggregate query.
+        """
+        qs = cls.get_active(stocked_item, exclude_cart)
+
+        return qs.aggregate(models.Sum('quantity'))['quantity__sum'] or 0
+
+    @classmethod
+    def get_expires(cls):
+        """ Return the expiry for reservations made or renewed now. """
+        return timezone.now() + datetime.timedelta(seconds=RESERVATION_TTL)
+
+    @classmethod
+    def renew(cls, cart):
+        """
+        Renew the expiry of all reservations for `cart` with a single
+        query.
+        """
+        expires = cls.get_expires()
+
+        logger.debug(u'Renewing reservations for %s until %s', cart, expires)
+
+        cls.objects.filter(cart=cart).update(expires=expires)
+
+    @classmethod
+    def reserve(cls, cart, stocked_item, quantity):
+        """
+        Hold `quantity` of `stocked_item` for `cart`, replacing any earlier
+        reservation, and renew the expiry of all reservations for `cart`.
+        A `quantity` of 0 releases the reservation.
+        """
+        if not quantity:
+            cls.release(cart, stocked_item)
+            cls.renew(cart)
+            return
+
+        expires = cls.get_expires()
+
+        logger.debug(u'Reserving %d of %s for %s until %s',
+                     quantity, stocked_item, cart, expires)
+
+        cls.objects.filter(cart=cart).update(expires=expires)
+
+        updated = cls.objects.filter(cart=cart, stocked_item=stocked_item)\
+                             .update(quantity=quantity)
+
+        if not updated:
+            reservation = cls(cart=cart, stocked_item=stocked_item,
+                              quantity=quantity, expires=expires)
+
+            # Another request might have created the reservation meanwhile
+            using = cls.objects.db
+            sid = transaction.savepoint(using=using)
+            try:
+                reservation.save(force_insert=True, using=using)
+                transaction.savepoint_commit(sid, using=using)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid, using=using)
+
+                cls.objects.filter(cart=cart, stocked_item=stocked_item)\
+                           .update(quantity=quantity, expires=expires)
+
+    @classmethod
+    def release(cls, cart, stocked_item=None):
+        """
+        Release the stock held for `cart`, optionally for `stocked_item`
+        only.
+        """
+        qs = cls.objects.filter(cart=cart)
+
+        if stocked_item is not None:
+            qs = qs.filter(stocked_item=stocked_item)
+
+        qs.delete()
+
+    @classmethod
+    def release_expired(cls, chunk_size=RESERVATION_SWEEP_CHUNK_SIZE):
+        """
+        Delete expired reservations in chunks of `chunk_size`, keeping
+        transactions and locks short. Returns the number of reservations
+        deleted.
+        """
+        now = timezone.now()
+        expired = cls.objects.filter(expires__lte=now)
+
+        released = 0
+        while True:
+            pks = list(expired.values_list('pk', flat=True)[:chunk_size])
+
+            if not pks:
+                break
+
+            cls.objects.filter(pk__in=pks).delete()
+            released += len(pks)
+
+        logger.info(u'Released %d expired reservations', released)
+
+        return released
+
+
+class ReservedStockItemMixin(object):
+    """
+    Mixin for stocked items, preceding :class:`StockedItemMixin`, for which
+    the quantity held for shopping carts is not available.
+    """
+
+    def get_available_stock(self, cart=None):
+        """
+        Return the stock not held for carts other than `cart`.
+        """
+        reservation_class = get_reservation_class()
+
+        reserved = reservation_class.get_reserved_quantity(self,
+                                                           exclude_cart=cart)
+
+        return self.stock - reserved
+
+    def is_available(self, quantity, cart=None):
+        """
+        Determine whether `quantity` is available, not counting the stock
+        held for `cart`.
+        """
+        logger.debug(u'Checking whether quantity %d of %s is available',
+                     quantity, self)
+
+        return self.get_available_stock(cart) >= quantity
+
+    def get_decrement_queryset(self, quantity):
+        """
+        Only match this item when `quantity` can be taken from the stock
+        not held by active reservations. The reserved quantity is summed in
+        a subquery, so the decrement remains a single conditional `UPDATE`.
+
+        The reservations of the cart being confirmed should have been
+        released beforehand, as :class:`ReservingOrderMixin` does.
+        """
+        qs = super(ReservedStockItemMixin, self).get_decrement_queryset(
+            quantity)
+
+        reservation_class = get_reservation_class()
+        opts = reservation_class._meta
+        qn = connections[qs.db].ops.quote_name
+
+        sql = '%(stock)s - (SELECT COALESCE(SUM(%(quantity)s), 0) ' \
+              'FROM %(table)s WHERE %(item)s = %(pk)s ' \
+              'AND %(expires)s > %%s) >= %%s' % {
+                  'stock': '%s.%s' % (qn(self._meta.db_table),
+                                      qn(self._meta.get_field('stock').column)),
+                  'pk': '%s.%s' % (qn(self._meta.db_table),
+                                   qn(self._meta.pk.column)),
+                  'table': qn(opts.db_table),
+                  'quantity': qn(opts.get_field('quantity').column),
+                  'item': qn(opts.get_field('stocked_item').column),
+                  'expires': qn(opts.get_field('expires').column)
+              }
+
+        return qs.extra(where=[sql], params=[timezone.now(), quantity])
+
+
+class ReservingCartItemMixin(StockedCartItemMixin):
+    """
+    Mixin class for `CartItem`'s of which stock is held for the cart.
+    """
+
+    def is_available(self, quantity):
+        """ Determine availability, disregarding stock held for this cart. """
+        return self.get_stocked_item().is_available(quantity, cart=self.cart)
+
+    def save(self, *args, **kwargs):
+        """
+        Hold the stock for the current quantity of this item and renew the
+        other reservations for the cart.
+        """
+        super(ReservingCartItemMixin, self).save(*args, **kwargs)
+
+        get_reservation_class().reserve(self.cart, self.get_stocked_item(),
+                                        self.quantity)
+
+    def delete(self, *args, **kwargs):
+        """ Release the stock held for this item. """
+        get_reservation_class().release(self.cart, self.get_stocked_item())
+
+        super(ReservingCartItemMixin, self).delete(*args, **kwargs)
+
+
+class ReservingCartMixin(StockedCartMixin):
+    """
+    Mixin class for `Cart`'s holding stock for their items for
+    `RESERVATION_TTL` seconds. The stock is held when saving the items, see
+    :class:`ReservingCartItemMixin`.
+    """
+
+    def renew_reservations(self):
+        """ Renew the expiry of the stock held for this cart. """
+        get_reservation_class().renew(self)
+
+
+class ReservingOrderItemMixin(StockedOrderItemMixin):
+    """
+    Mixin class for `OrderItem`'s of which the stock has been held for the
+    cart the order was created from.
+    """
+
+    def is_available(self, quantity):
+        """ Determine availability, disregarding stock held for our cart. """
+        return self.get_stocked_item().is_available(quantity,
+                                                    cart=self.order.cart)
+
+
+class ReservingOrderMixin(StockedOrderMixin):
+    """
+    Mixin class for `Order`'s converting the stock held for their cart into
+    a decrement of the stock upon confirmation.
+
+    The reservations for the cart are deleted along with the cart by
+    `OrderBase.confirm`, before the stock is decremented. The decrement
+    therefore only has to respect the stock held for other carts. As this
+    happens in the transaction of :class:`StockedOrderMixin`, a failing
+    decrement restores the reservations.
+    """
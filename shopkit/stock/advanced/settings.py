@@ -16,3 +16,32 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+from django.conf import settings
+
+from shopkit.core.settings import PRODUCT_MODEL
+
+
+STOCKED_ITEM_MODEL = getattr(settings, 'SHOPKIT_STOCKED_ITEM_MODEL', PRODUCT_MODEL)
+"""
+Model keeping stock, ie. a subclass of :class:`StockedItemMixin
+<shopkit.stock.advanced.models.StockedItemMixin>`. Defaults to the
+product model.
+"""
+
+RESERVATION_MODEL = getattr(settings, 'SHOPKIT_STOCK_RESERVATION_MODEL', None)
+"""
+(Optional) Model holding stock for shopping carts. Should be a subclass of
+:class:`ReservationBase <shopkit.stock.advanced.models.ReservationBase>`.
+"""
+
+RESERVATION_TTL = getattr(settings, 'SHOPKIT_STOCK_RESERVATION_TTL', 900)
+"""
+Number of seconds stock is held for a shopping cart after adding an item.
+Defaults to 15 minutes.
+"""
+
+RESERVATION_SWEEP_CHUNK_SIZE = getattr(settings, 'SHOPKIT_STOCK_RESERVATION_SWEEP_CHUNK_SIZE', 1000)
+"""
+Number of expired reservations deleted per query when releasing expired
+reservations. Defaults to 1000.
+"""
@@ -16,3 +16,128 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+
+import datetime
+
+from django.utils import timezone
+
+from shopkit.stock.advanced.models import get_reservation_class
+from shopkit.stock.exceptions import NoStockAvailableException
+
+
+class ReservationTestMixin(object):
+    """
+    Base class for testing stock reservations. Like `CoreTestMixin`, it
+    should be subclassed with implementations of `make_stocked_item` and
+    `make_cart` for the models used by the project.
+    """
+
+    def setUp(self):
+        """ Make the reservation class available as `reservation_class`. """
+        super(ReservationTestMixin, self).setUp()
+
+        self.reservation_class = get_reservation_class()
+
+    def make_stocked_item(self, stock):
+        """
+        Abstract function returning a saved product with `stock` items in
+        stock, which can be added to carts.
+        """
+        raise NotImplementedError
+
+    def make_cart(self):
+        """ Abstract function returning a saved, empty cart. """
+        raise NotImplementedError
+
+    def test_reservation_reduces_availability(self):
+        """ Stock held for a cart is unavailable for other carts. """
+        item = self.make_stocked_item(stock=5)
+        cart = self.make_cart()
+        other = self.make_cart()
+
+        cart.add_item(item, 3)
+
+        self.assertEqual(item.get_available_stock(cart), 5)
+        self.assertEqual(item.get_available_stock(other), 2)
+        self.assert_(not item.is_available(3, cart=other))
+
+    def test_save_syncs_quantity(self):
+        """ Saving a cart item updates the quantity held. """
+        item = self.make_stocked_item(stock=5)
+        cart = self.make_cart()
+
+        cartitem = cart.add_item(item, 1)
+        cartitem.quantity = 4
+        cartitem.save()
+
+        self.assertEqual(
+            self.reservation_class.get_reserved_quantity(item), 4)
+
+        cartitem.delete()
+
+        self.assertEqual(
+            self.reservation_class.get_reserved_quantity(item), 0)
+
+    def test_renew_reservations(self):
+        """ Renewing updates the expiry of all reservations for a cart. """
+        cart = self.make_cart()
+        cart.add_item(self.make_stocked_item(stock=5), 1)
+        cart.add_item(self.make_stocked_item(stock=5), 1)
+
+        past = timezone.now() - datetime.timedelta(seconds=1)
+        self.reservation_class.objects.filter(cart=cart).update(expires=past)
+
+        cart.renew_reservations()
+
+        active = self.reservation_class.objects.filter(
+            cart=cart, expires__gt=timezone.now())
+        self.assertEqual(active.count(), 2)
+
+    def test_release_expired(self):
+        """ Expired reservations are removed. """
+        cart = self.make_cart()
+        item = self.make_stocked_item(stock=5)
+        cart.add_item(item, 2)
+
+        past = timezone.now() - datetime.timedelta(seconds=1)
+        self.reservation_class.objects.filter(cart=cart).update(expires=past)
+
+        self.reservation_class.release_expired()
+
+        self.assert_(not self.reservation_class.objects.filter(cart=cart))
+        self.assertEqual(item.get_available_stock(), 5)
+
+    def test_cart_deletion_releases(self):
+        """ Reservations are deleted along with their cart. """
+        item = self.make_stocked_item(stock=5)
+        cart = self.make_cart()
+        cart.add_item(item, 2)
+
+        cart.delete()
+
+        self.assertEqual(
+            self.reservation_class.get_reserved_quantity(item), 0)
+
+    def test_single_reservation(self):
+        """ Reserving again replaces the reservation for a cart item. """
+        item = self.make_stocked_item(stock=5)
+        cart = self.make_cart()
+
+        self.reservation_class.reserve(cart, item, 1)
+        self.reservation_class.reserve(cart, item, 3)
+
+        reservations = self.reservation_class.objects.filter(cart=cart)
+        self.assertEqual(reservations.count(), 1)
+        self.assertEqual(reservations[0].quantity, 3)
+
+    def test_decrement_respects_reservations(self):
+        """ Stock held for other carts cannot be decremented. """
+        item = self.make_stocked_item(stock=5)
+        self.make_cart().add_item(item, 4)
+
+        self.assertRaises(NoStockAvailableException,
+                          item.decrement_stock, 2)
+
+        item.decrement_stock(1)
+
+        self.assertEqual(item.__class__.objects.get(pk=item.pk).stock, 4)
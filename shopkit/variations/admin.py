@@ -22,12 +22,11 @@ logger = logging.getLogger(__name__)
 from django.contrib import admin
 
 from shopkit.variations.settings import PRODUCTVARIATION_MODEL
-from shopkit.core.utils import get_model_from_string
-productvariation_class = get_model_from_string(PRODUCTVARIATION_MODEL)
+from shopkit.core.utils import LazyModel
 
 
 class ProductVariationInline(admin.TabularInline):
     """ Inline admin for product variations. """
 
-    model = productvariation_class
+    model = LazyModel(PRODUCTVARIATION_MODEL)
     extra = 0
\ No newline at end of file
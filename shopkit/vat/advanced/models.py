@@ -16,3 +16,346 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+
+import logging
+logger = logging.getLogger(__name__)
+
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+
+from shopkit.core.exceptions import AlreadyConfirmedException
+from shopkit.core.settings import ORDER_MODEL
+from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils.cache import bump_version, VersionedManager
+from shopkit.core.utils.fields import PercentageField
+
+from shopkit.currency.money import sum_decimals
+
+from shopkit.vat.advanced.rates import \
+    VATBreakdown, get_vat_resolver, get_country_code
+from shopkit.vat.advanced.settings import \
+    ORDER_VAT_MODEL, VAT_DEFAULT_COUNTRY, VAT_DEFAULT_TAX_CLASS
+
+# Get the currently configured currency field, whatever it is
+from shopkit.currency.utils import get_currency_field
+PriceField = get_currency_field()
+
+
+class VATRateManager(VersionedManager):
+    """ Manager for VAT rates, bumping the `vat` version on bulk changes. """
+
+    version_name = 'vat'
+
+
+class VATRateBase(models.Model):
+    """
+    Base class for VAT rates for a country and tax class, valid during a
+    period. Saving or deleting a rate recompiles the cached
+    :class:`VATRateResolver <shopkit.vat.advanced.rates.VATRateResolver>`
+    in all processes.
+    """
+
+    class Meta:
+        abstract = True
+        verbose_name = _('VAT rate')
+        verbose_name_plural = _('VAT rates')
+
+    objects = VATRateManager()
+    """ Manager invalidating cached data upon bulk changes as well. """
+
+    country = models.CharField(max_length=2, blank=True,
+                               verbose_name=_('country'),
+        help_text=_('ISO country code, leave empty for all countries.'))
+    """ ISO code of the country this rate applies to. """
+
+    tax_class = models.CharField(max_length=32, db_index=True,
+                                 default=VAT_DEFAULT_TAX_CLASS,
+                                 verbose_name=_('tax class'))
+    """ Tax class of the products this rate applies to. """
+
+    rate = PercentageField(decimal_places=2, max_digits=5,
+                           verbose_name=_('rate'))
+    """ VAT percentage. """
+
+    start_date = models.DateField(blank=True, null=True,
+                                  verbose_name=_('start date'))
+    """ First day this rate is valid, or `None` for no limit. """
+
+    end_date = models.DateField(blank=True, null=True,
+                                verbose_name=_('end date'))
+    """ Last day this rate is valid, or `None` for no limit. """
+
+    def __unicode__(self):
+        return u'%s%% %s %s' % (self.rate, self.country, self.tax_class)
+
+    def clean(self):
+        """
+        Make sure the period of this rate does not overlap with that of
+        another rate for the same country and tax class.
+        """
+        super(VATRateBase, self).clean()
+
+        if self.start_date and self.end_date and \
+                self.start_date > self.end_date:
+            raise ValidationError(
+                _('The start date should precede the end date.'))
+
+        overlapping = self.__class__._default_manager.filter(
+            country=get_country_code(self.country), tax_class=self.tax_class)
+
+        if self.pk:
+            overlapping = overlapping.exclude(pk=self.pk)
+
+        if self.start_date:
+            overlapping = overlapping.filter(
+                Q(end_date__isnull=True) | Q(end_date__gte=self.start_date))
+
+        if self.end_date:
+            overlapping = overlapping.filter(
+                Q(start_date__isnull=True) | Q(start_date__lte=self.end_date))
+
+        if overlapping.exists():
+            raise ValidationError(
+                _('Another rate for this country and tax class is valid '
+                  'during this period.'))
+
+    def save(self, *args, **kwargs):
+        """ Invalidate cached VAT rates upon saving. """
+        self.country = get_country_code(self.country)
+
+        super(VATRateBase, self).save(*args, **kwargs)
+
+        bump_version('vat')
+
+    def delete(self, *args, **kwargs):
+        """ Invalidate cached VAT rates upon deletion. """
+        super(VATRateBase, self).delete(*args, **kwargs)
+
+        bump_version('vat')
+
+
+class TaxClassProductMixin(models.Model):
+    """ Mixin for products belonging to a tax class. """
+
+    class Meta:
+        abstract = True
+
+    tax_class = models.CharField(max_length=32,
+                                 default=VAT_DEFAULT_TAX_CLASS,
+                                 verbose_name=_('tax class'))
+    """ Tax class determining the VAT rate for this product. """
+
+    def get_tax_class(self):
+        """ Return the tax class of this product. """
+        return self.tax_class
+
+
+class CalculatedVATMixin(object):
+    """
+    Mixin for carts and orders calculating the VAT over all of their items
+    in a single pass, using the cached
+    :class:`VATRateResolver <shopkit.vat.advanced.rates.VATRateResolver>`.
+    """
+
+    def get_vat_country(self):
+        """
+        Return the country VAT is due in: the country of the shipping
+        address, or `VAT_DEFAULT_COUNTRY`.
+        """
+        shipping_address = getattr(self, 'shipping_address', None)
+
+        if shipping_address and shipping_address.country:
+            return shipping_address.country
+
+        return VAT_DEFAULT_COUNTRY
+
+    def get_vat_date(self):
+        """ Return the date determining the VAT rates. """
+        return date.today()
+
+    def get_vat_lines(self):
+        """
+        Return a list of `(tax_class, amount)` tuples for all items VAT is
+        calculated over.
+        """
+        lines = []
+
+        for item in self.get_items().select_related('product'):
+            get_tax_class = getattr(item.product, 'get_tax_class', None)
+
+            if get_tax_class:
+                tax_class = get_tax_class()
+            else:
+                tax_class = VAT_DEFAULT_TAX_CLASS
+
+            lines.append((tax_class, item.get_price()))
+
+        return lines
+
+    def calculate_vat(self):
+        """
+        Calculate the VAT for all items, returning a
+        :class:`VATBreakdown <shopkit.vat.advanced.rates.VATBreakdown>`.
+        """
+        resolver = get_vat_resolver()
+
+        return resolver.calculate(self.get_vat_lines(),
+                                  self.get_vat_country(),
+                                  self.get_vat_date())
+
+    def get_vat_breakdown(self):
+        """ Return the VAT per rate. """
+        return self.calculate_vat()
+
+    def get_vat(self):
+        """ Return the total amount of VAT. """
+        return self.get_vat_breakdown().get_total_vat()
+
+    def get_price_with_vat(self, **kwargs):
+        """ Return the price including VAT. """
+        return sum_decimals([self.get_price(**kwargs), self.get_vat()])
+
+
+class VATCartMixin(CalculatedVATMixin):
+    """ Mixin for carts with calculated VAT. """
+    pass
+
+
+class VATOrderMixin(CalculatedVATMixin):
+    """
+    Mixin for orders with calculated VAT, using the rates valid on the
+    date the order was placed.
+    """
+
+    def get_vat_date(self):
+        """ Return the date this order was placed. """
+        if self.date_added:
+            return self.date_added.date()
+
+        return date.today()
+
+
+class OrderVATBase(models.Model):
+    """
+    Abstract base class for storing the VAT of an order per rate. Rows are
+    written by :class:`PersistentVATOrderMixin` upon confirmation, so
+    invoices never recalculate VAT and VAT returns can be reported using
+    the aggregations in :mod:`shopkit.vat.advanced.reporting`.
+    """
+
+    class Meta:
+        abstract = True
+        verbose_name = _('order VAT')
+        verbose_name_plural = _('order VAT')
+
+    order = models.ForeignKey(ORDER_MODEL, related_name='vat_rates',
+                              verbose_name=_('order'))
+    """ Order this VAT is due for. """
+
+    date = models.DateField(db_index=True, verbose_name=_('date'))
+    """ Date the VAT has been calculated for, used for reporting. """
+
+    country = models.CharField(max_length=2, blank=True, db_index=True,
+                               verbose_name=_('country'))
+    """ ISO code of the country the VAT is due in. """
+
+    rate = PercentageField(decimal_places=2, max_digits=5,
+                           verbose_name=_('rate'))
+    """ VAT percentage. """
+
+    net = PriceField(verbose_name=_('net amount'))
+    """ Amount the VAT has been calculated over. """
+
+    vat = PriceField(verbose_name=_('VAT'))
+    """ Amount of VAT. """
+
+    def __unicode__(self):
+        return _(u'%(rate)s%% VAT over %(net)s: %(vat)s') % {
+            'rate': self.rate,
+            'net': self.net,
+            'vat': self.vat
+        }
+
+
+class PersistentVATOrderMixin(VATOrderMixin):
+    """
+    Mixin for orders storing their VAT breakdown as `ORDER_VAT_MODEL` rows
+    upon confirmation. Confirmed orders return the stored breakdown.
+    """
+
+    @classmethod
+    def get_order_vat_class(cls):
+        """ Return the model class for storing VAT per rate. """
+        assert ORDER_VAT_MODEL, \
+            'SHOPKIT_VAT_ORDER_VAT_MODEL should be set to persist VAT.'
+
+        return get_model_from_string(ORDER_VAT_MODEL)
+
+    def update_vat(self):
+        """
+        Recalculate the VAT for this order and replace the stored rows with
+        a single delete and a single `bulk_create`. Transactions are left
+        to the caller.
+        """
+        assert self.pk, 'Object not saved, need PK for storing VAT'
+
+        vat_class = self.get_order_vat_class()
+
+        day = self.get_vat_date()
+        breakdown = get_vat_resolver().calculate(self.get_vat_lines(),
+                                                 self.get_vat_country(), day)
+
+        rows = [vat_class(order=self, date=day, country=breakdown.country,
+                          rate=rate, net=net, vat=vat)
+                for (rate, net, vat) in breakdown]
+
+        logger.debug(u'Storing %d VAT rates for %s', len(rows), self)
+
+        vat_class.objects.filter(order=self).delete()
+        vat_class.objects.bulk_create(rows)
+
+        return breakdown
+
+    def get_vat_breakdown(self):
+        """
+        Return the stored VAT breakdown for confirmed orders, or calculate
+        it for other orders.
+        """
+        if not self.confirmed:
+            return self.calculate_vat()
+
+        vat_class = self.get_order_vat_class()
+
+        rows = vat_class.objects.filter(order=self).order_by('rate')
+        rates = [(row.rate, row.net, row.vat) for row in rows]
+
+        if rates:
+            country = rows[0].country
+        else:
+            country = get_country_code(self.get_vat_country())
+
+        return VATBreakdown(country, rates)
+
+    def confirm(self):
+        """
+        Confirm the order and store its VAT breakdown. The stored breakdown
+        is never recalculated, so confirming the order again raises
+        :class:`AlreadyConfirmedException` before anything is written.
+
+        List this class after :class:`StockedOrderMixin
+        <shopkit.stock.advanced.models.StockedOrderMixin>` among the base
+        classes of the order, such that the breakdown is stored within the
+        transaction of the confirmation.
+
+        :raises: AlreadyConfirmedException
+        """
+        if self.confirmed:
+            raise AlreadyConfirmedException(self)
+
+        super(PersistentVATOrderMixin, self).confirm()
+
+        self.update_vat()
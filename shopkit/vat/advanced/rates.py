@@ -0,0 +1,208 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+In-memory resolution of VAT rates.
+
+All rates from the `VAT_RATE_MODEL` table are compiled into a
+:class:`VATRateResolver`, indexed by country and tax class with the
+validity periods of the rates sorted by start date. The resolver is
+cached in every process and recompiled only when rates have changed, so
+calculating the VAT for all lines of a cart or order requires no queries.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from bisect import bisect_right
+from datetime import date
+
+from shopkit.core.utils import get_model_from_string
+from shopkit.core.utils.cache import VersionedCache
+
+from shopkit.currency.money import round_decimal, sum_decimals
+from shopkit.vat.advanced.settings import VAT_RATE_MODEL
+
+
+def get_country_code(country):
+    """
+    Normalize a country, which can be either a model instance with a `code`
+    or a country code, to an upper case country code.
+    """
+    if not country:
+        return u''
+
+    code = getattr(country, 'code', country)
+
+    return unicode(code).upper()
+
+
+class VATBreakdown(object):
+    """
+    VAT for a set of lines, grouped per rate. `rates` is a list of
+    `(rate, net, vat)` tuples with `Decimal` amounts, ordered by rate.
+    """
+
+    def __init__(self, country, rates):
+        self.country = country
+        self.rates = rates
+
+    def __iter__(self):
+        return iter(self.rates)
+
+    def __len__(self):
+        return len(self.rates)
+
+    def get_total_net(self):
+        """ Return the total amount VAT has been calculated over. """
+        return sum_decimals([net for (rate, net, vat) in self.rates])
+
+    def get_total_vat(self):
+        """ Return the total amount of VAT. """
+        return sum_decimals([vat for (rate, net, vat) in self.rates])
+
+
+class VATRateResolver(object):
+    """
+    Lookup of the VAT rate for a country, tax class and date, compiled
+    from an iterable of `(country, tax_class, rate, start_date, end_date)`
+    tuples. Rates without a country apply to all countries without
+    specific rates for a tax class.
+    """
+
+    def __init__(self, rates):
+        periods = {}
+        for (country, tax_class, rate, start_date, end_date) in rates:
+            key = (get_country_code(country), tax_class)
+
+            periods.setdefault(key, []).append(
+                (start_date or date.min, end_date or date.max, rate))
+
+        self.index = {}
+        for (key, entries) in periods.items():
+            entries.sort()
+
+            starts = [start for (start, end, rate) in entries]
+            self.index[key] = (starts, entries)
+
+        # Memoized results of `get_rate()`
+        self._rates = {}
+
+        logger.debug(u'Compiled VAT rates for %d countries and tax classes',
+                     len(self.index))
+
+    def _find_rate(self, key, day):
+        """
+        Return the rate for `key` valid on `day`, or `None`. Should periods
+        overlap, the one starting last takes precedence.
+        """
+        if not key in self.index:
+            return None
+
+        (starts, entries) = self.index[key]
+
+        position = bisect_right(starts, day) - 1
+        while position >= 0:
+            (start, end, rate) = entries[position]
+            if end >= day:
+                return rate
+
+            position -= 1
+
+        return None
+
+    def get_rate(self, country, tax_class, day=None):
+        """
+        Return the VAT rate as a percentage for `country` and `tax_class`
+        on `day`, which defaults to today, or `None` when no rate applies.
+        """
+        if day is None:
+            day = date.today()
+
+        key = (get_country_code(country), tax_class, day)
+
+        try:
+            return self._rates[key]
+        except KeyError:
+            pass
+
+        rate = self._find_rate(key[:2], day)
+        if rate is None:
+            rate = self._find_rate((u'', tax_class), day)
+
+        if rate is None:
+            logger.debug(u'No VAT rate for tax class %s in %s on %s',
+                         tax_class, country, day)
+
+        self._rates[key] = rate
+
+        return rate
+
+    def calculate(self, lines, country, day=None):
+        """
+        Calculate the VAT for `lines`, an iterable of `(tax_class, amount)`
+        tuples, in a single pass. Amounts are summed per rate before VAT is
+        calculated, so rounding happens once per rate. Lines without an
+        applicable rate are left out.
+
+        Returns a :class:`VATBreakdown`.
+        """
+        if day is None:
+            day = date.today()
+
+        country = get_country_code(country)
+
+        totals = {}
+        for (tax_class, amount) in lines:
+            rate = self.get_rate(country, tax_class, day)
+
+            if rate is None:
+                continue
+
+            totals.setdefault(rate, []).append(amount)
+
+        rates = []
+        for rate in sorted(totals.keys()):
+            net = sum_decimals(totals[rate])
+            vat = round_decimal(net*rate/100)
+
+            rates.append((rate, net, vat))
+
+        return VATBreakdown(country, rates)
+
+
+def _load_resolver():
+    """ Read all VAT rates from the database. """
+    assert VAT_RATE_MODEL, \
+        'SHOPKIT_VAT_RATE_MODEL should be set to calculate VAT.'
+
+    rate_class = get_model_from_string(VAT_RATE_MODEL)
+
+    return VATRateResolver(rate_class.objects.values_list(
+        'country', 'tax_class', 'rate', 'start_date', 'end_date'))
+
+
+_resolver = VersionedCache('vat', _load_resolver)
+
+
+def get_vat_resolver():
+    """
+    Return the current :class:`VATRateResolver`, recompiling it when VAT
+    rates have changed.
+    """
+    return _resolver.get()
@@ -0,0 +1,145 @@
+# Copyright (C) 2010-2011 Mathijs de Bruin <mathijs@mathijsfietst.nl>
+#
+# This file is part of django-shopkit.
+#
+# django-shopkit is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+"""
+Aggregated VAT reporting over confirmed orders.
+
+The VAT of confirmed orders is stored per rate as `ORDER_VAT_MODEL` rows
+by :class:`PersistentVATOrderMixin
+<shopkit.vat.advanced.models.PersistentVATOrderMixin>`. Totals per period,
+country and rate are aggregated from these rows with a single `GROUP BY`
+query, without loading any orders.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import csv
+
+from django.db import connections
+from django.db.models import Sum, Count
+
+from shopkit.core.utils import get_model_from_string
+
+from shopkit.vat.advanced.settings import ORDER_VAT_MODEL
+
+
+PERIODS = ('day', 'month', 'year')
+""" Periods VAT totals can be grouped by. """
+
+REPORT_FIELDS = ('period', 'country', 'rate', 'orders', 'net', 'vat')
+""" Columns of VAT reports. """
+
+
+def get_order_vat_class():
+    """ Return the model class storing VAT per order and rate. """
+    assert ORDER_VAT_MODEL, \
+        'SHOPKIT_VAT_ORDER_VAT_MODEL should be set for VAT reporting.'
+
+    return get_model_from_string(ORDER_VAT_MODEL)
+
+
+def get_vat_totals(start_date=None, end_date=None, country=None, rate=None,
+                   period='month'):
+    """
+    Return a `ValuesQuerySet` with the number of orders and the total net
+    amount and VAT per `period`, country and rate. Rows are dictionaries
+    with the keys in `REPORT_FIELDS`.
+
+    :param start_date: First day to include.
+    :param end_date: Last day to include.
+    :param country: Only include VAT due in this country.
+    :param rate: Only include VAT at this rate.
+    :param period: One of `PERIODS`, or `None` to total the whole range.
+    """
+    vat_class = get_order_vat_class()
+
+    # Rows of orders of which the confirmation failed do not count
+    qs = vat_class.objects.filter(order__confirmed=True)
+
+    if start_date:
+        qs = qs.filter(date__gte=start_date)
+
+    if end_date:
+        qs = qs.filter(date__lte=end_date)
+
+    if country:
+        qs = qs.filter(country=country.upper())
+
+    if rate is not None:
+        qs = qs.filter(rate=rate)
+
+    group_by = ['country', 'rate']
+
+    if period:
+        assert period in PERIODS, 'Unknown period %s' % period
+
+        connection = connections[qs.db]
+        ops = connection.ops
+        column = '%s.%s' % (ops.quote_name(vat_class._meta.db_table),
+                            ops.quote_name('date'))
+
+        # Truncation yields a timestamp, report the date only
+        if connection.vendor == 'sqlite':
+            sql = 'date(%s)'
+        else:
+            sql = 'CAST(%s AS DATE)'
+
+        sql = sql % ops.date_trunc_sql(period, column)
+
+        qs = qs.extra(select={'period': sql})
+        group_by.insert(0, 'period')
+
+    qs = qs.values(*group_by).annotate(orders=Count('order', distinct=True),
+                                       net=Sum('net'), vat=Sum('vat'))
+
+    return qs.order_by(*group_by)
+
+
+class Echo(object):
+    """ File-like object returning written values, for streaming CSV. """
+
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    """ Encode `value` for the Python 2 `csv` module. """
+    if value is None:
+        return ''
+
+    if hasattr(value, 'date') and callable(value.date):
+        value = value.date()
+
+    return unicode(value).encode('utf-8')
+
+
+def iter_csv(totals):
+    """
+    Generate the lines of a CSV file for the rows in `totals`, as returned
+    by :func:`get_vat_totals`, without building the file in memory.
+    """
+    writer = csv.writer(Echo())
+
+    fields = [field for field in REPORT_FIELDS
+              if field != 'period' or field in totals.query.extra_select]
+
+    yield writer.writerow(fields)
+
+    for row in totals.iterator():
+        yield writer.writerow([_encode(row.get(field)) for field in fields])
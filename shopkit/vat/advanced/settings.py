@@ -16,3 +16,28 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+from django.conf import settings
+
+
+VAT_RATE_MODEL = getattr(settings, 'SHOPKIT_VAT_RATE_MODEL', None)
+"""
+Model holding VAT rates per country, tax class and period. Should be a
+subclass of :class:`VATRateBase <shopkit.vat.advanced.models.VATRateBase>`.
+"""
+
+ORDER_VAT_MODEL = getattr(settings, 'SHOPKIT_VAT_ORDER_VAT_MODEL', None)
+"""
+(Optional) Model storing the VAT breakdown per rate for orders. Should be
+a subclass of :class:`OrderVATBase <shopkit.vat.advanced.models.OrderVATBase>`.
+"""
+
+VAT_DEFAULT_COUNTRY = getattr(settings, 'SHOPKIT_VAT_DEFAULT_COUNTRY', None)
+"""
+ISO country code for which VAT is calculated when a cart or order has
+no shipping address, usually the country the shop is established in.
+"""
+
+VAT_DEFAULT_TAX_CLASS = getattr(settings, 'SHOPKIT_VAT_DEFAULT_TAX_CLASS', 'standard')
+"""
+Tax class for products which do not specify one. Defaults to `standard`.
+"""
@@ -16,3 +16,86 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import logging
+logger = logging.getLogger(__name__)
+
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.http import HttpResponse
+from django.views.generic import View
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5, regular responses accept iterators as well
+    StreamingHttpResponse = HttpResponse
+
+from shopkit.vat.advanced.reporting import get_vat_totals, iter_csv, PERIODS
+
+
+class VATReportCSVView(View):
+    """
+    View streaming aggregated VAT totals as CSV. The period, country and
+    rate are taken from the `start_date`, `end_date` (both `YYYY-MM-DD`),
+    `country`, `rate` and `period` GET parameters.
+
+    As this view exposes financial data, make sure to restrict access,
+    ie. by wrapping it with `staff_member_required`.
+    """
+
+    date_format = '%Y-%m-%d'
+    filename = 'vat.csv'
+
+    def get_date(self, name):
+        """ Parse the date in GET parameter `name`, if any. """
+        value = self.request.GET.get(name)
+
+        if not value:
+            return None
+
+        try:
+            return datetime.strptime(value, self.date_format).date()
+        except ValueError:
+            logger.warning(u'Ignoring invalid %s %r in VAT report',
+                           name, value)
+            return None
+
+    def get_rate(self):
+        """ Parse the `rate` GET parameter, if any. """
+        value = self.request.GET.get('rate')
+
+        if not value:
+            return None
+
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            logger.warning(u'Ignoring invalid rate %r in VAT report', value)
+            return None
+
+    def get_filters(self):
+        """ Return the keyword arguments for `get_vat_totals()`. """
+        period = self.request.GET.get('period', 'month')
+        if not period in PERIODS:
+            period = None
+
+        return {
+            'start_date': self.get_date('start_date'),
+            'end_date': self.get_date('end_date'),
+            'country': self.request.GET.get('country') or None,
+            'rate': self.get_rate(),
+            'period': period
+        }
+
+    def get_totals(self):
+        """ Return the aggregated VAT totals to export. """
+        return get_vat_totals(**self.get_filters())
+
+    def get(self, request, *args, **kwargs):
+        response = StreamingHttpResponse(iter_csv(self.get_totals()),
+                                         content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename=%s' % self.filename
+
+        return response
@@ -16,7 +16,10 @@
 # along with this program; if not, write to the Free Software Foundation,
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+from decimal import Decimal
+
 from shopkit.core.basemodels import AbstractPricedItemBase
+from shopkit.currency.money import round_decimal
 
 from shopkit.vat.simple.settings import VAT_PERCENTAGE, VAT_DEFAULT_DISPLAY
 
@@ -35,13 +38,15 @@ class VATItemBase(AbstractPricedItemBase):
     class Meta:
        abstract = True
 
-    def get_vat(**kwargs):
+    def get_vat(self, **kwargs):
         """ Gets the amount of VAT for the current item. """
 
         kwargs.update({'with_vat': False})
-        return self.get_price(**kwargs) * 0.01 * VAT_PERCENTAGE
+        vat = self.get_price(**kwargs)*Decimal(str(VAT_PERCENTAGE))/100
+
+        return round_decimal(vat)
 
-    def get_price(with_vat=VAT_DEFAULT_DISPLAY, **kwargs):
+    def get_price(self, with_vat=VAT_DEFAULT_DISPLAY, **kwargs):
         """ If `with_vat=False`, simply returns the original price. Otherwise
             it takes the result of `get_vat()` and adds it to the original price. """
 
@@ -55,7 +60,7 @@ class VATItemBase(AbstractPricedItemBase):
 
         return price_without
 
-    def get_price_with_vat(**kwargs):
+    def get_price_with_vat(self, **kwargs):
         """ Gets the price including VAT. This is a wrapper function around
             get_price as to allow for specific prices to be queried from within
             templates. """
@@ -64,7 +69,7 @@ class VATItemBase(AbstractPricedItemBase):
 
         return self.get_price(**kwargs)
 
-    def get_price_without_vat(**kwargs):
+    def get_price_without_vat(self, **kwargs):
         """ Gets the price excluding VAT. This is a wrapper function around
             get_price as to allow for specific prices to be queried from within
             templates. """